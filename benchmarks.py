@@ -0,0 +1,496 @@
+"""Benchmarks for the CAPTCHA create/verify hot paths.
+
+    python benchmarks.py                     # run and print the results
+    python benchmarks.py -o baseline.json    # also save them as JSON
+    python benchmarks.py -c baseline.json    # compare, exit 1 on regression
+    python benchmarks.py -k jwt -c base.json # only benchmarks matching 'jwt'
+
+Every benchmark reports its per call latency (median/min/max of several
+rounds) and the peak memory allocated by a single call (tracemalloc). The
+startup benchmarks time importing the package (and a first verify) in a new
+interpreter, the scaling benchmarks measure the throughput of create_many
+worker processes and of threads sharing one CAPTCHA (on free-threaded
+builds too). The comparison fails when the median latency or the peak
+allocation grew by more than the thresholds, e.g. when a dependency upgrade
+silently makes hashing a thousand times slower.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import sysconfig
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from flask_simple_captcha import CAPTCHA, DEFAULT_CONFIG
+from flask_simple_captcha.img import (
+    IMG_MIMETYPES,
+    convert_b64img,
+    create_text_img,
+    draw_lines,
+)
+from flask_simple_captcha.noise import NoiseBank
+from flask_simple_captcha.text import CAPTCHA_FONTS
+from flask_simple_captcha.utils import (
+    HASH_BACKENDS,
+    gen_captcha_text,
+    jwtdecrypt,
+    jwtencrypt,
+)
+
+RESULTS_VERSION = 1
+LATENCY_THRESHOLD = 0.25  # fail on a median latency 25% above the baseline
+ALLOC_THRESHOLD = 0.25  # fail on a peak allocation 25% above the baseline
+ALLOC_SLACK = 4096  # bytes of allocation growth always tolerated
+
+SECRET = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY']
+# seeded, every run renders the same captchas
+CONFIGS = {
+    'default': {'RANDOM_SEED': 0},
+    'fast': {
+        'RANDOM_SEED': 0,
+        'CAPTCHA_HASH_BACKEND': 'blake2b',
+        'CAPTCHA_TOKEN_FORMAT': 'compact',
+    },
+}
+
+# a benchmark is a function to time and a factory of the arguments of n calls
+Benchmark = Tuple[Callable, Callable[[int], List[tuple]]]
+BENCHMARKS = {}  # type: Dict[str, Callable[[], Benchmark]]
+
+
+def benchmark(name: str):
+    """Register a factory returning (function, make_args)"""
+
+    def register(factory):
+        BENCHMARKS[name] = factory
+        return factory
+
+    return register
+
+
+def no_args(n: int) -> List[tuple]:
+    return [()] * n
+
+
+@benchmark('utils.gen_captcha_text')
+def _gen_text():
+    return gen_captcha_text, no_args
+
+
+@benchmark('img.create_text_img')
+def _create_text_img():
+    path = CAPTCHA_FONTS[0].path
+    return create_text_img, lambda n: [('ABCDEF', path)] * n
+
+
+@benchmark('img.create_text_img[noise_bank]')
+def _create_text_img_bank():
+    path, bank = CAPTCHA_FONTS[0].path, NoiseBank(refresh=None)
+    return (
+        lambda text, path: create_text_img(text, path, noise_bank=bank),
+        lambda n: [('ABCDEF', path)] * n,
+    )
+
+
+@benchmark('img.CaptchaRenderer.render')
+def _renderer_render():
+    renderer = CAPTCHA({**DEFAULT_CONFIG, **CONFIGS['default']}).renderer
+    return renderer.render, lambda n: [('ABCDEF',)] * n
+
+
+@benchmark('img.draw_lines')
+def _draw_lines():
+    return draw_lines, lambda n: [(Image.new('RGB', (180, 60)),)] * n
+
+
+for _fmt in IMG_MIMETYPES:
+
+    @benchmark('img.convert_b64img[%s]' % _fmt)
+    def _convert_b64img(fmt=_fmt):
+        img = create_text_img('ABCDEF', CAPTCHA_FONTS[0].path)
+        return convert_b64img, lambda n: [(img, fmt)] * n
+
+
+for _backend in ('werkzeug',) + tuple(HASH_BACKENDS):
+
+    @benchmark('utils.jwtencrypt[%s]' % _backend)
+    def _jwtencrypt(backend=_backend):
+        return jwtencrypt, lambda n: [('ABCDEF', SECRET, 600, backend)] * n
+
+    @benchmark('utils.jwtdecrypt[%s]' % _backend)
+    def _jwtdecrypt(backend=_backend):
+        token = jwtencrypt('ABCDEF', SECRET, 600, backend)
+        return jwtdecrypt, lambda n: [(token, 'ABCDEF', SECRET)] * n
+
+
+for _name, _config in CONFIGS.items():
+
+    @benchmark('CAPTCHA.create[%s]' % _name)
+    def _create(config=_config):
+        return CAPTCHA({**DEFAULT_CONFIG, **config}).create, no_args
+
+    @benchmark('CAPTCHA.verify[%s]' % _name)
+    def _verify(config=_config):
+        captcha = CAPTCHA({**DEFAULT_CONFIG, **config})
+
+        def make_args(n):
+            # every token verifies once, the next attempt is a replay
+            texts = [captcha.gen_text() for _ in range(n)]
+            return [(text, captcha.encrypt(text)) for text in texts]
+
+        return captcha.verify, make_args
+
+
+# startup benchmarks run in a fresh interpreter each time
+STARTUP = {
+    'startup.import': 'import flask_simple_captcha',
+    'startup.verify': (
+        'import flask_simple_captcha as fsc\n'
+        "cap = fsc.CAPTCHA({'CAPTCHA_TOKEN_FORMAT': 'compact'})\n"
+        "cap.verify('ABC', cap.encrypt('ABC'))"
+    ),
+}
+STARTUP_RUNNER = '''
+import json, sys, time, tracemalloc
+if sys.argv[1] == 'alloc':
+    tracemalloc.start()
+start = time.perf_counter()
+exec(sys.argv[2])
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, tracemalloc.get_traced_memory()[1]]))
+'''
+
+
+def run_startup(code: str, alloc: bool = False) -> Tuple[float, int]:
+    """(seconds, peak allocated bytes) of running code in a new process"""
+    out = subprocess.run(
+        [sys.executable, '-c', STARTUP_RUNNER, 'alloc' if alloc else '', code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    seconds, peak = json.loads(out)
+    return seconds, peak
+
+
+def time_calls(
+    func: Callable, make_args: Callable, min_time: float, rounds: int
+) -> dict:
+    """Time func over rounds of enough calls to take about min_time each"""
+    args = make_args(1)[0]
+    start = time.perf_counter()
+    func(*args)  # warms up caches and measures the number of calls needed
+    once = time.perf_counter() - start
+    calls = max(1, min(10000, int(min_time / max(once, 1e-7))))
+
+    per_call = []
+    for _ in range(rounds):
+        all_args = make_args(calls)
+        start = time.perf_counter()
+        for args in all_args:
+            func(*args)
+        per_call.append((time.perf_counter() - start) / calls)
+
+    return {
+        'median_us': statistics.median(per_call) * 1e6,
+        'min_us': min(per_call) * 1e6,
+        'max_us': max(per_call) * 1e6,
+        'calls': calls,
+        'rounds': rounds,
+    }
+
+
+def peak_alloc(func: Callable, make_args: Callable, repeat: int = 3) -> int:
+    """Smallest peak of memory allocated during a single call, in bytes"""
+    peaks = []
+    for args in make_args(repeat):
+        tracemalloc.start()
+        try:
+            func(*args)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    return min(peaks)
+
+
+def run_benchmarks(
+    names: List[str], min_time: float = 0.2, rounds: int = 5
+) -> dict:
+    results = {}
+    for name in names:
+        func, make_args = BENCHMARKS[name]()
+        result = time_calls(func, make_args, min_time, rounds)
+        result['peak_alloc_bytes'] = peak_alloc(func, make_args)
+        results[name] = result
+        print(
+            '%-36s %12.1f us %12d B'
+            % (name, result['median_us'], result['peak_alloc_bytes']),
+            file=sys.stderr,
+        )
+    return results
+
+
+def run_startup_benchmarks(names: List[str], rounds: int = 5) -> dict:
+    results = {}
+    for name in names:
+        per_run = [run_startup(STARTUP[name])[0] for _ in range(rounds)]
+        results[name] = {
+            'median_us': statistics.median(per_run) * 1e6,
+            'min_us': min(per_run) * 1e6,
+            'max_us': max(per_run) * 1e6,
+            'calls': 1,
+            'rounds': rounds,
+            'peak_alloc_bytes': run_startup(STARTUP[name], alloc=True)[1],
+        }
+        print(
+            '%-36s %12.1f us %12d B'
+            % (
+                name,
+                results[name]['median_us'],
+                results[name]['peak_alloc_bytes'],
+            ),
+            file=sys.stderr,
+        )
+    return results
+
+
+def run_scaling(n_per_worker: int = 40, max_workers: int = None) -> list:
+    """Throughput of create_many with 1, 2, 4 ... CPU count workers"""
+    cpus = max_workers or os.cpu_count() or 1
+    counts = sorted({min(2**i, cpus) for i in range(cpus.bit_length() + 1)})
+    captcha = CAPTCHA({**DEFAULT_CONFIG, **CONFIGS['fast']})
+    scaling = []
+    try:
+        for workers in counts:
+            captcha.create_many(workers, workers=workers)  # start the workers
+            n = n_per_worker * workers
+            start = time.perf_counter()
+            captcha.create_many(n, workers=workers)
+            per_sec = n / (time.perf_counter() - start)
+            scaling.append({'workers': workers, 'per_sec': per_sec})
+    finally:
+        captcha.close_workers()
+
+    return report_scaling(scaling, 'workers')
+
+
+def run_threads(n_per_thread: int = 50, max_threads: int = None) -> list:
+    """Throughput of create() + verify() from 1, 2, 4 ... CPU count threads
+    sharing one CAPTCHA, raises RuntimeError if a captcha fails to verify
+    """
+    cpus = max_threads or os.cpu_count() or 1
+    counts = sorted({min(2**i, cpus) for i in range(cpus.bit_length() + 1)})
+    captcha = CAPTCHA({**DEFAULT_CONFIG, **CONFIGS['fast']})
+    captcha.create()  # set up the fonts
+
+    def work(barrier, failures):
+        barrier.wait()
+        for _ in range(n_per_thread):
+            c = captcha.create()
+            if not captcha.verify(c['text'], c['hash']):
+                failures.append(c['hash'])
+
+    scaling = []
+    for threads in counts:
+        barrier, failures = threading.Barrier(threads + 1), []
+        pool = [
+            threading.Thread(target=work, args=(barrier, failures))
+            for _ in range(threads)
+        ]
+        for thread in pool:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in pool:
+            thread.join()
+        per_sec = n_per_thread * threads / (time.perf_counter() - start)
+        if failures:
+            raise RuntimeError(
+                '%d of %d captchas failed to verify with %d threads'
+                % (len(failures), n_per_thread * threads, threads)
+            )
+        scaling.append({'threads': threads, 'per_sec': per_sec})
+    return report_scaling(scaling, 'threads')
+
+
+# how the scaling entries of each kind are named
+SCALING_LABELS = {
+    'workers': 'create_many[workers=%d]',
+    'threads': 'create+verify[threads=%d]',
+}
+
+
+def report_scaling(scaling: list, key: str) -> list:
+    """Add the efficiency (speedup per worker/thread) and print it"""
+    for entry in scaling:
+        entry['efficiency'] = entry['per_sec'] / (
+            entry[key] * scaling[0]['per_sec']
+        )
+        print(
+            '%-36s %12.1f /s %11.0f %%'
+            % (
+                SCALING_LABELS[key] % entry[key],
+                entry['per_sec'],
+                entry['efficiency'] * 100,
+            ),
+            file=sys.stderr,
+        )
+    return scaling
+
+
+def package_version(name: str) -> Optional[str]:
+    try:
+        from importlib.metadata import version
+    except ImportError:  # python 3.7
+        return None
+    try:
+        return version(name)
+    except Exception:
+        return None
+
+
+def environment() -> dict:
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)  # python 3.13+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'free_threaded': bool(sysconfig.get_config_var('Py_GIL_DISABLED')),
+        'gil_enabled': is_gil_enabled() if is_gil_enabled else True,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': {
+            name: package_version(name)
+            for name in ('Pillow', 'PyJWT', 'Werkzeug', 'numpy')
+        },
+    }
+
+
+def compare(
+    baseline: dict,
+    current: dict,
+    latency_threshold: float = LATENCY_THRESHOLD,
+    alloc_threshold: float = ALLOC_THRESHOLD,
+) -> List[str]:
+    """Compare two results dicts, returns the regressions found
+
+    Args:
+        baseline (dict): results to compare against
+        current (dict): new results
+        latency_threshold (float): tolerated median latency increase,
+            as a fraction of the baseline
+        alloc_threshold (float): tolerated peak allocation increase,
+            as a fraction of the baseline (plus ALLOC_SLACK bytes)
+
+    Returns:
+        List[str]: a description of every regression, empty if none
+    """
+    regressions = []
+    old_benchmarks = baseline.get('benchmarks', {})
+    for name, new in current.get('benchmarks', {}).items():
+        old = old_benchmarks.get(name)
+        if old is None:
+            continue
+        ratio = new['median_us'] / old['median_us']
+        if ratio > 1 + latency_threshold:
+            regressions.append(
+                '%s: %.1fus -> %.1fus (%.2fx slower)'
+                % (name, old['median_us'], new['median_us'], ratio)
+            )
+        old_alloc, new_alloc = old['peak_alloc_bytes'], new['peak_alloc_bytes']
+        if new_alloc > old_alloc * (1 + alloc_threshold) + ALLOC_SLACK:
+            regressions.append(
+                '%s: peak allocation %dB -> %dB' % (name, old_alloc, new_alloc)
+            )
+
+    # scaling only compares on the same number of CPUs (and GIL)
+    old_env, new_env = baseline.get('environment'), current.get('environment')
+    if not old_env or not new_env:
+        return regressions
+    for key in ('cpu_count', 'gil_enabled'):
+        if old_env.get(key) != new_env.get(key):
+            return regressions
+    for results_key, key in (('scaling', 'workers'), ('threads', 'threads')):
+        old_scaling = {
+            s[key]: s['per_sec'] for s in baseline.get(results_key, [])
+        }
+        for entry in current.get(results_key, []):
+            old = old_scaling.get(entry[key])
+            if old and old / entry['per_sec'] > 1 + latency_threshold:
+                regressions.append(
+                    '%s: %.1f/s -> %.1f/s'
+                    % (SCALING_LABELS[key] % entry[key], old, entry['per_sec'])
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', help='save the results as JSON')
+    parser.add_argument('-c', '--compare', help='baseline JSON to compare to')
+    parser.add_argument(
+        '-i', '--input', help='compare these saved results, do not run'
+    )
+    parser.add_argument(
+        '-k', '--filter', default='', help='only run matching benchmarks'
+    )
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument(
+        '--min-time', type=float, default=0.2, help='seconds per round'
+    )
+    parser.add_argument('--no-scaling', action='store_true')
+    parser.add_argument('--no-threads', action='store_true')
+    parser.add_argument(
+        '--latency-threshold', type=float, default=LATENCY_THRESHOLD
+    )
+    parser.add_argument(
+        '--alloc-threshold', type=float, default=ALLOC_THRESHOLD
+    )
+    args = parser.parse_args(argv)
+
+    if args.input:
+        with open(args.input) as f:
+            results = json.load(f)
+    else:
+        names = [name for name in BENCHMARKS if args.filter in name]
+        benchmarks = run_benchmarks(names, args.min_time, args.rounds)
+        startup = [name for name in STARTUP if args.filter in name]
+        benchmarks.update(run_startup_benchmarks(startup, args.rounds))
+        results = {
+            'version': RESULTS_VERSION,
+            'environment': environment(),
+            'benchmarks': benchmarks,
+            'scaling': [] if args.no_scaling else run_scaling(),
+            'threads': [] if args.no_threads else run_threads(),
+        }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != results.get('environment'):
+            print('warning: environments differ', file=sys.stderr)
+        regressions = compare(
+            baseline, results, args.latency_threshold, args.alloc_threshold
+        )
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+        print('no regressions')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
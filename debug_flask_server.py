@@ -4,20 +4,18 @@ import multiprocessing as mp
 from flask import Flask, request, render_template_string
 
 from flask_simple_captcha import CAPTCHA, DEFAULT_CONFIG
+from flask_simple_captcha.img import IMG_MIMETYPES
 
 app = Flask(__name__)
 test_config = DEFAULT_CONFIG.copy()
 
+# one instance shared by every request thread
 CAPTCHA = CAPTCHA(config=test_config)
 app = CAPTCHA.init_app(app)
 
 PROCS = mp.cpu_count()
 
 
-def _captcha(mp_list: list):
-    mp_list.append(CAPTCHA.create())
-
-
 @app.route('/', methods=['GET', 'POST'])
 def submit_captcha():
     if request.method == 'GET':
@@ -39,15 +37,9 @@ def submit_captcha():
 @app.route('/images')
 @app.route('/images/<int:captchas>')
 def bulk_captchas(captchas=None):
-    captchas = captchas or 50
-    with mp.Manager() as mgr:
-        mp_list = mgr.list()
-        with mp.Pool(PROCS) as pool:
-            pool.map(_captcha, [mp_list] * captchas)
-
-        captchas = list(mp_list)
+    captchas = CAPTCHA.create_many(captchas or 50, workers=PROCS)
 
-    mimetype = 'image/png' if CAPTCHA.img_format == 'PNG' else 'image/jpeg'
+    mimetype = IMG_MIMETYPES[CAPTCHA.img_format]
     captchas = [
         '<img class="simple-captcha-img" '
         + 'src="data:%s;base64, %s" />' % (mimetype, c['img'])
@@ -2,3 +2,5 @@ import sys
 from os.path import dirname, abspath, join as pjoin
 
 from .captcha_generation import CAPTCHA, DEFAULT_CONFIG
+from .replay import BaseReplayStore, MemoryReplayStore, SQLiteReplayStore
+from .metrics import StageTimer, StatsCollector
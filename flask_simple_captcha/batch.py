@@ -0,0 +1,84 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+# config keys which are not sent to (or make no sense in) worker processes
+WORKER_EXCLUDED_KEYS = (
+    'REPLAY_STORE',
+    'ASYNC_EXECUTOR',
+    'METRICS',
+    'RANDOM_SEED',  # every worker would make the same captchas
+)
+
+_WORKER_CAPTCHA = None
+
+
+def worker_config(config: dict) -> dict:
+    """The picklable part of a CAPTCHA config, with pre-rendering off"""
+    conf = {k: v for k, v in config.items() if k not in WORKER_EXCLUDED_KEYS}
+    conf['POOL_SIZE'] = 0
+    return conf
+
+
+def init_worker(config: dict):
+    global _WORKER_CAPTCHA
+    from .captcha_generation import CAPTCHA
+
+    _WORKER_CAPTCHA = CAPTCHA(config)
+
+
+def _render_chunk(n: int, sign: bool) -> List[Tuple[str, ...]]:
+    """Render n captchas in a worker, as (img, text[, hash]) tuples"""
+    cap = _WORKER_CAPTCHA
+    out = []
+    for _ in range(n):
+        c = cap.render()
+        if sign:
+            out.append((c['img'], c['text'], cap.encrypt(c['text'])))
+        else:
+            out.append((c['img'], c['text']))
+    return out
+
+
+def create_one(length=None, digits=None) -> dict:
+    """CAPTCHA.create() in a worker"""
+    return _WORKER_CAPTCHA.create(length, digits)
+
+
+def check_one(c_text: str, c_hash: str) -> bool:
+    """CAPTCHA.check() in a worker"""
+    return _WORKER_CAPTCHA.check(c_text, c_hash)
+
+
+class BatchRenderer:
+    """Persistent process pool rendering captchas for a CAPTCHA config.
+
+    Every worker builds its own CAPTCHA once (fonts, glyph atlases etc.)
+    and renders whole chunks of captchas per task, sending them back as
+    plain tuples, so there is a single round trip per chunk.
+    """
+
+    def __init__(self, config: dict, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(
+            self.workers,
+            initializer=init_worker,
+            initargs=(worker_config(config),),
+        )
+
+    def render(self, n: int, sign: bool = True) -> List[Tuple[str, ...]]:
+        """Render n captchas across the workers, see _render_chunk"""
+        # a few chunks per worker evens out uneven chunk durations
+        chunks = self.workers * 4
+        size, rest = divmod(n, chunks)
+        sizes = [size + (i < rest) for i in range(chunks)]
+        futures = [
+            self._executor.submit(_render_chunk, s, sign) for s in sizes if s
+        ]
+        return [c for f in futures for c in f.result()]
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+    def __repr__(self):
+        return '<BatchRenderer %d workers>' % self.workers
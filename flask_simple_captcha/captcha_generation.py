@@ -1,24 +1,59 @@
+import os
+import re
 import string
-from random import choice as rchoice
-from PIL import Image
-from typing import Tuple
-from uuid import uuid4
+import sys
+import threading
+import time
+from base64 import b64encode
+from typing import TYPE_CHECKING, Optional, Tuple
+from weakref import WeakKeyDictionary
 from .config import DEFAULT_CONFIG
 
 from .utils import (
     jwtencrypt,
     jwtdecrypt,
+    compact_encrypt,
+    compact_decrypt,
+    is_compact_token,
+    is_token,
+    token_expiry,
+    token_status,
+    seal_text,
+    open_sealed,
     gen_captcha_text,
     CHARPOOL,
     exclude_similar_chars,
+    HASH_BACKENDS,
+    TOKEN_FORMATS,
 )
 
-from .img import (
-    convert_b64img as new_convert_b64img,
-    draw_lines as new_draw_lines,
-    create_text_img,
-)
-from .text import CAPTCHA_FONTS, get_font
+from .formats import IMG_EXTENSIONS, IMG_MIMETYPES, get_img_options
+from .metrics import StageTimer, StatsCollector
+from .pool import CaptchaPool, SQLiteCaptchaPool
+from .replay import MemoryReplayStore
+from .rng import CaptchaRandom, token_layout
+from .text import FONT_CACHE, captcha_fonts, get_font
+
+# rendering (.img, Pillow), asyncio and the worker processes (.batch) are
+# imported on first use, processes which only verify never load them
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from PIL import Image
+    from .img import CaptchaRenderer
+
+# old names of .img functions, still importable from here
+_IMG_ALIASES = {
+    'new_convert_b64img': 'convert_b64img',
+    'new_draw_lines': 'draw_lines',
+}
+
+
+def __getattr__(name: str):
+    if name in _IMG_ALIASES:
+        from . import img
+
+        return getattr(img, _IMG_ALIASES[name])
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
 
 
 class CAPTCHA:
@@ -27,7 +62,6 @@ class CAPTCHA:
     def __init__(self, config: dict):
         """Initialize CAPTCHA with default configuration."""
         self.config = {**DEFAULT_CONFIG, **config}
-        self.verified_captchas = set()
         self.secret = self.config['SECRET_CAPTCHA_KEY']
 
         # jwt expiration time
@@ -40,6 +74,16 @@ class CAPTCHA:
         else:
             self.expire_secs = DEFAULT_CONFIG['EXPIRE_SECONDS']
 
+        # successfully verified tokens, kept until they expire
+        if self.config.get('REPLAY_STORE') is not None:
+            self.verified_captchas = self.config['REPLAY_STORE']
+        else:
+            self.verified_captchas = MemoryReplayStore(
+                self.config['REPLAY_STORE_MAX_ENTRIES'],
+                default_ttl=self.expire_secs,
+                stripes=self.config['REPLAY_STORE_STRIPES'],
+            )
+
         # character pool
         if 'CHARACTER_POOL' in self.config:
             chars = self.config['CHARACTER_POOL']
@@ -67,22 +111,226 @@ class CAPTCHA:
 
         self.characters = tuple(set(chars))
 
-        # img format
-        self.img_format = self.config['CAPTCHA_IMG_FORMAT']
+        # digits added by create(digits=True)
+        digits = string.digits
+        if self.config['EXCLUDE_VISUALLY_SIMILAR']:
+            digits = exclude_similar_chars(digits)
+        self._digit_characters = tuple(set(self.characters + tuple(digits)))
+
+        # answers verify() rejects before checking the token: with
+        # characters no CAPTCHA text has or, if ANSWER_LENGTHS is set, of
+        # any other length. Tokens do not tell the length they were made
+        # for (create(length=)), so no length is enforced by default.
+        self.answer_lengths = None  # type: Optional[frozenset]
+        if self.config.get('ANSWER_LENGTHS'):
+            self.answer_lengths = frozenset(self.config['ANSWER_LENGTHS'])
+        self._answer_chars = frozenset(self._digit_characters)
+
+        # texts from a CSPRNG, layouts from a random.Random of our own,
+        # both reproducible with RANDOM_SEED (for tests/benchmarks only)
+        self.random = CaptchaRandom(self.config.get('RANDOM_SEED'))
+
+        # img format and encoder options
+        self.img_format = self.config['CAPTCHA_IMG_FORMAT'].upper()
+        if self.img_format not in IMG_MIMETYPES:
+            raise ValueError(
+                'unsupported CAPTCHA_IMG_FORMAT %r, use one of %s'
+                % (self.config['CAPTCHA_IMG_FORMAT'], ', '.join(IMG_MIMETYPES))
+            )
+        self.img_options = get_img_options(
+            self.img_format,
+            self.config['CAPTCHA_IMG_PROFILE'],
+            self.config['CAPTCHA_IMG_OPTIONS'],
+        )
 
-        # fonts
-        self.fonts = CAPTCHA_FONTS
+        # serve images from this route instead of inlining them in the html,
+        # with a blueprint named after the route, so several instances can
+        # serve their own
+        self.lazy_route = self.config.get('LAZY_IMG_ROUTE')
+        self.blueprint_name = None  # type: Optional[str]
+        if self.lazy_route is not None:
+            self.lazy_route = self.lazy_route.rstrip('/')
+            self.blueprint_name = 'simple_captcha' + re.sub(
+                r'\W', '_', self.lazy_route
+            )
+
+        # answer hashing backend and token format
+        self.hash_backend = self.config['CAPTCHA_HASH_BACKEND']
+        backends = ('werkzeug', *HASH_BACKENDS)
+        if self.hash_backend not in backends:
+            raise ValueError(
+                'unknown CAPTCHA_HASH_BACKEND %r, use one of %s'
+                % (self.hash_backend, ', '.join(backends))
+            )
+        self.token_format = self.config['CAPTCHA_TOKEN_FORMAT']
+        if self.token_format not in TOKEN_FORMATS:
+            raise ValueError(
+                'unknown CAPTCHA_TOKEN_FORMAT %r, use one of %s'
+                % (self.token_format, ', '.join(TOKEN_FORMATS))
+            )
+
+        # image size and rendering
+        self.img_size = (self.config['IMG_WIDTH'], self.config['IMG_HEIGHT'])
+        self.render_at_target = self.config['RENDER_AT_TARGET']
+        self.resample = self.config['RESAMPLE']
+
+        # guards the lazily set up rendering, worker pool and executor, an
+        # instance is shared by every thread of the app
+        self._lock = threading.RLock()
+
+        # fonts, image mode and the renderer, set up on first render,
+        # processes which only verify never load Pillow
+        self._fonts = None
+        self._img_mode = None
+        self._renderer = None
+
+        # pre-drawn noise layers (NOISE_BANK), also set up on first render
+        self.noise_bank = None
+
+        # process pool used by create_many, started on first use
+        self._batch = None
+
+        # acreate/averify, ASYNC_EXECUTOR is 'thread', 'process' or an
+        # executor running calls in this process, a process pool would
+        # have to pickle this instance (use 'process')
+        self._async_kind = self.config['ASYNC_EXECUTOR']
+        self._executor = None
+        if not isinstance(self._async_kind, str):
+            from concurrent.futures import ProcessPoolExecutor
+
+            if isinstance(self._async_kind, ProcessPoolExecutor):
+                raise ValueError(
+                    "ASYNC_EXECUTOR can not be a ProcessPoolExecutor, "
+                    "use 'process'"
+                )
+            self._executor, self._async_kind = self._async_kind, 'custom'
+        self._async_sems = WeakKeyDictionary()
+
+        # background pre-rendering of captchas, in memory or on disk
+        self.pool = None
+        if self.config['POOL_SIZE'] > 0:
+            pool_args = dict(
+                high=self.config['POOL_SIZE'],
+                low=self.config.get('POOL_LOW_WATERMARK'),
+                max_age=self.config['POOL_MAX_AGE'],
+                workers=self.config.get('POOL_WORKERS'),
+            )
+            if self.config.get('POOL_PATH') is not None:
+                self.pool = SQLiteCaptchaPool(
+                    self, self.config['POOL_PATH'], **pool_args
+                )
+            else:
+                self.pool = CaptchaPool(self, **pool_args)
+
+        # per stage timings of create/verify, a callable taking the
+        # operation name, a dict of stage durations and the outcome, off
+        # when None
+        self.metrics = self.config.get('METRICS')
+        self.metrics_route = self.config.get('METRICS_ROUTE')
+        if self.metrics is True or (
+            self.metrics is None and self.metrics_route is not None
+        ):
+            self.metrics = StatsCollector()
 
-        # if USE_TEXT_FONTS is set in config, only use those fonts
-        if 'USE_TEXT_FONTS' in self.config:
-            self.fonts = []
-            for fntname in self.config['USE_TEXT_FONTS']:
-                fnt = get_font(fntname, CAPTCHA_FONTS)
-                if fnt is not None:
-                    self.fonts.append(fnt)
+    def _setup_rendering(self):
+        """Find the fonts, pick the image mode and build the
+        CaptchaRenderer, which lays out the character pool for every font.
+        """
+        with self._lock:
+            # another thread may have set it up while we waited
+            if None in (self._fonts, self._img_mode, self._renderer):
+                self._setup_rendering_locked()
+
+    def _setup_rendering_locked(self):
+        from .img import CaptchaRenderer, auto_img_mode
+
+        fonts = self._fonts
+        if fonts is None:
+            fonts = captcha_fonts()
+
+            # if USE_TEXT_FONTS is set in config, only use those fonts
+            if 'USE_TEXT_FONTS' in self.config:
+                fonts = []
+                for fntname in self.config['USE_TEXT_FONTS']:
+                    fnt = get_font(fntname)
+                    if fnt is not None:
+                        fonts.append(fnt)
+
+        # make sure every configured font fits in the shared font cache
+        FONT_CACHE.maxsize = max(FONT_CACHE.maxsize, len(fonts))
+
+        img_mode = self.config['IMG_MODE'] or auto_img_mode(
+            self.config['BACKGROUND_COLOR'],
+            self.config['TEXT_COLOR'],
+            self.img_format,
+        )
+        if self.config['NOISE_BANK'] > 0 and self.noise_bank is None:
+            from .noise import NoiseBank
+
+            self.noise_bank = NoiseBank(
+                self.config['NOISE'],
+                self.config['NOISE_BANK'],
+                refresh=self.config['NOISE_BANK_REFRESH'],
+                seed=self.config.get('RANDOM_SEED'),
+            )
+
+        self._renderer = CaptchaRenderer(
+            [fnt.path for fnt in fonts],
+            self._digit_characters,
+            size=self.img_size,
+            font_size=self.config['FONT_SIZE'],
+            back_color=self.config['BACKGROUND_COLOR'],
+            text_color=self.config['TEXT_COLOR'],
+            mode=img_mode,
+            at_target=self.render_at_target,
+            resample=self.resample,
+            noise=self.config['NOISE'],
+            pixel_noise=self.config['PIXEL_NOISE'],
+            noise_bank=self.noise_bank,
+            lengths=(self.config['CAPTCHA_LENGTH'],),
+        )
+        self._fonts, self._img_mode = fonts, img_mode
+
+    @property
+    def fonts(self) -> list:
+        """The CaptchaFonts to render with"""
+        if self._fonts is None:
+            self._setup_rendering()
+        return self._fonts
+
+    @fonts.setter
+    def fonts(self, fonts: list):
+        with self._lock:
+            self._fonts = fonts
+            self._renderer = None
+
+    @property
+    def renderer(self) -> 'CaptchaRenderer':
+        """The CaptchaRenderer of this configuration"""
+        renderer = self._renderer
+        if renderer is None:
+            self._setup_rendering()
+            renderer = self._renderer
+        return renderer
+
+    @property
+    def img_mode(self) -> str:
+        """The Pillow mode images are rendered in, see IMG_MODE"""
+        if self._img_mode is None:
+            self._setup_rendering()
+        return self._img_mode
+
+    @property
+    def font_size(self) -> int:
+        """The font size CAPTCHA_LENGTH texts are drawn at, see FONT_SIZE
+        and RENDER_AT_TARGET
+        """
+        return self.renderer.text_font_size(self.config['CAPTCHA_LENGTH'])
 
-    def get_background(self, text_size: Tuple[int, int]) -> Image:
+    def get_background(self, text_size: Tuple[int, int]) -> 'Image.Image':
         """preserved for backwards compatibility"""
+        from PIL import Image
+
         return Image.new(
             'RGBA',
             (int(text_size[0]), int(text_size[1])),
@@ -91,59 +339,303 @@ class CAPTCHA:
 
     def convert_b64img(self, *args, **kwargs) -> str:
         """preserved for backwards compatibility"""
-        return new_convert_b64img(*args, **kwargs)
+        # looked up on the module, imported or patched there
+        module = sys.modules[__name__]
+        return module.new_convert_b64img(*args, **kwargs)
 
-    def draw_lines(self, *args, **kwargs) -> Image:
+    def draw_lines(self, *args, **kwargs) -> 'Image.Image':
         """preserved for backwards compatibility"""
-        return new_draw_lines(*args, **kwargs)
+        module = sys.modules[__name__]
+        return module.new_draw_lines(*args, **kwargs)
 
     def create(self, length=None, digits=None) -> str:
         """Create a new CAPTCHA dict and add it to self.captchas"""
+        if self.metrics is None:
+            return self._create(length, digits, None)
+
+        timer = StageTimer()
+        captcha = self._create(length, digits, timer)
+        self.metrics('create', timer.stages, timer.outcome)
+        return captcha
+
+    def _create(self, length, digits, timer: Optional[StageTimer]) -> dict:
+        if self.lazy_route is not None:
+            # only the token now, the image is rendered when it's fetched
+            text = self.gen_text(length, digits)
+            if timer is not None:
+                timer.mark('text')
+            sealed = seal_text(text, self.secret, self.expire_secs)
+            if timer is not None:
+                timer.mark('seal')
+            captcha = {
+                'img': None,
+                'img_url': self.image_url(sealed),
+                'sealed': sealed,
+                'text': text,
+                'hash': self.encrypt(text),
+            }
+            if timer is not None:
+                timer.mark('token')
+                timer.outcome = 'lazy'
+            return captcha
+
+        if self.pool is not None and length is None and digits is None:
+            captcha = self.pool.get()
+            if captcha is not None:
+                if timer is not None:
+                    timer.mark('pool')
+                    timer.outcome = 'pool'
+                return captcha
+
+        captcha = self.render(length, digits, timer)
+        captcha['hash'] = self.encrypt(captcha['text'])
+        if timer is not None:
+            timer.mark('token')
+            timer.outcome = 'rendered'
+        return captcha
+
+    def render(self, length=None, digits=None, timer=None) -> dict:
+        """Generate the text and image of a new CAPTCHA, without a token.
+        timer (a StageTimer) marks every rendering stage when given.
+        """
+        text = self.gen_text(length, digits)
+        if timer is None:
+            img = self.convert_b64img(
+                self.render_image(text), self.img_format, **self.img_options
+            )
+        else:
+            from .img import encode_img
+
+            timer.mark('text')
+            data = encode_img(
+                self.render_image(text, timer),
+                self.img_format,
+                **self.img_options,
+            )
+            timer.mark('encode')
+            img = b64encode(data).decode()
+            timer.mark('base64')
+        return {'img': img, 'text': text}
+
+    def gen_text(self, length=None, digits=None) -> str:
+        """Generate the text of a new CAPTCHA"""
         # backwards compatibility
         length = self.config['CAPTCHA_LENGTH'] if length is None else length
         add_digits = (
             self.config['CAPTCHA_DIGITS'] if digits is None else digits
         )
 
-        text = gen_captcha_text(
-            length=length, add_digits=add_digits, charpool=self.characters
-        )
-        out_img = create_text_img(
+        chars = self._digit_characters if add_digits else self.characters
+        return self.random.text(length, chars)
+
+    def render_image(self, text: str, timer=None, rng=None) -> 'Image.Image':
+        """Render the image of the CAPTCHA text, with the layout drawn from
+        rng (a random.Random) or this instance's CaptchaRandom. Only the
+        latter combines its noise from the NOISE_BANK, the bank changes
+        over time while an rng must always give the same image.
+        """
+        if rng is None:
+            return self.renderer.render(text, self.random.layout, timer)
+        return self.renderer.render(text, rng, timer, use_noise_bank=False)
+
+    def create_many(self, n: int, workers: Optional[int] = None) -> list:
+        """Create n CAPTCHA dicts, rendered in parallel.
+
+        Args:
+            n (int): The number of CAPTCHAs to create.
+            workers (int, optional): Worker processes to use, the pool of
+                workers is kept and reused by later calls. Defaults to the
+                number of CPUs, 1 renders in this process.
+
+        Returns:
+            list: CAPTCHA dicts, the same as returned by create()
+        """
+        return [
+            {'img': c[0], 'text': c[1], 'hash': c[2]}
+            for c in self._render_many(n, workers, sign=True)
+        ]
+
+    def render_many(self, n: int, workers: Optional[int] = None) -> list:
+        """Render n CAPTCHAs (without tokens) in parallel, see create_many"""
+        return [
+            {'img': c[0], 'text': c[1]}
+            for c in self._render_many(n, workers, sign=False)
+        ]
+
+    def _render_many(self, n: int, workers: Optional[int], sign: bool):
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            rendered = [self.render() for _ in range(n)]
+            if sign:
+                return [
+                    (c['img'], c['text'], self.encrypt(c['text']))
+                    for c in rendered
+                ]
+            return [(c['img'], c['text']) for c in rendered]
+
+        with self._lock:
+            if self._batch is None or self._batch.workers != workers:
+                self.close_workers()
+                from .batch import BatchRenderer
+
+                self._batch = BatchRenderer(self.config, workers)
+            batch = self._batch
+        return batch.render(n, sign)
+
+    def close_workers(self):
+        """Shut down the create_many worker processes, the acreate /
+        averify executor and the noise bank refresh thread, if started.
+        """
+        with self._lock:
+            if self.noise_bank is not None:
+                self.noise_bank.stop()
+            if self._batch is not None:
+                self._batch.shutdown()
+                self._batch = None
+            if self._executor is not None and self._async_kind != 'custom':
+                self._executor.shutdown()
+                self._executor = None
+
+    def encrypt(self, text: str) -> str:
+        """Create the token (jwt or compact) for the CAPTCHA text"""
+        if self.token_format == 'compact':
+            return compact_encrypt(text, self.secret, self.expire_secs)
+        return jwtencrypt(
             text,
-            rchoice(self.fonts).path,
-            back_color=self.config['BACKGROUND_COLOR'],
-            text_color=self.config['TEXT_COLOR'],
+            self.secret,
+            expire_seconds=self.expire_secs,
+            hash_backend=self.hash_backend,
         )
 
-        return {
-            'img': self.convert_b64img(out_img, self.img_format),
-            'text': text,
-            'hash': jwtencrypt(
-                text, self.secret, expire_seconds=self.expire_secs
-            ),
-        }
-
     def verify(self, c_text: str, c_hash: str) -> bool:
         """Verify CAPTCHA response. Return True if valid, False if invalid.
 
         Args:
             c_text (str): The CAPTCHA text to verify.
-            c_hash (str): The jwt to verify (from the hidden input field)
+            c_hash (str): The jwt or compact token to verify
+                (from the hidden input field)
 
         Returns:
             bool: True if valid, False if invalid.
         """
+        if self.metrics is None:
+            return self._verify(c_text, c_hash, None)
+
+        timer = StageTimer()
+        valid = self._verify(c_text, c_hash, timer)
+        self.metrics('verify', timer.stages, timer.outcome)
+        return valid
+
+    def _verify(
+        self, c_text: str, c_hash: str, timer: Optional[StageTimer]
+    ) -> bool:
+        answer = self._before_check(c_text, c_hash, timer)
+        if answer is None:
+            return False
+        valid = self.check(*answer)
+        if timer is not None:
+            timer.mark('check')
+        return self._after_check(answer[1], valid, timer)
+
+    def _before_check(
+        self, c_text: str, c_hash: str, timer: Optional[StageTimer]
+    ) -> Optional[Tuple[str, str]]:
+        """The (c_text, c_hash) verify() checks, None if rejected without
+        checking: by precheck() or as a replay
+        """
         # handle parameter reversed order
-        if len(c_text.split('.')) == 3:
-            # jwt was passed as 1st arg correct
+        if is_token(c_text):
+            # token was passed as 1st arg correct
             c_text, c_hash = c_hash, c_text
-
-        if c_hash in self.verified_captchas:
+            if timer is not None:
+                timer.mark('swap')
+
+        rejected = self.precheck(c_text, c_hash)
+        if timer is not None:
+            timer.mark('precheck')
+        if rejected is not None:
+            if timer is not None:
+                timer.outcome = rejected
+            return None
+
+        replayed = c_hash in self.verified_captchas
+        if timer is not None:
+            timer.mark('replay_check')
+        if replayed:
+            if timer is not None:
+                timer.outcome = 'replay'
+            return None
+        return c_text, c_hash
+
+    def _after_check(
+        self, c_hash: str, valid: bool, timer: Optional[StageTimer]
+    ) -> bool:
+        """Record the token of a valid answer, False if it was a replay"""
+        if not valid:
+            if timer is not None:
+                # the token alone tells an expired/forged token from a typo
+                status = token_status(c_hash, self.secret)
+                timer.outcome = 'mismatch' if status == 'ok' else status
             return False
 
-        decoded_text = jwtdecrypt(
-            c_hash, c_text, self.config['SECRET_CAPTCHA_KEY']
-        )
+        # False if another thread/process accepted it in the meantime
+        valid = self.verified_captchas.add(c_hash, token_expiry(c_hash))
+        if timer is not None:
+            timer.mark('replay_add')
+            timer.outcome = 'valid' if valid else 'replay'
+        return valid
+
+    def precheck(self, c_text: str, c_hash: str) -> Optional[str]:
+        """Cheap checks of a CAPTCHA answer and its token, run by verify()
+        before the replay store and the token's signature and hash.
+
+        Args:
+            c_text (str): The CAPTCHA text to verify.
+            c_hash (str): The jwt or compact token to verify.
+
+        Returns:
+            Optional[str]: Why the answer can not be valid: 'invalid' (not
+                shaped like a token, or either is not a str, e.g. a missing
+                form field), 'expired', 'wrong_length' (not one of
+                ANSWER_LENGTHS, if set) or 'wrong_chars' (not in the
+                character pool), None if it passes.
+        """
+        if not isinstance(c_text, str) or not is_token(c_hash):
+            return 'invalid'
+        exp = token_expiry(c_hash)
+        if exp is None:
+            return 'invalid'
+        if exp <= time.time():
+            return 'expired'
+        if (
+            self.answer_lengths is not None
+            and len(c_text) not in self.answer_lengths
+        ):
+            return 'wrong_length'
+        if self.only_upper:
+            c_text = c_text.upper()
+        if not self._answer_chars.issuperset(c_text):
+            return 'wrong_chars'
+        return None
+
+    def stats(self) -> dict:
+        """Snapshot of the METRICS collector, empty if it has no stats()"""
+        stats = getattr(self.metrics, 'stats', None)
+        return stats() if stats is not None else {}
+
+    def check(self, c_text: str, c_hash: str) -> bool:
+        """Check the CAPTCHA text against the token, like verify() but
+        without looking at or recording replays.
+        """
+        # tokens of both formats verify, whatever CAPTCHA_TOKEN_FORMAT is
+        if is_compact_token(c_hash):
+            decoded_text = compact_decrypt(
+                c_hash, c_text, self.config['SECRET_CAPTCHA_KEY']
+            )
+        else:
+            decoded_text = jwtdecrypt(
+                c_hash, c_text, self.config['SECRET_CAPTCHA_KEY']
+            )
 
         # token expired or invalid
         if decoded_text is None:
@@ -152,10 +644,99 @@ class CAPTCHA:
         if self.only_upper:
             decoded_text, c_text = decoded_text.upper(), c_text.upper()
 
-        if decoded_text == c_text:
-            self.verified_captchas.add(c_hash)
-            return True
-        return False
+        return decoded_text == c_text
+
+    async def acreate(self, length=None, digits=None) -> dict:
+        """create() for asyncio, the rendering and hashing run in the
+        ASYNC_EXECUTOR, at most ASYNC_CONCURRENCY at a time.
+        """
+        timer = None if self.metrics is None else StageTimer()
+        if self.pool is not None and length is None and digits is None:
+            captcha = self.pool.get()
+            if captcha is not None:
+                if timer is not None:
+                    timer.mark('pool')
+                    timer.outcome = 'pool'
+                    self.metrics('create', timer.stages, timer.outcome)
+                return captcha
+
+        if self._async_kind != 'process':
+            # create() records its own metrics
+            return await self._run_async(self.create, length, digits)
+
+        from .batch import create_one
+
+        captcha = await self._run_async(create_one, length, digits)
+        if timer is not None:
+            timer.mark('worker')
+            timer.outcome = 'lazy' if captcha['img'] is None else 'rendered'
+            self.metrics('create', timer.stages, timer.outcome)
+        return captcha
+
+    async def averify(self, c_text: str, c_hash: str) -> bool:
+        """verify() for asyncio, the token check runs in the ASYNC_EXECUTOR,
+        at most ASYNC_CONCURRENCY at a time.
+        """
+        timer = None if self.metrics is None else StageTimer()
+        answer = self._before_check(c_text, c_hash, timer)
+        if answer is None:
+            valid = False
+        else:
+            # replays are always recorded here, worker processes only check
+            if self._async_kind == 'process':
+                from .batch import check_one
+
+                valid = await self._run_async(check_one, *answer)
+            else:
+                valid = await self._run_async(self.check, *answer)
+            if timer is not None:
+                timer.mark('check')
+            valid = self._after_check(answer[1], valid, timer)
+
+        if timer is not None:
+            self.metrics('verify', timer.stages, timer.outcome)
+        return valid
+
+    async def _run_async(self, func, *args):
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        sem = self._async_sems.get(loop)
+        if sem is None:
+            with self._lock:
+                sem = self._async_sems.get(loop)
+                if sem is None:
+                    sem = asyncio.Semaphore(self.config['ASYNC_CONCURRENCY'])
+                    self._async_sems[loop] = sem
+
+        # cancelling the awaiting task cancels the call if it has not
+        # started yet, the semaphore caps the work handed to the executor
+        async with sem:
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    @property
+    def executor(self) -> 'Executor':
+        """The executor used by acreate/averify, created on first use"""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._new_executor()
+        return self._executor
+
+    def _new_executor(self) -> 'Executor':
+        workers = self.config.get('ASYNC_WORKERS')
+        if self._async_kind == 'process':
+            from concurrent.futures import ProcessPoolExecutor
+            from .batch import init_worker, worker_config
+
+            return ProcessPoolExecutor(
+                workers,
+                initializer=init_worker,
+                initargs=(worker_config(self.config),),
+            )
+        from concurrent.futures import ThreadPoolExecutor
+
+        return ThreadPoolExecutor(workers, thread_name_prefix='captcha')
 
     def captcha_html(self, captcha: dict) -> str:
         """
@@ -165,11 +746,15 @@ class CAPTCHA:
         Returns:
             str: HTML string containing the CAPTCHA image and input fields.
         """
-        mimetype = 'image/png' if self.img_format == 'PNG' else 'image/jpeg'
-        img = (
-            '<img class="simple-captcha-img" '
-            + 'src="data:%s;base64, %s" />' % (mimetype, captcha['img'])
-        )
+        if captcha.get('sealed'):
+            # built now, in the request the html is rendered for
+            src = self.image_url(captcha['sealed'])
+        elif captcha.get('img_url'):
+            src = captcha['img_url']
+        else:
+            mimetype = IMG_MIMETYPES[self.img_format]
+            src = 'data:%s;base64, %s' % (mimetype, captcha['img'])
+        img = '<img class="simple-captcha-img" src="%s" />' % src
 
         inpu = (
             '<input type="text" class="simple-captcha-text"'
@@ -181,9 +766,76 @@ class CAPTCHA:
 
         return '%s\n%s' % (img, inpu)
 
+    def image_url(self, sealed: str) -> str:
+        """The LAZY_IMG_ROUTE url of the image of a sealed text. During a
+        request to an app the route is registered on, it is built with
+        url_for, so it includes the SCRIPT_NAME of apps mounted under a
+        prefix.
+        """
+        from flask import current_app, has_request_context, url_for
+
+        ext = IMG_EXTENSIONS[self.img_format]
+        if (
+            has_request_context()
+            and self.blueprint_name in current_app.blueprints
+        ):
+            endpoint = self.blueprint_name + '.image'
+            return url_for(endpoint, sealed=sealed, ext=ext)
+        return '%s/%s.%s' % (self.lazy_route, sealed, ext)
+
+    def image_response(self, sealed: str, ext: str):
+        """Flask response with the image for a LAZY_IMG_ROUTE url"""
+        from flask import Response, abort
+        from .img import encode_img
+
+        text = open_sealed(sealed, self.secret)
+        if text is None or ext != IMG_EXTENSIONS[self.img_format]:
+            abort(404)
+
+        # the same image for every fetch of the url, so fetching it again
+        # and again gives no new views of the text to combine
+        rng = token_layout(self.secret, sealed)
+        data = encode_img(
+            self.render_image(text, rng=rng),
+            self.img_format,
+            **self.img_options,
+        )
+        resp = Response(data, mimetype=IMG_MIMETYPES[self.img_format])
+        resp.headers['Cache-Control'] = 'private, no-store'
+        return resp
+
+    def metrics_response(self):
+        """Flask response with the METRICS in the Prometheus text format"""
+        from flask import Response, abort
+
+        exposition = getattr(self.metrics, 'exposition', None)
+        if exposition is None:
+            abort(404)
+
+        gauges = {'replay_store_entries': len(self.verified_captchas)}
+        if self.pool is not None:
+            gauges['pool_entries'] = len(self.pool)
+        return Response(
+            exposition(gauges), mimetype='text/plain; version=0.0.4'
+        )
+
     def init_app(self, app):
         app.jinja_env.globals.update(captcha_html=self.captcha_html)
 
+        if self.lazy_route is not None:
+            from flask import Blueprint
+
+            bp = Blueprint(self.blueprint_name, __name__)
+            bp.add_url_rule('/<sealed>.<ext>', 'image', self.image_response)
+            app.register_blueprint(bp, url_prefix=self.lazy_route)
+
+        if self.metrics_route is not None:
+            app.add_url_rule(
+                self.metrics_route,
+                'simple_captcha_metrics',
+                self.metrics_response,
+            )
+
         return app
 
     def __repr__(self):
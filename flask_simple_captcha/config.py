@@ -9,24 +9,63 @@ DEFAULT_CONFIG = {
     'SECRET_CAPTCHA_KEY': 'LONGKEY',  # use for JWT encoding/decoding
     # CAPTCHA GENERATION SETTINGS
     'EXPIRE_SECONDS': 60 * 10,  # takes precedence over EXPIRE_MINUTES
-    'CAPTCHA_IMG_FORMAT': 'JPEG',  # 'PNG' or 'JPEG' (JPEG is 3X faster)
+    'CAPTCHA_IMG_FORMAT': 'JPEG',  # 'PNG', 'JPEG' or 'WEBP' (JPEG is fastest)
+    'CAPTCHA_IMG_PROFILE': None,  # None, 'fastest' or 'smallest'
+    'CAPTCHA_IMG_OPTIONS': {},  # encoder options e.g. {'quality': 70}
+    # 'werkzeug', 'hmac-sha256' or 'blake2b', the last two are much faster
+    'CAPTCHA_HASH_BACKEND': 'werkzeug',
+    # 'jwt' or 'compact' (smaller/faster token, does not use the hash backend)
+    'CAPTCHA_TOKEN_FORMAT': 'jwt',
+    # max verified tokens remembered to prevent resubmission (replays)
+    'REPLAY_STORE_MAX_ENTRIES': 100000,
+    'REPLAY_STORE_STRIPES': 16,  # independently locked parts
+    # pre-render up to POOL_SIZE captchas in a background thread (0 is off)
+    'POOL_SIZE': 0,
+    'POOL_MAX_AGE': 300,  # seconds a pre-rendered captcha can be handed out
+    # acreate/averify run in a 'thread'/'process' pool (or a thread Executor)
+    'ASYNC_EXECUTOR': 'thread',
+    'ASYNC_CONCURRENCY': 16,  # max acreate/averify calls running at once
     # CAPTCHA TEXT SETTINGS
     'CAPTCHA_LENGTH': 6,  # Length of the generated CAPTCHA text
     'CAPTCHA_DIGITS': False,  # Should digits be added to the character pool?
     'EXCLUDE_VISUALLY_SIMILAR': True,  # Exclude visually similar characters
     'BACKGROUND_COLOR': (0, 0, 0),  # RGB(A?) background color (default black)
     'TEXT_COLOR': (255, 255, 255),  # RGB(A?) text color (default white)
+    # CAPTCHA IMAGE SETTINGS
+    'IMG_WIDTH': 180,
+    'IMG_HEIGHT': 60,
+    'FONT_SIZE': 30,  # text is drawn at this size, then resized to w/h
+    'RENDER_AT_TARGET': False,  # draw at IMG_WIDTH/HEIGHT, skips the resize
+    'RESAMPLE': None,  # resize filter e.g. 'bilinear', Pillow's if None
+    'IMG_MODE': None,  # 'RGB', 'L', '1' or 'P', None picks from the colors
+    'NOISE': 12,  # amount of noise lines/ellipses (6 minimum)
+    'PIXEL_NOISE': 0.0,  # fraction of pixels speckled with the text color
+    'NOISE_BANK': 0,  # combine the noise from this many pre-drawn layers
+    'NOISE_BANK_REFRESH': 300,  # seconds to redraw every layer of the bank
     # Optional/Backwards Compatability settings
     #'EXPIRE_MINUTES': 10, # backwards compatibility concerns supports this too
     #'EXCLUDE_VISUALLY_SIMILAR': True,  # Optional
     #'ONLY_UPPERCASE': True,  # Optional
     #'CHARACTER_POOL': 'AaBb',  # Optional
     #'USE_TEXT_FONTS': ['RobotoMono-Bold'], # Only use these fonts in ./fonts
+    #'REPLAY_STORE': SQLiteReplayStore('/tmp/captcha.db'), # share replays
+    #'POOL_LOW_WATERMARK': 25, # refill the pool below this (POOL_SIZE / 2)
+    #'POOL_WORKERS': 4, # refill the pool with create_many worker processes
+    #'POOL_PATH': '/var/tmp/captcha-pool.db', # keep the pool in SQLite
+    #'ASYNC_WORKERS': 4, # size of the acreate/averify executor
+    #'ANSWER_LENGTHS': (6,),  # verify() rejects answers of other lengths
+    #'RANDOM_SEED': 0,  # reproducible texts/images, for tests/benchmarks only
+    #'METRICS': True,  # or callable(operation, stages, outcome), metrics.py
+    #'METRICS_ROUTE': '/metrics',  # Prometheus metrics, see init_app
+    #'LAZY_IMG_ROUTE': '/captcha', # serve images from here, see init_app
 }
 
 EXPIRE_NORMALIZED = DEFAULT_CONFIG['EXPIRE_SECONDS']
 
-# should add these to config and allow users to change them
-IMGHEIGHT = 60
-IMGWIDTH = 180
-FONTSIZE = 30
+# defaults of the IMG_HEIGHT, IMG_WIDTH and FONT_SIZE settings
+IMGHEIGHT = DEFAULT_CONFIG['IMG_HEIGHT']
+IMGWIDTH = DEFAULT_CONFIG['IMG_WIDTH']
+FONTSIZE = DEFAULT_CONFIG['FONT_SIZE']
+
+# max number of (font, size) FreeTypeFont objects kept loaded in memory
+FONT_CACHE_SIZE = 32
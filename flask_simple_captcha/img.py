@@ -1,142 +1,714 @@
 import os
 import random as ran
-from typing import Tuple, Optional, Union
-from PIL import Image, ImageDraw, ImageFont
+import string
+import threading
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple, Optional, Union
+from functools import lru_cache
+from PIL import Image, ImageChops, ImageColor, ImageDraw, ImageFont
 from io import BytesIO
 from base64 import b64encode
 from .utils import gen_captcha_text, jwtencrypt
 from .config import DEFAULT_CONFIG as _DEF, IMGHEIGHT, IMGWIDTH, FONTSIZE
-from .text import CaptchaFont
+from .formats import (
+    IMG_EXTENSIONS,
+    IMG_MIMETYPES,
+    IMG_PROFILES,
+    get_img_options,
+)
+from .text import CaptchaFont, load_font
+
+if TYPE_CHECKING:
+    from .noise import NoiseBank
+
+
+def encode_img(
+    captcha_img: Image, img_format: str = _DEF['CAPTCHA_IMG_FORMAT'], **options
+) -> bytes:
+    """Encode PIL image to bytes in img_format
+    Args:
+        captcha_img (Image): The PIL image to be encoded
+        img_format (str, optional): The image format to be used.
+            Defaults to 'JPEG'
+        **options: Pillow encoder options (e.g. quality, subsampling,
+            optimize, progressive, lossless, method) and for PNG colors,
+            the number of palette colors to reduce the image to.
+    Returns:
+        bytes: The encoded image
+    """
+    byte_array = BytesIO()
+    colors = options.pop('colors', None)
+    # '1' and 'P' images have few colors already ('1' can not be converted)
+    if (
+        colors is not None
+        and img_format == 'PNG'
+        and captcha_img.mode not in ('1', 'P')
+    ):
+        captcha_img = captcha_img.convert(
+            'P', palette=Image.ADAPTIVE, colors=colors
+        )
+    # JPEG is about ~3x faster
+    if img_format == 'JPEG':
+        options.setdefault('quality', 85)
+        if captcha_img.mode == 'P':
+            captcha_img = captcha_img.convert('RGB')
+    captcha_img.save(byte_array, format=img_format, **options)
+
+    return byte_array.getvalue()
 
 
 def convert_b64img(
-    captcha_img: Image, img_format: str = _DEF['CAPTCHA_IMG_FORMAT']
+    captcha_img: Image, img_format: str = _DEF['CAPTCHA_IMG_FORMAT'], **options
 ) -> str:
     """Convert PIL image to base64 string
     Args:
         captcha_img (Image): The PIL image to be converted
         img_format (str, optional): The image format to be used.
             Defaults to 'JPEG'
+        **options: encoder options, see encode_img
     Returns:
         str: The base64 encoded image string
     """
-    byte_array = BytesIO()
-    # JPEG is about ~3x faster
-    if img_format == 'JPEG':
-        captcha_img.save(byte_array, format=img_format, quality=85)
-    else:
-        captcha_img.save(byte_array, format=img_format)
-
-    return b64encode(byte_array.getvalue()).decode()
+    return b64encode(encode_img(captcha_img, img_format, **options)).decode()
 
 
 RGBAType = Union[Tuple[int, int, int, int], Tuple[int, int, int]]
 
 
+class GlyphAtlas:
+    """Pre-rasterized glyph masks for a single font at a single size.
+
+    Every character is rasterized once into an 'L' mode mask, drawing text
+    then becomes pasting the text color through those masks, which gives
+    the exact same pixels as ImageDraw.text. The masks do not depend on the
+    text color, so one atlas serves every color.
+    """
+
+    def __init__(self, font_path: str, font_size: int, chars: Iterable = ()):
+        self.font = load_font(font_path, font_size)
+        self.glyphs = {}  # type: Dict[str, Tuple[Image.Image, int, int]]
+        for c in chars:
+            self.glyph(c)
+
+    def glyph(self, char: str) -> Tuple[Image.Image, int, int]:
+        """Get the (mask, x offset, y offset) of char, rasterizing it on
+        first use. The offsets are relative to the ImageDraw.text origin.
+        """
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            left, top, right, bottom = self.font.getbbox(char)
+            mask = Image.new('L', (right - left, bottom - top), 0)
+            ImageDraw.Draw(mask).text(
+                (-left, -top), char, font=self.font, fill=255
+            )
+            glyph = self.glyphs[char] = (mask, left, top)
+        return glyph
+
+    def draw(
+        self, im: Image, xy: Tuple[int, int], char: str, fill: RGBAType
+    ) -> None:
+        """Draw char onto im at xy, same as ImageDraw.text(xy, char)"""
+        mask, left, top = self.glyph(char)
+        im.paste(fill, (xy[0] + left, xy[1] + top), mask)
+
+    def __repr__(self):
+        return '<GlyphAtlas %r %d glyphs>' % (self.font.getname(), len(self))
+
+    def __len__(self):
+        return len(self.glyphs)
+
+
+GLYPH_ATLASES = {}  # type: Dict[Tuple[str, int], GlyphAtlas]
+_ATLAS_LOCK = threading.Lock()
+
+
+def get_glyph_atlas(
+    font_path: str, font_size: int, chars: Iterable = ()
+) -> GlyphAtlas:
+    """Get the shared GlyphAtlas for font_path at font_size, building it
+    (with chars pre-rasterized) if it does not exist yet.
+    """
+    key = (font_path, font_size)
+    atlas = GLYPH_ATLASES.get(key)
+    if atlas is None:
+        with _ATLAS_LOCK:
+            atlas = GLYPH_ATLASES.get(key)
+            if atlas is None:
+                atlas = GLYPH_ATLASES[key] = GlyphAtlas(
+                    font_path, font_size, chars
+                )
+    return atlas
+
+
+# numpy only pays off for large batches of random numbers, below this many
+# its per call overhead makes it slower than the stdlib
+NUMPY_MIN_BATCH = 256
+_NP_RNG = None
+
+
+def _numpy_rng():
+    """numpy Generator, False if numpy is not installed"""
+    global _NP_RNG
+    if _NP_RNG is None:
+        try:
+            import numpy
+
+            _NP_RNG = numpy.random.default_rng()
+            # forked workers must not share the parent's random state
+            if hasattr(os, 'register_at_fork'):
+                os.register_at_fork(after_in_child=_reseed_numpy)
+        except ImportError:
+            _NP_RNG = False
+    return _NP_RNG
+
+
+def _reseed_numpy():
+    global _NP_RNG
+    _NP_RNG = None
+
+
+def randints(
+    bounds: List[Tuple[int, int]], rng: Optional[ran.Random] = None
+) -> List[int]:
+    """One random int per (low, high) pair of bounds (both inclusive),
+    drawn in a single batch from rng. Without rng, from numpy when
+    available for large batches, else from the random module.
+    """
+    if rng is None:
+        if len(bounds) >= NUMPY_MIN_BATCH:
+            np_rng = _numpy_rng()
+            if np_rng:
+                lows, highs = zip(*bounds)
+                highs = [hi + 1 for hi in highs]
+                return np_rng.integers(lows, highs).tolist()
+        rng = ran
+
+    r = rng.random
+    return [lo + int(r() * (hi - lo + 1)) for lo, hi in bounds]
+
+
+def noise_bounds(
+    w: int, h: int, noise: int = 12
+) -> Tuple[List[Tuple[int, int]], int]:
+    """The randints bounds of the noise parameters of a w x h image, and
+    how many of them are for lines (the rest are for ellipses)
+    """
+    n_lines = int(noise * 0.66)
+    n_ellipses = int(noise * 0.33)
+    bounds = [(0, w), (0, h)] * (n_lines * 2) + [
+        (0, w),
+        (0, h),
+        (4, w // 4),
+        (4, h // 4),
+    ] * n_ellipses
+    return bounds, n_lines * 4
+
+
+def noise_params(
+    w: int, h: int, noise: int = 12, rng: Optional[ran.Random] = None
+) -> Tuple[List[int], List[int]]:
+    """Random parameters of the noise drawn by draw_lines, as flat lists
+    of (x0, y0, x1, y1) per line and (x, y, radius x, radius y) per ellipse
+    """
+    bounds, n_line_values = noise_bounds(w, h, noise)
+    values = randints(bounds, rng)
+    return values[:n_line_values], values[n_line_values:]
+
+
 def draw_lines(
     im: Image,
     noise: int = 12,
     text_color: RGBAType = (255, 255, 255),
     **kwargs,
 ) -> Image:
-    """Draws complex background noise on the image."""
+    """Draws complex background noise on the image.
+
+    The optional kwargs are draw (an ImageDraw of im), width (of the
+    lines), params (from noise_params, drawn instead of new random ones)
+    and rng (a random.Random to draw the parameters from).
+    """
     draw = kwargs.get('draw', None)
     if draw is None:
         draw = ImageDraw.Draw(im)
+    width = kwargs.get('width', 2)
 
-    w, h = im.size
-
-    line_starts = [
-        (ran.randint(0, w), ran.randint(0, h))
-        for _ in range(int(noise * 0.66) * 2)
-    ]
+    params = kwargs.get('params')
+    if params is None:
+        params = noise_params(im.size[0], im.size[1], noise, kwargs.get('rng'))
+    lines, ellipses = params
 
     # Draw lines
-    for i in range(0, len(line_starts) - 1, 2):
-        x0, y0 = line_starts[i]
-        x1, y1 = line_starts[i + 1]
-        draw.line((x0, y0, x1, y1), fill=text_color, width=2)
-
-    ellipse_centers = [
-        (ran.randint(0, w), ran.randint(0, h))
-        for _ in range(int(noise * 0.33))
-    ]
+    for i in range(0, len(lines), 4):
+        draw.line(lines[i : i + 4], fill=text_color, width=width)
 
     # Draw ellipses
-    for center_x, center_y in ellipse_centers:
-        radius_x = ran.randint(4, w // 4)
-        radius_y = ran.randint(4, h // 4)
-        upper_left = (center_x - radius_x, center_y - radius_y)
-        lower_right = (center_x + radius_x, center_y + radius_y)
-        draw.ellipse((upper_left + lower_right), outline=text_color, width=2)
+    for i in range(0, len(ellipses), 4):
+        center_x, center_y, radius_x, radius_y = ellipses[i : i + 4]
+        draw.ellipse(
+            (
+                center_x - radius_x,
+                center_y - radius_y,
+                center_x + radius_x,
+                center_y + radius_y,
+            ),
+            outline=text_color,
+            width=width,
+        )
 
     return im
 
 
+@lru_cache(maxsize=8)
+def noise_texture(size: Tuple[int, int], density: float) -> Image:
+    """'L' mask with a random density fraction of its pixels set to 255,
+    generated once per (size, density)
+    """
+    threshold = round(density * 256)
+    noise = Image.frombytes('L', size, os.urandom(size[0] * size[1]))
+    return noise.point([255 if v < threshold else 0 for v in range(256)])
+
+
+def draw_pixel_noise(
+    im: Image,
+    density: float,
+    color: Union[RGBAType, int],
+    offset: Optional[Tuple[int, int]] = None,
+) -> Image:
+    """Speckle a density fraction of the pixels of im with color, using a
+    precomputed noise_texture shifted by offset (random if None) as a mask.
+    """
+    if offset is None:
+        offset = (ran.randrange(im.size[0]), ran.randrange(im.size[1]))
+    mask = ImageChops.offset(noise_texture(im.size, density), *offset)
+    im.paste(color, (0, 0), mask)
+    return im
+
+
+def rgb_color(color: Union[RGBAType, int, str]) -> Union[RGBAType, int]:
+    """color as a tuple (or int), Pillow color strings like 'red' or
+    '#ff0000' are converted with ImageColor.getrgb
+    """
+    if isinstance(color, str):
+        return ImageColor.getrgb(color)
+    return color
+
+
+def is_grey(color: Union[RGBAType, int]) -> bool:
+    """Check if color is a shade of grey (r == g == b)"""
+    return isinstance(color, int) or color[0] == color[1] == color[2]
+
+
+def to_grey(color: Union[RGBAType, int]) -> int:
+    """The 'L' mode (luminance) value of color"""
+    if isinstance(color, int):
+        return color
+    if is_grey(color):
+        return color[0]
+    return ImageColor.getcolor('rgb(%d,%d,%d)' % tuple(color[:3]), 'L')
+
+
+def auto_img_mode(
+    back_color: RGBAType, text_color: RGBAType, img_format: str
+) -> str:
+    """The cheapest image mode able to show back_color and text_color:
+    'L' for two shades of grey, 'P' for other colors (except for JPEG,
+    which can't store palette images), else 'RGB'.
+    """
+    back_color, text_color = rgb_color(back_color), rgb_color(text_color)
+    if is_grey(back_color) and is_grey(text_color):
+        return 'L'
+    if img_format != 'JPEG':
+        return 'P'
+    return 'RGB'
+
+
+@lru_cache(maxsize=32)
+def gradient_palette(back_color: RGBAType, text_color: RGBAType) -> list:
+    """256 color palette fading from back_color (index 0) to text_color
+    (index 255), applied to an 'L' intensity image it colorizes it.
+    """
+    palette = []
+    for i in range(256):
+        palette.extend(
+            round(b + (t - b) * i / 255)
+            for b, t in zip(back_color[:3], text_color[:3])
+        )
+    return palette
+
+
+def target_font_size(length: int, size: Tuple[int, int]) -> int:
+    """The largest font size at which a CAPTCHA text of length characters
+    fits in an image of size, see CaptchaRenderer(at_target=True).
+    """
+    # monospace glyphs are ~0.6 font sizes wide, the text gets 1.25x its
+    # width and 1.5x the font size
+    return max(1, int(min(size[0] / (length * 0.75), size[1] / 1.5)))
+
+
+def get_resample(resample: Union[int, str, None]) -> Optional[int]:
+    """Resampling filter from a Pillow constant or name like 'bilinear'"""
+    if isinstance(resample, str):
+        return getattr(Image, resample.upper())
+    return resample
+
+
 def create_text_img(
     text: str,
     font_path: str,
     font_size: int = FONTSIZE,
     back_color: RGBAType = (0, 0, 0, 255),
     text_color: RGBAType = (255, 255, 255),
+    size: Optional[Tuple[int, int]] = None,
+    at_target: bool = False,
+    resample: Union[int, str, None] = None,
+    mode: str = 'RGB',
+    noise: int = 12,
+    pixel_noise: float = 0.0,
+    timer=None,
+    rng: Optional[ran.Random] = None,
+    noise_bank: Optional['NoiseBank'] = None,
 ) -> Image:
     """Create a PIL image of the CAPTCHA text.
     Args:
         text (str): The CAPTCHA text to be drawn.
         font_path (str): The path to the font to be used.
-        img_format (str): The image format to be used.
-            Defaults to 'JPEG'
+        font_size (int): The font size to be used, ignored if at_target.
+            Defaults to FONTSIZE
         back_color (RGBAType): The background color to be used.
             Defaults to (0, 0, 0, 255)
         text_color (RGBAType): The text color to be used.
             Defaults to (255, 255, 255)
+        size (Tuple[int, int], optional): The (width, height) of the image.
+            Defaults to (IMGWIDTH, IMGHEIGHT)
+        at_target (bool): Draw directly at size, with the font scaled to
+            fit, instead of drawing at font_size and resizing.
+            Defaults to False
+        resample (Union[int, str], optional): Resampling filter (Pillow
+            constant or name) used when resizing. Defaults to Pillow's.
+        mode (str): The image mode, 'RGB', 'L' (colors drawn as greys),
+            '1' or 'P'. '1' and 'P' are drawn as intensities in 'L' and
+            colorized with a palette at the end. Defaults to 'RGB'
+        noise (int): The amount of noise lines/ellipses, see draw_lines.
+            Defaults to 12
+        pixel_noise (float): Fraction of pixels to speckle with the text
+            color, see draw_pixel_noise. Defaults to 0.0
+        timer (StageTimer, optional): marks the 'font', 'draw', 'noise' and
+            'resize' stages when given. Defaults to None
+        rng (random.Random, optional): source of the layout randomness,
+            see randints. Defaults to None
+        noise_bank (NoiseBank, optional): combine the noise from its
+            pre-drawn layers instead of drawing it. Defaults to None
     Returns:
         Image: The PIL image of the CAPTCHA text.
     """
-    # roboto mono assumed to be 0.6x width of $size * char width
-    char_w = round(font_size * 0.6)
-    actual_txt_w = len(text) * char_w
-    txt_w = font_size * len(text)
-    txt_h = font_size
+    size = (IMGWIDTH, IMGHEIGHT) if size is None else tuple(size)
+    renderer = _text_img_renderer(
+        font_path,
+        font_size,
+        _hashable_color(back_color),
+        _hashable_color(text_color),
+        size,
+        at_target,
+        resample,
+        mode,
+        noise,
+        pixel_noise,
+        noise_bank,
+    )
+    return renderer.render(text, rng, timer)
 
-    fnt = ImageFont.truetype(font_path, font_size)
 
-    # background should be slightly larger than text
-    back_w, back_h = (round(actual_txt_w * 1.25), round(txt_h * 1.5))
+def _hashable_color(color: Union[RGBAType, int, str]):
+    return color if isinstance(color, (int, str)) else tuple(color)
 
-    # each char is randomly placed in a segment of the background
-    txt_seg_w = int(back_w / len(text))  # rounds down
 
-    # gap between background h/w and text h/w
-    seg_gap_h = int(back_h - txt_h)  # rounds down
+@lru_cache(maxsize=32)
+def _text_img_renderer(
+    font_path, font_size, back_color, text_color, size, at_target, *args
+) -> 'CaptchaRenderer':
+    # the CaptchaRenderer of the create_text_img arguments, kept for reuse
+    resample, mode, noise, pixel_noise, noise_bank = args
+    return CaptchaRenderer(
+        [font_path],
+        size=size,
+        font_size=font_size,
+        back_color=back_color,
+        text_color=text_color,
+        mode=mode,
+        at_target=at_target,
+        resample=resample,
+        noise=noise,
+        pixel_noise=pixel_noise,
+        noise_bank=noise_bank,
+    )
 
-    # create background image
-    back_img = Image.new('RGB', (back_w, back_h), color=back_color)
 
-    # only initialize drawer once
-    drawer = ImageDraw.Draw(back_img)
+def draw_colors(
+    mode: str, back_color: RGBAType, text_color: RGBAType
+) -> Tuple[tuple, Union[RGBAType, int], Union[RGBAType, int]]:
+    """The (back, text) RGB colors of the final image and the background
+    and text colors to draw with in mode: greys for 'L', intensities for
+    '1' and 'P' (colorized by finish_img).
+    """
+    back_color, text_color = rgb_color(back_color), rgb_color(text_color)
+    # low bit depth modes draw on a single channel
+    colors = tuple(
+        (c, c, c) if isinstance(c, int) else tuple(c[:3])
+        for c in (back_color, text_color)
+    )
+    if mode == 'L':
+        back_color, text_color = to_grey(back_color), to_grey(text_color)
+    elif mode in ('1', 'P'):
+        back_color, text_color = 0, 255
+    return colors, back_color, text_color
 
-    char_chords = []
 
-    for i, c in enumerate(text):
-        startx = i * txt_seg_w
-        endx = startx + (txt_seg_w - char_w)
-        # roboto mono seems to appear slightly under the baseline
-        starty = -5
-        endy = seg_gap_h - 5
+def finish_img(
+    img: Image,
+    size: Tuple[int, int],
+    resample: Optional[int],
+    mode: str,
+    colors: tuple,
+) -> Image:
+    """Resize img to size and turn the intensities drawn for mode '1' or
+    'P' into the (back, text) colors.
+    """
+    if img.size != size:
+        if resample is None:
+            img = img.resize(size)
+        else:
+            img = img.resize(size, resample)
 
-        ranx = ran.randint(startx, endx)
-        rany = ran.randint(starty, endy)
+    if mode == '1':
+        img = img.convert('1', dither=Image.NONE)
+        if colors != ((0, 0, 0), (255, 255, 255)):
+            img = img.convert('L')
+            img.putpalette(gradient_palette(*colors))
+    elif mode == 'P':
+        img.putpalette(gradient_palette(*colors))
+    return img
 
-        char_chords.append((ranx, rany))
 
-        drawer.text((ranx, rany), c, font=fnt, fill=text_color)
+class TextLayout:
+    """Where the characters of a text of a given length may be drawn with
+    a font at a size, worked out from the real glyph metrics: every
+    character is randomly placed in its segment of the canvas, with its
+    ink inside the segment and the canvas.
+    """
 
-    # 6 minimum
-    back_img = draw_lines(
-        back_img, noise=12, draw=drawer, text_color=text_color
-    )
+    __slots__ = ('atlas', 'canvas', 'seg_w', 'line_width', '_ranges')
+
+    def __init__(
+        self,
+        atlas: GlyphAtlas,
+        chars: Iterable[str],
+        length: int,
+        canvas: Optional[Tuple[int, int]] = None,
+        line_width: int = 2,
+    ):
+        self.atlas = atlas
+        self.line_width = line_width
+        if canvas is None:
+            # slightly larger than the text
+            font = atlas.font
+            advance = max(font.getlength(c) for c in chars)
+            canvas = (round(length * advance * 1.25), round(font.size * 1.5))
+        self.canvas = canvas
+        self.seg_w = canvas[0] // length
+        # char -> (x low, x high, y low, y high) from its segment's start
+        self._ranges = {}  # type: Dict[str, Tuple[int, int, int, int]]
+        for c in chars:
+            self.char_range(c)
+
+    def char_range(self, char: str) -> Tuple[int, int, int, int]:
+        """The range of the drawing origin of char, relative to the start
+        of its segment, which keeps its ink inside
+        """
+        ranges = self._ranges.get(char)
+        if ranges is None:
+            mask, left, top = self.atlas.glyph(char)
+            w, h = mask.size
+            ranges = self._ranges[char] = (
+                _span(-left, self.seg_w - w - left),
+                _span(-top, self.canvas[1] - h - top),
+            )
+        return ranges
+
+    def bounds(self, text: str) -> List[Tuple[int, int]]:
+        """The randints bounds of the x and y of every char of text"""
+        bounds = []
+        seg_w = self.seg_w
+        for i, c in enumerate(text):
+            (x_lo, x_hi), y_range = self.char_range(c)
+            bounds += [(i * seg_w + x_lo, i * seg_w + x_hi), y_range]
+        return bounds
+
+    def __repr__(self):
+        return '<TextLayout %dx%d>' % self.canvas
+
+
+def _span(lo: int, hi: int) -> Tuple[int, int]:
+    # centered when the ink does not fit
+    if hi < lo:
+        lo = hi = (lo + hi) // 2
+    return lo, hi
+
+
+class CaptchaRenderer:
+    """Renders the CAPTCHA images of one configuration.
+
+    Everything which does not depend on the text is worked out once: the
+    colors and mode to draw in, the glyph atlases of every font and, per
+    font and text length, a TextLayout from the real glyph metrics.
+    render(text) then just draws the random numbers and pastes.
+    """
+
+    def __init__(
+        self,
+        font_paths: Iterable[str],
+        chars: Iterable[str] = string.ascii_letters + string.digits,
+        size: Tuple[int, int] = (_DEF['IMG_WIDTH'], _DEF['IMG_HEIGHT']),
+        font_size: int = _DEF['FONT_SIZE'],
+        back_color: RGBAType = (0, 0, 0),
+        text_color: RGBAType = (255, 255, 255),
+        mode: str = 'RGB',
+        at_target: bool = False,
+        resample: Union[int, str, None] = None,
+        noise: int = _DEF['NOISE'],
+        pixel_noise: float = _DEF['PIXEL_NOISE'],
+        noise_bank: Optional['NoiseBank'] = None,
+        lengths: Iterable[int] = (),
+    ):
+        """
+        Args:
+            font_paths (Iterable[str]): The fonts to pick from.
+            chars (Iterable[str]): The characters texts are made of, the
+                layouts keep all of them inside the image.
+            size (Tuple[int, int]): The (width, height) of the images.
+            font_size (int): The font size, when not at_target.
+            back_color, text_color, mode, at_target, resample, noise,
+            pixel_noise, noise_bank: see create_text_img
+            lengths (Iterable[int]): Text lengths to lay out right away,
+                others are laid out on first use.
+        """
+        self.font_paths = tuple(font_paths)
+        self.chars = tuple(chars)
+        self.size = tuple(size)
+        self.font_size = font_size
+        self.mode = mode
+        self.at_target = at_target
+        self.resample = get_resample(resample)
+        self.noise = noise
+        self.pixel_noise = pixel_noise
+        self.noise_bank = noise_bank
+        self.colors, self.back_color, self.text_color = draw_colors(
+            mode, back_color, text_color
+        )
+        self.draw_mode = 'RGB' if mode == 'RGB' else 'L'
+        self._layouts = {}  # type: Dict[Tuple[int, int], TextLayout]
+        for length in lengths:
+            for index in range(len(self.font_paths)):
+                self.layout(index, length)
+
+    def layout(self, font_index: int, length: int) -> TextLayout:
+        """The TextLayout of a text of length with the font_index'th font"""
+        key = (font_index, length)
+        layout = self._layouts.get(key)
+        if layout is None:
+            path = self.font_paths[font_index]
+            font_size = self.text_font_size(length)
+            if self.at_target:
+                canvas = self.size
+                # lines as thick as they'd be after resizing from font_size
+                width = max(1, round(2 * font_size / self.font_size))
+            else:
+                canvas, width = None, 2
+            atlas = get_glyph_atlas(path, font_size, self.chars)
+            layout = TextLayout(atlas, self.chars, length, canvas, width)
+            self._layouts[key] = layout
+        return layout
+
+    def text_font_size(self, length: int) -> int:
+        """The font size texts of length are drawn at"""
+        if self.at_target:
+            return target_font_size(length, self.size)
+        return self.font_size
+
+    def render(
+        self,
+        text: str,
+        rng: Optional[ran.Random] = None,
+        timer=None,
+        use_noise_bank: bool = True,
+    ) -> Image:
+        """Render the image of text.
+
+        Args:
+            text (str): The CAPTCHA text to be drawn.
+            rng (random.Random, optional): source of the font choice and
+                layout randomness, see randints. Defaults to None
+            timer (StageTimer, optional): marks the 'font', 'draw', 'noise'
+                and 'resize' stages when given. Defaults to None
+            use_noise_bank (bool): combine the noise from the noise_bank,
+                if any, instead of drawing it. Defaults to True
+        Returns:
+            Image: The PIL image of the CAPTCHA text.
+        """
+        n_fonts = len(self.font_paths)
+        font_index = randints([(0, n_fonts - 1)], rng)[0] if n_fonts > 1 else 0
+        layout = self.layout(font_index, len(text))
+        if timer is not None:
+            timer.mark('font')
+
+        # every other random number of the image at once: the position of
+        # every char, the noise and the pixel noise offset
+        back_w, back_h = layout.canvas
+        bank = self.noise_bank if use_noise_bank else None
+        if bank is not None:
+            noise_b, n_line_values = bank.bounds(layout.canvas), 0
+        else:
+            noise_b, n_line_values = noise_bounds(back_w, back_h, self.noise)
+        char_bounds = layout.bounds(text)
+        bounds = char_bounds + noise_b
+        if self.pixel_noise:
+            bounds += [(0, back_w - 1), (0, back_h - 1)]
+        values = randints(bounds, rng)
+
+        img = Image.new(self.draw_mode, layout.canvas, self.back_color)
+        atlas, text_color = layout.atlas, self.text_color
+        for i, c in enumerate(text):
+            atlas.draw(img, (values[2 * i], values[2 * i + 1]), c, text_color)
+        if timer is not None:
+            timer.mark('draw')
+
+        n = len(char_bounds)
+        noise_values = values[n : n + len(noise_b)]
+        if bank is not None:
+            bank.draw(img, text_color, layout.line_width, noise_values)
+        else:
+            draw_lines(
+                img,
+                noise=self.noise,
+                text_color=text_color,
+                width=layout.line_width,
+                params=(
+                    noise_values[:n_line_values],
+                    noise_values[n_line_values:],
+                ),
+            )
+        if self.pixel_noise:
+            offset = tuple(values[n + len(noise_b) :])
+            draw_pixel_noise(img, self.pixel_noise, text_color, offset)
+        if timer is not None:
+            timer.mark('noise')
 
-    back_img = back_img.resize((IMGWIDTH, IMGHEIGHT))
+        img = finish_img(img, self.size, self.resample, self.mode, self.colors)
+        if timer is not None:
+            timer.mark('resize')
+        return img
 
-    return back_img
+    def __repr__(self):
+        return '<CaptchaRenderer %d fonts %dx%d %s>' % (
+            len(self.font_paths),
+            *self.size,
+            self.mode,
+        )
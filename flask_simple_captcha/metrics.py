@@ -0,0 +1,259 @@
+import threading
+import weakref
+from bisect import bisect_left
+from time import perf_counter
+from typing import Dict, Optional, Tuple
+
+# metric name prefix of the Prometheus exposition
+PREFIX = 'flask_simple_captcha'
+
+# upper bounds (seconds) of the latency histogram buckets, the last bucket
+# (+Inf) catches everything slower
+LATENCY_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+class StageTimer:
+    """Times the consecutive stages of a single operation.
+
+    mark(stage) attributes the time since the previous mark (or since the
+    timer was created) to stage, so the stages add up to the total. The
+    operation sets outcome to tell how it ended.
+    """
+
+    __slots__ = ('stages', 'outcome', '_last')
+
+    def __init__(self):
+        self.stages = {}  # type: Dict[str, float]
+        self.outcome = None  # type: Optional[str]
+        self._last = perf_counter()
+
+    def mark(self, stage: str):
+        now = perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def __repr__(self):
+        return '<StageTimer %r %r>' % (self.outcome, self.stages)
+
+
+class Histogram:
+    """Fixed bucket latency histogram, not thread safe on its own"""
+
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def snapshot(self) -> dict:
+        """count, sum and cumulative bucket counts keyed by upper bound,
+        like Prometheus histograms
+        """
+        cumulative, total = {}, 0
+        for le, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            cumulative[str(le)] = total
+        return {'count': total, 'sum': self.sum, 'buckets': cumulative}
+
+
+def _labels(**labels) -> str:
+    return ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+
+
+class _Shard:
+    """The histograms of one thread, held by its threading.local"""
+
+    __slots__ = ('histograms', '__weakref__')
+
+    def __init__(self):
+        self.histograms = {}  # type: Dict[tuple, Histogram]
+
+
+def _merge(
+    into: Dict[tuple, Histogram],
+    histograms: Dict[tuple, Histogram],
+    buckets: Tuple[float, ...],
+):
+    # the recording thread may add keys meanwhile, hence the list()
+    for key, histogram in list(histograms.items()):
+        total = into.get(key)
+        if total is None:
+            total = into[key] = Histogram(buckets)
+        total.sum += histogram.sum
+        total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+
+
+def _retire(ref: 'weakref.ref', histograms: Dict[tuple, Histogram]):
+    # move the histograms of an exited thread into the retired ones
+    collector = ref()
+    if collector is None:
+        return
+    with collector._lock:
+        if collector._shards.pop(id(histograms), None) is not None:
+            _merge(collector._retired, histograms, collector.buckets)
+
+
+class StatsCollector:
+    """Metrics hook aggregating the stage durations and outcomes of every
+    operation into latency histograms.
+
+    Pass it as the METRICS config value (or assign it to CAPTCHA.metrics),
+    it is called with the name of the operation ('create' or 'verify'), a
+    dict of stage durations in seconds and the outcome of the operation.
+
+    Every thread records into its own histograms, so recording never
+    waits on other threads, stats() adds them up. The histograms of a
+    thread which exits are added to the retired ones, so threads started
+    per request do not pile up.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        # histograms of the live threads by id, and of the exited ones
+        self._shards = {}  # type: Dict[int, Dict[tuple, Histogram]]
+        self._retired = {}  # type: Dict[tuple, Histogram]
+        # only taken when a thread records for the first time or exits
+        self._lock = threading.Lock()
+
+    def _shard(self) -> Dict[tuple, Histogram]:
+        try:
+            return self._local.shard.histograms
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards[id(shard.histograms)] = shard.histograms
+            # runs when the thread's locals are dropped, as it exits
+            weakref.finalize(
+                shard, _retire, weakref.ref(self), shard.histograms
+            )
+            return shard.histograms
+
+    def __call__(
+        self,
+        operation: str,
+        stages: Dict[str, float],
+        outcome: Optional[str] = None,
+    ):
+        shard = self._shard()
+        total = 0.0
+        for stage, seconds in stages.items():
+            key = ('stage', operation, stage)
+            self._histogram(shard, key).observe(seconds)
+            total += seconds
+        self._histogram(shard, ('stage', operation, 'total')).observe(total)
+        self._histogram(shard, ('outcome', operation, outcome)).observe(total)
+
+    def _histogram(self, shard: dict, key: tuple) -> Histogram:
+        histogram = shard.get(key)
+        if histogram is None:
+            histogram = shard[key] = Histogram(self.buckets)
+        return histogram
+
+    def _merged(self) -> Dict[tuple, Histogram]:
+        merged = {}  # type: Dict[tuple, Histogram]
+        with self._lock:
+            _merge(merged, self._retired, self.buckets)
+            for shard in self._shards.values():
+                _merge(merged, shard, self.buckets)
+        return merged
+
+    def _snapshot(self, kind: str) -> dict:
+        snapshot = {}
+        for (k, operation, name), histogram in self._merged().items():
+            if k == kind:
+                histograms = snapshot.setdefault(operation, {})
+                histograms[name] = histogram.snapshot()
+        return snapshot
+
+    def stats(self) -> dict:
+        """Snapshot of the stage histograms, {operation: {stage: histogram}}
+        with the whole operation as the 'total' stage
+        """
+        return self._snapshot('stage')
+
+    def outcomes(self) -> dict:
+        """Snapshot of the operation latency by outcome,
+        {operation: {outcome: histogram}}
+        """
+        return self._snapshot('outcome')
+
+    def reset(self):
+        with self._lock:
+            self._retired.clear()
+            for shard in self._shards.values():
+                shard.clear()
+
+    def exposition(
+        self, gauges: Optional[Dict[str, float]] = None, prefix: str = PREFIX
+    ) -> str:
+        """The metrics (and gauges, by name) in the Prometheus text format"""
+        lines = []
+        merged = sorted(self._merged().items(), key=lambda item: str(item[0]))
+
+        lines.append('# TYPE %s_operations_total counter' % prefix)
+        for (kind, operation, outcome), histogram in merged:
+            if kind == 'outcome':
+                lines.append(
+                    '%s_operations_total{%s} %d'
+                    % (
+                        prefix,
+                        _labels(operation=operation, outcome=outcome),
+                        sum(histogram.counts),
+                    )
+                )
+
+        for kind, name, label in (
+            ('outcome', 'duration_seconds', 'outcome'),
+            ('stage', 'stage_seconds', 'stage'),
+        ):
+            lines.append('# TYPE %s_%s histogram' % (prefix, name))
+            for (k, operation, value), histogram in merged:
+                if k != kind or (kind == 'stage' and value == 'total'):
+                    continue
+                labels = _labels(operation=operation, **{label: value})
+                snapshot = histogram.snapshot()
+                for le, count in snapshot['buckets'].items():
+                    lines.append(
+                        '%s_%s_bucket{%s,le="%s"} %d'
+                        % (prefix, name, labels, le, count)
+                    )
+                lines.append(
+                    '%s_%s_sum{%s} %r'
+                    % (prefix, name, labels, snapshot['sum'])
+                )
+                lines.append(
+                    '%s_%s_count{%s} %d'
+                    % (prefix, name, labels, snapshot['count'])
+                )
+
+        for name, value in (gauges or {}).items():
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            lines.append('%s_%s %r' % (prefix, name, value))
+        return '\n'.join(lines) + '\n'
+
+    def __repr__(self):
+        return '<StatsCollector threads=%d>' % len(self._shards)
@@ -0,0 +1,144 @@
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+
+from .config import DEFAULT_CONFIG
+from .img import RGBAType, draw_lines
+
+
+class NoiseBank:
+    """A bank of pre-drawn noise layers, pasted as the noise of every
+    captcha instead of drawing its lines and ellipses one by one.
+
+    A layer is an 'L' mode mask twice the size of the image, holding the
+    noise lines and ellipses together with its mirror images, drawn once
+    per image size and line width. A captcha crops a randomly placed
+    window out of a randomly picked layer (a shifted, wrapped around and
+    possibly flipped version of the noise) and pastes its text color
+    through it in a single step. The masks do not depend on the color, so
+    one bank serves every color.
+
+    A daemon thread redraws the layers one after another, renewing the
+    whole bank every refresh seconds, so the noise does not become
+    predictable from the images served.
+    """
+
+    def __init__(
+        self,
+        noise: int = DEFAULT_CONFIG['NOISE'],
+        layers: int = 16,
+        refresh: Optional[float] = DEFAULT_CONFIG['NOISE_BANK_REFRESH'],
+        seed: Union[int, str, None] = None,
+    ):
+        self.noise = noise
+        self.n_layers = layers
+        self.refresh = refresh
+        self._rng = random.Random(None if seed is None else 'noise:%r' % seed)
+        # (size, width) -> layers, replaced one at a time
+        self._layers = {}  # type: Dict[Tuple[Tuple[int, int], int], List]
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._pid = None  # type: Optional[int]
+
+    def _new_layer(self, size: Tuple[int, int], width: int) -> Image.Image:
+        # with self._lock held, self._rng is not thread safe
+        w, h = size
+        noise = draw_lines(
+            Image.new('L', size, 0),
+            noise=self.noise,
+            text_color=255,
+            width=width,
+            rng=self._rng,
+        )
+        layer = Image.new('L', (w * 2, h * 2), 0)
+        layer.paste(noise, (0, 0))
+        layer.paste(noise.transpose(Image.FLIP_LEFT_RIGHT), (w, 0))
+        layer.paste(noise.transpose(Image.FLIP_TOP_BOTTOM), (0, h))
+        layer.paste(noise.transpose(Image.ROTATE_180), (w, h))
+        return layer
+
+    def layers(self, size: Tuple[int, int], width: int) -> list:
+        """The layers for images of size and line width, drawn on first
+        use
+        """
+        key = (tuple(size), width)
+        layers = self._layers.get(key)
+        if layers is None:
+            with self._lock:
+                layers = self._layers.get(key)
+                if layers is None:
+                    layers = [
+                        self._new_layer(*key) for _ in range(self.n_layers)
+                    ]
+                    self._layers[key] = layers
+            if self.refresh:
+                self.start()
+        return layers
+
+    def bounds(self, size: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """The randints bounds of the values draw() takes for an image of
+        size: the index of the layer and the position of the window
+        """
+        return [(0, self.n_layers - 1), (0, size[0] - 1), (0, size[1] - 1)]
+
+    def draw(
+        self,
+        im: Image.Image,
+        color: Union[RGBAType, int],
+        width: int,
+        values: List[int],
+    ) -> Image.Image:
+        """Paste color through the window of the layer picked by values
+        (see bounds)
+        """
+        w, h = im.size
+        index, x, y = values
+        mask = self.layers(im.size, width)[index].crop((x, y, x + w, y + h))
+        im.paste(color, (0, 0), mask)
+        return im
+
+    def refresh_one(self):
+        """Redraw the next layer of every size"""
+        with self._lock:
+            for key, layers in self._layers.items():
+                layers[self._next % len(layers)] = self._new_layer(*key)
+            self._next += 1
+
+    def start(self):
+        """Start the refresh thread, in this process, if not running"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='captcha-noise', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the refresh thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        # one layer per interval, the whole bank every refresh seconds
+        while not self._stop.wait(self.refresh / self.n_layers):
+            self.refresh_one()
+
+    def __len__(self):
+        return sum(len(layers) for layers in self._layers.values())
+
+    def __repr__(self):
+        return '<NoiseBank %d layers x %d sizes>' % (
+            self.n_layers,
+            len(self._layers),
+        )
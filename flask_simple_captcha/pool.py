@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+from base64 import b64decode, b64encode
+from collections import deque
+from typing import Optional
+
+from .config import DEFAULT_CONFIG
+from .replay import thread_conn
+from .utils import open_sealed, seal_text
+
+# seconds SQLiteCaptchaPool entries keep when max_age is None
+DISK_MAX_AGE = 86400
+
+
+class CaptchaPool:
+    """Bounded pool of pre-rendered captchas, refilled in the background.
+
+    A daemon thread renders captchas whenever the pool drops below low and
+    keeps going until it holds high of them. Only the image and text are
+    pooled, the token is created when a captcha is taken out of the pool,
+    so its expiry always starts at get(). Pooled images older than max_age
+    seconds are discarded instead of being handed out. With workers > 1
+    the pool is refilled in batches by CAPTCHA.render_many.
+    """
+
+    def __init__(
+        self,
+        captcha,
+        high: int = 50,
+        low: Optional[int] = None,
+        max_age: Optional[float] = DEFAULT_CONFIG['POOL_MAX_AGE'],
+        workers: Optional[int] = None,
+    ):
+        self.captcha = captcha
+        self.high = high
+        self.low = high // 2 if low is None else low
+        self.max_age = max_age
+        self.workers = workers or 1
+        self._items = deque()  # (created, {'img': ..., 'text': ...})
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._pid = None  # type: Optional[int]
+
+    def start(self):
+        """Start the refill thread, in this process, if not running"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._cond:
+            # only one of the threads calling get() starts it
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='captcha-pool', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop the refill thread"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def fill(self, n: Optional[int] = None) -> int:
+        """Render captchas until the pool holds high (or n more), returns
+        the number of captchas added.
+        """
+        added = 0
+        while not self._stop.is_set() and (n is None or added < n):
+            todo = self.high - len(self) if n is None else n - added
+            if todo <= 0:
+                break
+            if self.workers > 1:
+                items = self.captcha.render_many(todo, self.workers)
+            else:
+                items = [self.captcha.render()]
+            self._put(items)
+            added += len(items)
+        return added
+
+    def _put(self, items: list):
+        now = time.monotonic()
+        with self._cond:
+            self._items.extend((now, item) for item in items)
+
+    def _pop(self) -> Optional[dict]:
+        """The oldest item not older than max_age, None if there is none"""
+        oldest = None
+        if self.max_age is not None:
+            oldest = time.monotonic() - self.max_age
+
+        with self._cond:
+            while self._items:
+                created, item = self._items.popleft()
+                if oldest is None or created >= oldest:
+                    return item
+        return None
+
+    def get(self) -> Optional[dict]:
+        """Take a captcha dict out of the pool, None if the pool is empty"""
+        if not self._stop.is_set():
+            self.start()
+        item = self._pop()
+        if len(self) < self.low:
+            with self._cond:
+                self._cond.notify()
+
+        if item is None:
+            return None
+        return {**item, 'hash': self.captcha.encrypt(item['text'])}
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while len(self) >= self.low and not self._stop.is_set():
+                    self._cond.wait()
+            self.fill()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __repr__(self):
+        return '<CaptchaPool %d/%d>' % (len(self), self.high)
+
+
+class SQLiteCaptchaPool(CaptchaPool):
+    """CaptchaPool kept in a SQLite database, so the pre-rendered captchas
+    survive restarts and deploys and are shared by every process on a host.
+
+    Only the image and the sealed text (see seal_text: encrypted, MACed
+    with the secret key and expiring after max_age) are stored, so reading
+    the file does not reveal the answers and tampered entries do not open.
+    An entry is claimed by selecting and deleting it in one write
+    transaction, so it is handed out once, whichever process asks.
+    Expired entries are skipped and deleted before every refill.
+    """
+
+    def __init__(
+        self,
+        captcha,
+        path: str,
+        high: int = 50,
+        low: Optional[int] = None,
+        max_age: Optional[float] = DEFAULT_CONFIG['POOL_MAX_AGE'],
+        workers: Optional[int] = None,
+        timeout: float = 5.0,
+    ):
+        super().__init__(captcha, high, low, max_age, workers)
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS pool (id INTEGER PRIMARY KEY, '
+            'exp INTEGER NOT NULL, img BLOB NOT NULL, sealed TEXT NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS pool_exp ON pool (exp)')
+
+    def _conn(self):
+        return thread_conn(self._local, self.path, self.timeout)
+
+    def fill(self, n: Optional[int] = None) -> int:
+        self.sweep()
+        return super().fill(n)
+
+    def _put(self, items: list):
+        ttl = int(DISK_MAX_AGE if self.max_age is None else self.max_age)
+        exp = int(time.time()) + ttl
+        secret = self.captcha.secret
+        rows = [
+            (exp, b64decode(item['img']), seal_text(item['text'], secret, ttl))
+            for item in items
+        ]
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            conn.executemany(
+                'INSERT INTO pool (exp, img, sealed) VALUES (?, ?, ?)', rows
+            )
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _claim(self) -> Optional[tuple]:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT id, img, sealed FROM pool WHERE exp > ? '
+                'ORDER BY id LIMIT 1',
+                (time.time(),),
+            ).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM pool WHERE id = ?', (row[0],))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return row
+
+    def _pop(self) -> Optional[dict]:
+        while True:
+            row = self._claim()
+            if row is None:
+                return None
+            # None if tampered with or sealed with another secret key
+            text = open_sealed(row[2], self.captcha.secret)
+            if text is not None:
+                return {'img': b64encode(row[1]).decode(), 'text': text}
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Delete the expired entries, returns how many were deleted"""
+        now = time.time() if now is None else now
+        cur = self._conn().execute('DELETE FROM pool WHERE exp <= ?', (now,))
+        return cur.rowcount
+
+    def clear(self):
+        self._conn().execute('DELETE FROM pool')
+
+    def __len__(self):
+        return (
+            self._conn()
+            .execute('SELECT COUNT(*) FROM pool WHERE exp > ?', (time.time(),))
+            .fetchone()[0]
+        )
+
+    def __repr__(self):
+        return '<SQLiteCaptchaPool %r %d/%d>' % (
+            self.path,
+            len(self),
+            self.high,
+        )
@@ -0,0 +1,264 @@
+import base64
+import hashlib
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+from .config import DEFAULT_CONFIG
+from .utils import is_token
+
+DIGEST_SIZE = 16
+
+
+def token_digest(token: str) -> bytes:
+    """Short fixed-size digest of a token, stored instead of the token.
+    Of a JWT or compact token it is taken of the decoded bytes of the JWT
+    signature (of all of a compact token), base64 spells the same bytes
+    several ways and each spelling of a signed token verifies.
+    """
+    key = token.encode()
+    if is_token(token):
+        mac = token.rpartition('.')[2]
+        try:
+            key = base64.urlsafe_b64decode(mac + '=' * (-len(mac) % 4))
+        except ValueError:
+            pass
+    return hashlib.blake2b(key, digest_size=DIGEST_SIZE).digest()
+
+
+def thread_conn(
+    local: threading.local, path: str, timeout: float
+) -> sqlite3.Connection:
+    """The autocommit, WAL mode connection to the SQLite database at path
+    of this thread (and process), kept in local
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        local.conn, local.pid = conn, os.getpid()
+    return conn
+
+
+class BaseReplayStore(ABC):
+    """Interface of the stores CAPTCHA uses to remember verified tokens.
+
+    A store can be passed to CAPTCHA through the REPLAY_STORE config key,
+    add() must be an atomic check-and-insert so a token is only ever
+    accepted once, even across threads or processes sharing the store.
+    """
+
+    @abstractmethod
+    def add(self, token: str, exp: Optional[int] = None) -> bool:
+        """Remember token until exp (unix time). Returns False if token
+        was already stored.
+        """
+
+    @abstractmethod
+    def __contains__(self, token: str) -> bool:
+        """Check if token is stored and not expired"""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of stored tokens"""
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Remove expired entries, returns how many were removed"""
+        return 0
+
+    @abstractmethod
+    def clear(self):
+        """Forget every stored token"""
+
+    def stats(self) -> dict:
+        """Size of the store, for monitoring"""
+        return {'entries': len(self)}
+
+
+class _Stripe:
+    """One independently locked part of a MemoryReplayStore"""
+
+    __slots__ = ('entries', 'heap', 'lock', 'max_entries', 'evicted')
+
+    def __init__(self, max_entries: int):
+        self.entries = {}  # type: Dict[bytes, int]
+        self.heap = []  # type: List[Tuple[int, bytes]]
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+        self.evicted = 0
+
+    def sweep(self, now: float) -> int:
+        removed = 0
+        heap = self.heap
+        while heap and heap[0][0] < now:
+            del self.entries[heapq.heappop(heap)[1]]
+            removed += 1
+        return removed
+
+
+class MemoryReplayStore(BaseReplayStore):
+    """Remembers verified tokens (as digests) until they expire.
+
+    A token that has expired can no longer verify anyway, so every entry is
+    kept in an expiry ordered heap and swept once its expiry has passed.
+    When max_entries is reached the entries closest to expiring are evicted
+    first, keeping memory use bounded even under a flood of verifications.
+
+    The entries are split by digest into stripes, each with its own lock,
+    so threads verifying different tokens rarely wait on each other. Each
+    stripe holds up to max_entries / stripes entries and evicts on its own.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_CONFIG['REPLAY_STORE_MAX_ENTRIES'],
+        default_ttl: int = DEFAULT_CONFIG['EXPIRE_SECONDS'],
+        stripes: int = 1,
+    ):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        per_stripe = max(1, -(-max_entries // stripes))
+        self._stripes = [_Stripe(per_stripe) for _ in range(stripes)]
+
+    def _stripe(self, digest: bytes) -> _Stripe:
+        return self._stripes[digest[0] % len(self._stripes)]
+
+    def add(self, token: str, exp: Optional[int] = None) -> bool:
+        """Remember token until exp (unix time, defaults to default_ttl
+        from now). Returns False if token was already stored.
+        """
+        now = time.time()
+        if exp is None:
+            exp = int(now) + self.default_ttl
+        digest = token_digest(token)
+        stripe = self._stripe(digest)
+
+        with stripe.lock:
+            if digest in stripe.entries:
+                return False
+            stripe.sweep(now)
+            while len(stripe.entries) >= stripe.max_entries:
+                _, old = heapq.heappop(stripe.heap)
+                del stripe.entries[old]
+                stripe.evicted += 1
+            stripe.entries[digest] = exp
+            heapq.heappush(stripe.heap, (exp, digest))
+        return True
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Remove expired entries, returns how many were removed"""
+        now = time.time() if now is None else now
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                removed += stripe.sweep(now)
+        return removed
+
+    def clear(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.heap.clear()
+
+    @property
+    def evicted(self) -> int:
+        return sum(stripe.evicted for stripe in self._stripes)
+
+    def stats(self) -> dict:
+        """Size of the store, for monitoring"""
+        return {
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'evicted': self.evicted,
+            'stripes': len(self._stripes),
+        }
+
+    def __contains__(self, token: str) -> bool:
+        digest = token_digest(token)
+        exp = self._stripe(digest).entries.get(digest)
+        return exp is not None and exp >= time.time()
+
+    def __len__(self):
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def __repr__(self):
+        return '<MemoryReplayStore %d/%d>' % (len(self), self.max_entries)
+
+
+class SQLiteReplayStore(BaseReplayStore):
+    """Replay store in a SQLite database, shared by every process on a host.
+
+    The database runs in WAL mode so readers never block on the writer,
+    add() is a single indexed INSERT OR IGNORE (atomic check-and-insert)
+    and expired entries are deleted in batches every sweep_every inserts
+    instead of on every write. Each thread (and forked process) gets its
+    own connection.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        default_ttl: int = DEFAULT_CONFIG['EXPIRE_SECONDS'],
+        sweep_every: int = 1000,
+        timeout: float = 5.0,
+    ):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.sweep_every = sweep_every
+        self.timeout = timeout
+        self._local = threading.local()
+        self._inserts = 0
+
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS replay '
+            '(digest BLOB PRIMARY KEY, exp INTEGER NOT NULL) WITHOUT ROWID'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS replay_exp ON replay (exp)')
+
+    def _conn(self) -> sqlite3.Connection:
+        return thread_conn(self._local, self.path, self.timeout)
+
+    def add(self, token: str, exp: Optional[int] = None) -> bool:
+        if exp is None:
+            exp = int(time.time()) + self.default_ttl
+        cur = self._conn().execute(
+            'INSERT OR IGNORE INTO replay VALUES (?, ?)',
+            (token_digest(token), exp),
+        )
+        self._inserts += 1
+        if self._inserts % self.sweep_every == 0:
+            self.sweep()
+        return cur.rowcount == 1
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        cur = self._conn().execute('DELETE FROM replay WHERE exp < ?', (now,))
+        return cur.rowcount
+
+    def clear(self):
+        self._conn().execute('DELETE FROM replay')
+
+    def __contains__(self, token: str) -> bool:
+        row = (
+            self._conn()
+            .execute(
+                'SELECT 1 FROM replay WHERE digest = ? AND exp >= ?',
+                (token_digest(token), time.time()),
+            )
+            .fetchone()
+        )
+        return row is not None
+
+    def __len__(self):
+        return (
+            self._conn().execute('SELECT COUNT(*) FROM replay').fetchone()[0]
+        )
+
+    def __repr__(self):
+        return '<SQLiteReplayStore %r>' % self.path
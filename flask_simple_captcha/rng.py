@@ -0,0 +1,172 @@
+import hashlib
+import hmac
+import itertools
+import os
+import random
+import threading
+import weakref
+from typing import Dict, Iterable, Tuple, Union
+
+# random bytes fetched from the OS at a time for CAPTCHA texts
+ENTROPY_CHUNK = 4096
+
+
+class Charset:
+    """A character pool compiled to a bytes.translate table mapping random
+    bytes to characters.
+
+    Bytes past the largest multiple of the pool size are dropped, so every
+    character is equally likely.
+    """
+
+    __slots__ = ('chars', '_table', '_delete', '_latin1')
+
+    def __init__(self, chars: Iterable[str]):
+        self.chars = tuple(chars)
+        n = len(self.chars)
+        if not 0 < n <= 256:
+            raise ValueError('a charset needs 1 to 256 characters, not %d' % n)
+
+        self._delete = bytes(range(256 - 256 % n, 256))
+        self._latin1 = all(ord(c) < 256 for c in self.chars)
+        if self._latin1:
+            # random byte -> the character itself
+            self._table = bytes(ord(self.chars[b % n]) for b in range(256))
+        else:
+            # random byte -> index of the character
+            self._table = bytes(b % n for b in range(256))
+
+    def decode(self, data: bytes) -> str:
+        """The characters picked by the random bytes in data, the rejected
+        bytes make it shorter than data.
+        """
+        picked = data.translate(self._table, self._delete)
+        if self._latin1:
+            return picked.decode('latin-1')
+        return ''.join([self.chars[i] for i in picked])
+
+    def __len__(self):
+        return len(self.chars)
+
+    def __repr__(self):
+        return '<Charset %r>' % ''.join(self.chars)
+
+
+class _ThreadRandom:
+    """The state a CaptchaRandom keeps per thread"""
+
+    __slots__ = ('layout', 'text_rng', 'entropy', 'pos')
+
+    def __init__(self, seed: Union[int, str, None], stream: int):
+        if seed is not None and stream:
+            # every further thread of a seeded instance gets its own stream
+            seed = '%r:%d' % (seed, stream)
+        self.layout = random.Random(seed)
+        self.text_rng = None
+        if seed is not None:
+            self.text_rng = random.Random('text:%r' % (seed,))
+        self.entropy = b''
+        self.pos = 0
+
+
+class CaptchaRandom:
+    """The randomness of one CAPTCHA instance.
+
+    CAPTCHA texts come from os.urandom, fetched ENTROPY_CHUNK bytes at a
+    time and mapped to characters by a precompiled Charset. The image
+    layout (character positions, noise, font) comes from layout, a
+    random.Random of its own.
+
+    Every thread has its own entropy buffer and layout, so threads sharing
+    an instance never wait on each other. With a seed both are
+    reproducible (per thread), for tests and benchmarks only: the texts are
+    not secret anymore.
+    """
+
+    def __init__(self, seed: Union[int, str, None] = None):
+        self.seed = seed
+        self._charsets = {}  # type: Dict[Tuple[str, ...], Charset]
+        self._lock = threading.Lock()
+        self._new_local()
+        _INSTANCES.add(self)
+
+    def _new_local(self):
+        self._streams = itertools.count()
+        self._local = threading.local()
+
+    def _state(self) -> _ThreadRandom:
+        try:
+            return self._local.state
+        except AttributeError:
+            # only taken when a thread draws for the first time
+            with self._lock:
+                stream = next(self._streams)
+            state = self._local.state = _ThreadRandom(self.seed, stream)
+            return state
+
+    @property
+    def layout(self) -> random.Random:
+        """The random.Random of the calling thread, for image layouts"""
+        return self._state().layout
+
+    def entropy(self, n: int) -> bytes:
+        """n random bytes, never handed out twice"""
+        state = self._state()
+        if state.pos + n > len(state.entropy):
+            size = max(n, ENTROPY_CHUNK)
+            if state.text_rng is None:
+                state.entropy = os.urandom(size)
+            else:
+                bits = state.text_rng.getrandbits(size * 8)
+                state.entropy = bits.to_bytes(size, 'little')
+            state.pos = 0
+        data = state.entropy[state.pos : state.pos + n]
+        state.pos += n
+        return data
+
+    def charset(self, chars: Iterable[str]) -> Charset:
+        """The compiled Charset of chars, cached"""
+        key = tuple(chars)
+        charset = self._charsets.get(key)
+        if charset is None:
+            charset = self._charsets.setdefault(key, Charset(key))
+        return charset
+
+    def text(self, length: int, chars: Iterable[str]) -> str:
+        """A random text of length characters picked from chars"""
+        charset = self.charset(chars)
+        text = ''
+        while len(text) < length:
+            # a few spare bytes, so rejected ones rarely need another round
+            text += charset.decode(self.entropy(length - len(text) + 4))
+        return text[:length]
+
+    def _after_fork(self):
+        # a forked child must not hand out its parent's texts and layouts,
+        # nor wait for a lock held by a thread which only exists there
+        self._lock = threading.Lock()
+        self._new_local()
+
+    def __repr__(self):
+        return '<CaptchaRandom seed=%r>' % (self.seed,)
+
+
+_INSTANCES = weakref.WeakSet()  # type: weakref.WeakSet[CaptchaRandom]
+
+
+def _reseed_after_fork():
+    for instance in list(_INSTANCES):
+        instance._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reseed_after_fork)
+
+
+def token_layout(secret_key: str, token: str) -> random.Random:
+    """A random.Random seeded from the HMAC of token, the same for every
+    fetch of a lazy image yet unpredictable without the secret key.
+    """
+    key = secret_key.encode()
+    digest = hmac.new(key, token.encode(), hashlib.sha256).digest()
+    return random.Random(int.from_bytes(digest, 'big'))
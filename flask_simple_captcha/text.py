@@ -1,8 +1,17 @@
 import os
 import os.path as op
 import re
-from typing import Optional, List, Tuple, Union
+import threading
+from collections import OrderedDict
 from glob import glob
+from io import BytesIO
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+from .config import FONT_CACHE_SIZE
+
+# Pillow is imported on first use, not for importing this module
+if TYPE_CHECKING:
+    from PIL import ImageFont
 
 
 class CaptchaFont:
@@ -11,19 +20,123 @@ class CaptchaFont:
         self.name = '.'.join(self.filename.split('.')[:-1])
         self.path = path
 
+    def truetype(self, size: int) -> 'ImageFont.FreeTypeFont':
+        """Return a cached FreeTypeFont of this font at the given size"""
+        return FONT_CACHE.get(self, size)
+
     def __repr__(self):
         return '<CaptchaFont %r>' % self.name
 
 
+class FontCache:
+    """Process-wide cache of loaded fonts.
+
+    The raw bytes of every font file are read from disk only once, and
+    ready-made FreeTypeFont objects are kept per (font path, size), with the
+    least recently used ones evicted once maxsize is exceeded.
+    """
+
+    def __init__(self, maxsize: int = FONT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = {}  # type: Dict[str, bytes]
+        self._fonts = OrderedDict()  # (path, size) -> FreeTypeFont
+        self._lock = threading.Lock()
+
+    def font_bytes(self, path: str) -> bytes:
+        """Return the raw bytes of the font file at path, read only once"""
+        data = self._data.get(path)
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+            with self._lock:
+                data = self._data.setdefault(path, data)
+        return data
+
+    def get(
+        self, font: Union[CaptchaFont, str], size: int
+    ) -> 'ImageFont.FreeTypeFont':
+        """Get a FreeTypeFont for font at size, loading it if not cached
+        Args:
+            font (Union[CaptchaFont, str]): CaptchaFont object or font path
+            size (int): The font size
+        Returns:
+            FreeTypeFont: the loaded font
+        """
+        path = font.path if isinstance(font, CaptchaFont) else font
+        key = (path, size)
+        with self._lock:
+            fnt = self._fonts.get(key)
+            if fnt is not None:
+                self._fonts.move_to_end(key)
+                return fnt
+
+        from PIL import ImageFont
+
+        fnt = ImageFont.truetype(BytesIO(self.font_bytes(path)), size)
+
+        with self._lock:
+            self._fonts[key] = fnt
+            while len(self._fonts) > self.maxsize:
+                self._fonts.popitem(last=False)
+        return fnt
+
+    def clear(self):
+        """Drop all cached fonts and font file bytes"""
+        with self._lock:
+            self._fonts.clear()
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._fonts)
+
+    def __repr__(self):
+        return '<FontCache %d/%d>' % (len(self._fonts), self.maxsize)
+
+
+FONT_CACHE = FontCache()
+
 FONTS_DIR = op.join(op.dirname(op.abspath(__file__)), 'fonts')
-FONT_PATHS = glob(op.join(FONTS_DIR, '*.ttf'))
-FONT_NAMES = [op.basename(p) for p in FONT_PATHS]
 
-CAPTCHA_FONTS = [CaptchaFont(p) for p in FONT_PATHS]
+_CAPTCHA_FONTS = None  # type: Optional[List[CaptchaFont]]
+
+
+def captcha_fonts() -> List[CaptchaFont]:
+    """The fonts bundled in FONTS_DIR, looked up on first use"""
+    global _CAPTCHA_FONTS
+    if _CAPTCHA_FONTS is None:
+        _CAPTCHA_FONTS = [
+            CaptchaFont(p) for p in glob(op.join(FONTS_DIR, '*.ttf'))
+        ]
+    return _CAPTCHA_FONTS
+
+
+def __getattr__(name: str):
+    # CAPTCHA_FONTS, FONT_PATHS and FONT_NAMES only search FONTS_DIR once
+    # they are used
+    if name == 'CAPTCHA_FONTS':
+        return captcha_fonts()
+    if name == 'FONT_PATHS':
+        return [font.path for font in captcha_fonts()]
+    if name == 'FONT_NAMES':
+        return [font.filename for font in captcha_fonts()]
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def load_font(
+    font: Union[CaptchaFont, str], size: int
+) -> 'ImageFont.FreeTypeFont':
+    """Load a font (CaptchaFont or path) at size through FONT_CACHE
+    Args:
+        font (Union[CaptchaFont, str]): The font or path to the font
+        size (int): The font size
+    Returns:
+        FreeTypeFont: the cached FreeTypeFont object
+    """
+    return FONT_CACHE.get(font, size)
 
 
 def get_font(
-    name: str, font_pool: list = CAPTCHA_FONTS
+    name: str, font_pool: Optional[list] = None
 ) -> Optional[CaptchaFont]:
     """Get a CaptchaFont object by name or filename or path str
     Args:
@@ -33,6 +146,8 @@ def get_font(
     Returns:
         CaptchaFont: The CaptchaFont object if found, else None
     """
+    if font_pool is None:
+        font_pool = captcha_fonts()
     for font in font_pool:
         if font.name == name:
             return font
@@ -1,22 +1,57 @@
 import base64
+import hashlib
+import hmac
+import json
 import os
 import random
 import string
-import sys
+import struct
+import time
 from datetime import datetime, timedelta
-from io import BytesIO
-from typing import Iterable, Optional, Set, Tuple, Union
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple, Union
 
-import jwt
-from PIL import Image
-from werkzeug.security import check_password_hash, generate_password_hash
-
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from .config import CHARPOOL, DEFAULT_CONFIG, EXCHARS, EXPIRE_NORMALIZED
 
 
+def __getattr__(name: str):
+    # PyJWT is imported by the functions using it, on first use, but stays
+    # reachable as utils.jwt like when it was imported here
+    if name == 'jwt':
+        import jwt
+
+        return jwt
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def _hmac_sha256(secret_key: str, salt: bytes, text: str) -> str:
+    msg = salt + text.encode()
+    return hmac.new(secret_key.encode(), msg, hashlib.sha256).hexdigest()
+
+
+def _blake2b(secret_key: str, salt: bytes, text: str) -> str:
+    key = secret_key.encode()
+    if len(key) > hashlib.blake2b.MAX_KEY_SIZE:
+        key = hashlib.blake2b(key).digest()
+    return hashlib.blake2b(
+        text.encode(), key=key, salt=salt, digest_size=32
+    ).hexdigest()
+
+
+# fast keyed hash backends, name -> func(secret_key, salt, text) -> hexdigest
+# hashes are stored as 'name$salthex$hexdigest', the name prefix acts as
+# the version tag of the token, anything without a known prefix is treated
+# as a werkzeug password hash
+HASH_BACKENDS = {
+    'hmac-sha256': _hmac_sha256,
+    'blake2b': _blake2b,
+}  # type: Dict[str, Callable[[str, bytes, str], str]]
+HASH_SALT_BYTES = 8
+
+
 def hash_text(
-    text: str, secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY']
+    text: str,
+    secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY'],
+    backend: str = DEFAULT_CONFIG['CAPTCHA_HASH_BACKEND'],
 ) -> str:
     """
     Encrypt the CAPTCHA text.
@@ -25,18 +60,82 @@ def hash_text(
         text (str): The CAPTCHA text to be encrypted.
         secret_key (str, optional): The secret key for encryption.
             Defaults to value in DEFAULT_CONFIG.
+        backend (str, optional): 'werkzeug' or a name in HASH_BACKENDS.
+            Defaults to value in DEFAULT_CONFIG.
 
     Returns:
         str: The encrypted CAPTCHA text.
     """
-    salted_text = secret_key + text
-    return generate_password_hash(salted_text)
+    if backend == 'werkzeug':
+        from werkzeug.security import generate_password_hash
+
+        salted_text = secret_key + text
+        return generate_password_hash(salted_text)
+
+    if backend not in HASH_BACKENDS:
+        raise ValueError('unknown hash backend %r' % backend)
+
+    salt = os.urandom(HASH_SALT_BYTES)
+    digest = HASH_BACKENDS[backend](secret_key, salt, text)
+    return '%s$%s$%s' % (backend, salt.hex(), digest)
+
+
+def check_hashed_text(
+    hashed_text: str,
+    text: str,
+    secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY'],
+) -> bool:
+    """
+    Check text against a hash created by hash_text, whatever its backend.
+
+    Args:
+        hashed_text (str): The hash created by hash_text.
+        text (str): The CAPTCHA text to check.
+        secret_key (str, optional): The secret key used for hashing.
+            Defaults to value in DEFAULT_CONFIG.
+
+    Returns:
+        bool: True if text matches the hash.
+    """
+    backend, _, rest = hashed_text.partition('$')
+    if backend not in HASH_BACKENDS:
+        from werkzeug.security import check_password_hash
+
+        return check_password_hash(hashed_text, secret_key + text)
+
+    salt, _, digest = rest.partition('$')
+    try:
+        salt = bytes.fromhex(salt)
+    except ValueError:
+        return False
+    expected = HASH_BACKENDS[backend](secret_key, salt, text)
+    return hmac.compare_digest(expected, digest)
+
+
+def hash_backend_cost(backend: str, rounds: int = 20) -> float:
+    """
+    Measure the average cost of one hash_text + check_hashed_text round
+    trip for a hashing backend.
+
+    Args:
+        backend (str): 'werkzeug' or a name in HASH_BACKENDS.
+        rounds (int, optional): How many round trips to average over.
+            Defaults to 20.
+
+    Returns:
+        float: Seconds per hash + check.
+    """
+    start = time.perf_counter()
+    for _ in range(rounds):
+        check_hashed_text(hash_text('ABCDEF', backend=backend), 'ABCDEF')
+    return (time.perf_counter() - start) / rounds
 
 
 def jwtencrypt(
     text: str,
     secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY'],
     expire_seconds: int = EXPIRE_NORMALIZED,
+    hash_backend: str = DEFAULT_CONFIG['CAPTCHA_HASH_BACKEND'],
 ) -> str:
     """
     Encode the CAPTCHA text into a JWT token.
@@ -47,11 +146,15 @@ def jwtencrypt(
             Defaults to value in DEFAULT_CONFIG.
         expire_seconds (int, optional): The expiration time for the token in seconds.
             Defaults to 600, 10 minutes.
+        hash_backend (str, optional): The backend used to hash the text.
+            Defaults to value in DEFAULT_CONFIG.
 
     Returns:
         str: The encoded JWT token.
     """
-    hashed_text = hash_text(text, secret_key)
+    import jwt
+
+    hashed_text = hash_text(text, secret_key, hash_backend)
     payload = {
         'hashed_text': hashed_text,
         'exp': datetime.utcnow() + timedelta(seconds=expire_seconds),
@@ -75,16 +178,17 @@ def jwtdecrypt(
     Returns:
         Optional[str]: The decoded CAPTCHA text if valid, None if invalid.
     """
+    import jwt
+
     try:
         decoded = jwt.decode(token, secret_key, algorithms=['HS256'])
         if 'hashed_text' not in decoded:
             return None
 
         hashed_text = decoded['hashed_text']
-        salted_original_text = secret_key + original_text
 
         # Verify if the hashed text matches the original text
-        if check_password_hash(hashed_text, salted_original_text):
+        if check_hashed_text(hashed_text, original_text, secret_key):
             return original_text
         else:
             return None
@@ -93,6 +197,272 @@ def jwtdecrypt(
         return None
 
 
+# values of CAPTCHA_TOKEN_FORMAT
+TOKEN_FORMATS = ('jwt', 'compact')
+
+# compact token layout: version, expiry (unix secs), salt, then a truncated
+# HMAC-SHA256 of the header + CAPTCHA text, base64url encoded without padding
+COMPACT_TOKEN_VERSION = 1
+COMPACT_HEADER = struct.Struct('>BI8s')
+COMPACT_MAC_BYTES = 16
+COMPACT_TOKEN_LEN = -(-(COMPACT_HEADER.size + COMPACT_MAC_BYTES) * 4 // 3)
+
+
+def _compact_mac(header: bytes, text: str, secret_key: str) -> bytes:
+    # a key of its own, the hmac-sha256 backend MACs salt + text with the
+    # secret key itself and JWT payloads show its salt and digest
+    key = hmac.new(secret_key.encode(), b'captcha-compact', hashlib.sha256)
+    msg = header + text.encode()
+    digest = hmac.new(key.digest(), msg, hashlib.sha256).digest()
+    return digest[:COMPACT_MAC_BYTES]
+
+
+def compact_encrypt(
+    text: str,
+    secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY'],
+    expire_seconds: int = EXPIRE_NORMALIZED,
+) -> str:
+    """
+    Encode the CAPTCHA text into a compact token, a smaller and faster
+    alternative to jwtencrypt.
+
+    Args:
+        text (str): The CAPTCHA text to be encoded.
+        secret_key (str, optional): The secret key for signing.
+            Defaults to value in DEFAULT_CONFIG.
+        expire_seconds (int, optional): The expiration time for the token
+            in seconds. Defaults to 600, 10 minutes.
+
+    Returns:
+        str: The encoded compact token.
+    """
+    header = COMPACT_HEADER.pack(
+        COMPACT_TOKEN_VERSION, int(time.time() + expire_seconds), os.urandom(8)
+    )
+    raw = header + _compact_mac(header, text, secret_key)
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def compact_decrypt(
+    token: str,
+    original_text: str,
+    secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY'],
+) -> Optional[str]:
+    """
+    Check the CAPTCHA text against a compact token.
+
+    Args:
+        token (str): The compact token to check.
+        original_text (str): The original CAPTCHA text.
+        secret_key (str, optional): The secret key for signing.
+
+    Returns:
+        Optional[str]: The CAPTCHA text if valid, None if invalid.
+    """
+    if not is_compact_token(token):
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except ValueError:
+        return None
+    # base64 spells the same bytes several ways (the unused low bits of
+    # the last char), only the spelling compact_encrypt writes is valid, a
+    # solved token can not be resubmitted as another one
+    canonical = base64.urlsafe_b64encode(raw).rstrip(b'=')
+    if not hmac.compare_digest(canonical, token.encode()):
+        return None
+    if len(raw) != COMPACT_HEADER.size + COMPACT_MAC_BYTES:
+        return None
+
+    header, mac = raw[: COMPACT_HEADER.size], raw[COMPACT_HEADER.size :]
+    version, exp, _ = COMPACT_HEADER.unpack(header)
+    if version != COMPACT_TOKEN_VERSION or exp <= time.time():
+        return None
+
+    if hmac.compare_digest(
+        mac, _compact_mac(header, original_text, secret_key)
+    ):
+        return original_text
+    return None
+
+
+def is_compact_token(token: str) -> bool:
+    """Check if token has the shape of a compact token"""
+    return len(token) == COMPACT_TOKEN_LEN and '.' not in token
+
+
+# longest token accepted, a JWT with a werkzeug (scrypt) hash is ~350 chars
+MAX_TOKEN_LEN = 1024
+
+
+def is_token(token: str) -> bool:
+    """Check if token has the shape of a JWT or compact token"""
+    if not isinstance(token, str) or len(token) > MAX_TOKEN_LEN:
+        return False
+    return token.count('.') == 2 or is_compact_token(token)
+
+
+def token_expiry(token: str) -> Optional[int]:
+    """
+    Read the expiry of a JWT or compact token WITHOUT verifying it.
+
+    Args:
+        token (str): The JWT or compact token.
+
+    Returns:
+        Optional[int]: The unix timestamp the token expires at, None if
+            the token is malformed or its expiry is not an int.
+    """
+    try:
+        if is_compact_token(token):
+            raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            return COMPACT_HEADER.unpack(raw[: COMPACT_HEADER.size])[1]
+
+        payload = token.split('.')[1]
+        payload = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+        exp = json.loads(payload)['exp']
+    except (
+        ValueError,
+        IndexError,
+        KeyError,
+        TypeError,
+        OverflowError,
+        struct.error,
+    ):
+        return None
+    # unverified input, jwtencrypt only writes ints (not Infinity, 1e400...)
+    if type(exp) is not int:
+        return None
+    return exp
+
+
+def token_status(
+    token: str, secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY']
+) -> str:
+    """
+    Check a JWT or compact token without the CAPTCHA text, to tell why
+    it did not verify.
+
+    Args:
+        token (str): The JWT or compact token.
+        secret_key (str, optional): The secret key the token was signed with.
+
+    Returns:
+        str: 'invalid' if malformed or (JWT only) wrongly signed, 'expired'
+            or 'ok'. Compact tokens sign the text along with the header, so
+            a forged one is only found out by compact_decrypt.
+    """
+    exp = token_expiry(token)
+    if exp is None:
+        return 'invalid'
+    if exp <= time.time():
+        return 'expired'
+    if not is_compact_token(token):
+        import jwt
+
+        try:
+            jwt.decode(token, secret_key, algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return 'invalid'
+    return 'ok'
+
+
+# sealed text layout: version, expiry (unix secs), nonce, the CAPTCHA text
+# XORed with an HMAC-SHA256 keystream, then a truncated HMAC-SHA256 of all
+# of it (encrypt-then-MAC), base64url encoded without padding
+SEALED_VERSION = 1
+SEALED_HEADER = struct.Struct('>BI8s')
+SEALED_MAC_BYTES = 16
+
+
+def _sealed_keys(secret_key: str) -> Tuple[bytes, bytes]:
+    key = secret_key.encode()
+    enc = hmac.new(key, b'captcha-seal-enc', hashlib.sha256).digest()
+    mac = hmac.new(key, b'captcha-seal-mac', hashlib.sha256).digest()
+    return enc, mac
+
+
+def _keystream(key: bytes, nonce: bytes, length: int) -> bytes:
+    blocks = (
+        hmac.new(key, nonce + i.to_bytes(4, 'big'), hashlib.sha256).digest()
+        for i in range(-(-length // 32))
+    )
+    return b''.join(blocks)[:length]
+
+
+def seal_text(
+    text: str,
+    secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY'],
+    expire_seconds: int = EXPIRE_NORMALIZED,
+) -> str:
+    """
+    Encrypt and sign the CAPTCHA text into a url safe string, so the text
+    can be recovered later (e.g. to render the image) without storing it.
+
+    Args:
+        text (str): The CAPTCHA text to be sealed.
+        secret_key (str, optional): The secret key the keys are derived from.
+            Defaults to value in DEFAULT_CONFIG.
+        expire_seconds (int, optional): The expiration time in seconds.
+            Defaults to 600, 10 minutes.
+
+    Returns:
+        str: The sealed text.
+    """
+    enc_key, mac_key = _sealed_keys(secret_key)
+    nonce = os.urandom(8)
+    header = SEALED_HEADER.pack(
+        SEALED_VERSION, int(time.time() + expire_seconds), nonce
+    )
+    plain = text.encode()
+    cipher = bytes(
+        a ^ b for a, b in zip(plain, _keystream(enc_key, nonce, len(plain)))
+    )
+    mac = hmac.new(mac_key, header + cipher, hashlib.sha256).digest()
+    raw = header + cipher + mac[:SEALED_MAC_BYTES]
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def open_sealed(
+    sealed: str, secret_key: str = DEFAULT_CONFIG['SECRET_CAPTCHA_KEY']
+) -> Optional[str]:
+    """
+    Recover the CAPTCHA text from seal_text output.
+
+    Args:
+        sealed (str): The sealed text.
+        secret_key (str, optional): The secret key used by seal_text.
+
+    Returns:
+        Optional[str]: The CAPTCHA text, None if invalid or expired.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(sealed + '=' * (-len(sealed) % 4))
+    except ValueError:
+        return None
+    if len(raw) < SEALED_HEADER.size + SEALED_MAC_BYTES:
+        return None
+
+    enc_key, mac_key = _sealed_keys(secret_key)
+    signed, mac = raw[:-SEALED_MAC_BYTES], raw[-SEALED_MAC_BYTES:]
+    expected = hmac.new(mac_key, signed, hashlib.sha256).digest()
+    if not hmac.compare_digest(mac, expected[:SEALED_MAC_BYTES]):
+        return None
+
+    version, exp, nonce = SEALED_HEADER.unpack(signed[: SEALED_HEADER.size])
+    if version != SEALED_VERSION or exp <= time.time():
+        return None
+
+    cipher = signed[SEALED_HEADER.size :]
+    plain = bytes(
+        a ^ b for a, b in zip(cipher, _keystream(enc_key, nonce, len(cipher)))
+    )
+    try:
+        return plain.decode()
+    except UnicodeDecodeError:
+        return None
+
+
 def exclude_similar_chars(chars: Union[str, set, list, tuple]) -> str:
     """Excludes characters that are potentially visually confusing from
     the character pool (provided as charstr).
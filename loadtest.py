@@ -0,0 +1,389 @@
+"""Load test of the whole request path of a Flask app using CAPTCHA.
+
+    python loadtest.py                         # 10s, 8 threads, all scenarios
+    python loadtest.py -c 32 -d 30 -o run.json # save the report as JSON
+    python loadtest.py --server                # through a local HTTP server
+    python loadtest.py -s valid,replay --config '{"CAPTCHA_TOKEN_FORMAT":
+        "compact", "LAZY_IMG_ROUTE": "/captcha"}'
+
+The app is started in this process, every thread loads the form (and the
+image, with LAZY_IMG_ROUTE) and submits it, cycling through the scenarios:
+
+    valid    the right answer
+    wrong    an answer with one wrong character
+    replay   the right answer, submitted a second time
+    expired  the right answer with an expired token
+
+The report has the throughput, the p50/p95/p99 latency and the response
+size of every request kind (e.g. 'POST valid') and the RSS of the process
+over time. By default requests go through the Flask test client, --server
+sends them over HTTP to a local threaded WSGI server instead.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from flask import Flask, render_template_string, request
+
+from flask_simple_captcha import CAPTCHA, DEFAULT_CONFIG
+
+SCENARIOS = ('valid', 'wrong', 'replay', 'expired')
+PERCENTILES = (50, 95, 99)
+RSS_INTERVAL = 0.5  # seconds between RSS samples
+
+_HASH_RE = re.compile(r'name="captcha-hash" value="([^"]+)"')
+_IMG_RE = re.compile(r'class="simple-captcha-img" src="([^"]+)"')
+
+
+def make_app(config: dict) -> Tuple[Flask, CAPTCHA, Dict[str, str]]:
+    """The app under test, its CAPTCHA and the answers of the captchas it
+    handed out by token, which a load test needs to solve them
+    """
+    app = Flask(__name__)
+    captcha = CAPTCHA(config)
+    captcha.init_app(app)
+    answers = {}
+
+    @app.route('/', methods=['GET', 'POST'])
+    def form():
+        if request.method == 'GET':
+            c = captcha.create()
+            answers[c['hash']] = c['text']
+            return render_template_string(
+                '<form method="POST">%s<input type="submit"></form>'
+                % captcha.captcha_html(c)
+            )
+        c_hash = request.form.get('captcha-hash')
+        c_text = request.form.get('captcha-text')
+        if captcha.verify(c_text, c_hash):
+            return 'success'
+        return 'failed captcha'
+
+    return app, captcha, answers
+
+
+class TestClient:
+    """Sends requests through the Flask test client, one per thread"""
+
+    def __init__(self, app: Flask):
+        self.client = app.test_client()
+
+    def get(self, path: str) -> Tuple[int, bytes]:
+        resp = self.client.get(path)
+        return resp.status_code, resp.data
+
+    def post(self, path: str, form: dict) -> Tuple[int, bytes]:
+        resp = self.client.post(path, data=form)
+        return resp.status_code, resp.data
+
+
+class HTTPClient:
+    """Sends requests over a keep-alive HTTP connection, one per thread"""
+
+    def __init__(self, host: str, port: int):
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+
+    def _request(self, method, path, body=None, headers=None):
+        self.conn.request(method, path, body, headers or {})
+        resp = self.conn.getresponse()
+        return resp.status, resp.read()
+
+    def get(self, path: str) -> Tuple[int, bytes]:
+        return self._request('GET', path)
+
+    def post(self, path: str, form: dict) -> Tuple[int, bytes]:
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        return self._request('POST', path, urlencode(form), headers)
+
+
+def start_server(app: Flask) -> Tuple[Callable, Tuple[str, int]]:
+    """Serve app from a threaded WSGI server on a free local port, returns
+    its shutdown function and address
+    """
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class Handler(WSGIRequestHandler):
+        # keep-alive connections (werkzeug answers HTTP/1.0 by default)
+        # and no log line per request
+        protocol_version = 'HTTP/1.1'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server(
+        '127.0.0.1', 0, app, threaded=True, request_handler=Handler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown, server.server_address
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process, the peak where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """The q-th percentile (nearest rank) of sorted_values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Recorder:
+    """Latency, size and failures of every request kind, per thread"""
+
+    def __init__(self):
+        self.latency = defaultdict(list)  # type: Dict[str, List[float]]
+        self.size = defaultdict(int)  # type: Dict[str, int]
+        self.failures = defaultdict(int)  # type: Dict[str, int]
+
+    def record(self, kind: str, start: float, resp, ok: bool):
+        self.latency[kind].append(time.perf_counter() - start)
+        self.size[kind] += len(resp[1])
+        if not ok:
+            self.failures[kind] += 1
+
+
+def run_flow(
+    client,
+    scenario: str,
+    rec: Recorder,
+    answers: dict,
+    captcha: CAPTCHA,
+    expired: CAPTCHA,
+):
+    """Load the form and submit it the way scenario says, expired is a
+    CAPTCHA making expired tokens
+    """
+    start = time.perf_counter()
+    resp = client.get('/')
+    rec.record('GET form', start, resp, resp[0] == 200)
+    html = resp[1].decode()
+    c_hash = _HASH_RE.search(html).group(1)
+    text = answers.pop(c_hash)
+
+    src = _IMG_RE.search(html).group(1)
+    if not src.startswith('data:'):
+        start = time.perf_counter()
+        resp = client.get(src)
+        rec.record('GET image', start, resp, resp[0] == 200)
+
+    if scenario == 'wrong':
+        wrong = [c for c in captcha.characters if c != text[0]][0]
+        text = wrong + text[1:]
+    elif scenario == 'expired':
+        c_hash = expired.encrypt(text)
+    form = {'captcha-hash': c_hash, 'captcha-text': text}
+    if scenario == 'replay':
+        start = time.perf_counter()
+        resp = client.post('/', form)
+        rec.record('POST valid', start, resp, resp[1] == b'success')
+
+    start = time.perf_counter()
+    resp = client.post('/', form)
+    expected = b'success' if scenario == 'valid' else b'failed captcha'
+    rec.record('POST ' + scenario, start, resp, resp[1] == expected)
+
+
+def summarize(recorders: List[Recorder], seconds: float) -> dict:
+    """Merge the recorders into the per request kind report"""
+    latency, size, failures = defaultdict(list), defaultdict(int), {}
+    for rec in recorders:
+        for kind, values in rec.latency.items():
+            latency[kind] += values
+            size[kind] += rec.size[kind]
+            failures[kind] = failures.get(kind, 0) + rec.failures[kind]
+
+    requests = {}
+    for kind in sorted(latency):
+        values = sorted(latency[kind])
+        report = {
+            'count': len(values),
+            'per_sec': len(values) / seconds,
+            'failures': failures[kind],
+            'mean_bytes': size[kind] / len(values),
+        }
+        for q in PERCENTILES:
+            report['p%d_ms' % q] = percentile(values, q) * 1000
+        requests[kind] = report
+    return requests
+
+
+def run_load(
+    config: dict,
+    concurrency: int = 8,
+    duration: float = 10.0,
+    scenarios: Tuple[str, ...] = SCENARIOS,
+    server: bool = False,
+) -> dict:
+    """Drive the app with concurrency threads for duration seconds
+
+    Args:
+        config (dict): CAPTCHA config of the app, on top of DEFAULT_CONFIG
+        concurrency (int): threads running flows at the same time
+        duration (float): seconds to run for
+        scenarios (Tuple[str, ...]): the SCENARIOS each thread cycles
+            through
+        server (bool): send HTTP requests to a local server instead of
+            using the Flask test client
+
+    Returns:
+        dict: the per request kind report, the flow throughput and the RSS
+            samples as [seconds, bytes]
+    """
+    config = {**DEFAULT_CONFIG, **config}
+    app, captcha, answers = make_app(config)
+    # same secret, so its tokens are valid ones which have expired
+    expired = CAPTCHA({**config, 'EXPIRE_NORMALIZED': -60})
+
+    shutdown = None
+    if server:
+        shutdown, address = start_server(app)
+
+    def new_client():
+        if server:
+            return HTTPClient(*address)
+        return TestClient(app)
+
+    recorders = [Recorder() for _ in range(concurrency)]
+    flows = [0] * concurrency
+    rss, done = [], threading.Event()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(i):
+        client, rec = new_client(), recorders[i]
+        barrier.wait()
+        while not done.is_set():
+            scenario = scenarios[flows[i] % len(scenarios)]
+            run_flow(client, scenario, rec, answers, captcha, expired)
+            flows[i] += 1
+
+    threads = [
+        threading.Thread(target=worker, args=(i,), daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    while True:
+        elapsed = time.perf_counter() - start
+        rss.append([round(elapsed, 3), rss_bytes()])
+        if elapsed >= duration:
+            break
+        time.sleep(min(RSS_INTERVAL, duration - elapsed))
+    done.set()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    rss.append([round(seconds, 3), rss_bytes()])
+
+    if shutdown is not None:
+        shutdown()
+    captcha.close_workers()
+    return {
+        'concurrency': concurrency,
+        'seconds': seconds,
+        'flows_per_sec': sum(flows) / seconds,
+        'requests': summarize(recorders, seconds),
+        'rss': rss,
+    }
+
+
+def print_report(report: dict):
+    header = ('request', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms')
+    print(
+        '%-16s %8s %10s %9s %9s %9s %10s %8s' % (header + ('bytes', 'failed')),
+        file=sys.stderr,
+    )
+    for kind, r in report['requests'].items():
+        print(
+            '%-16s %8d %10.1f %9.2f %9.2f %9.2f %10.0f %8d'
+            % (
+                kind,
+                r['count'],
+                r['per_sec'],
+                r['p50_ms'],
+                r['p95_ms'],
+                r['p99_ms'],
+                r['mean_bytes'],
+                r['failures'],
+            ),
+            file=sys.stderr,
+        )
+    rss = [sample[1] for sample in report['rss']]
+    print(
+        '%.1f flows/s with %d threads, RSS %.1f -> %.1f MB (peak %.1f MB)'
+        % (
+            report['flows_per_sec'],
+            report['concurrency'],
+            rss[0] / 2**20,
+            rss[-1] / 2**20,
+            max(rss) / 2**20,
+        ),
+        file=sys.stderr,
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument(
+        '-d', '--duration', type=float, default=10.0, help='seconds'
+    )
+    parser.add_argument(
+        '-s',
+        '--scenarios',
+        default=','.join(SCENARIOS),
+        help='comma separated, of %s' % ', '.join(SCENARIOS),
+    )
+    parser.add_argument(
+        '--config', default='{}', help='CAPTCHA config overrides as JSON'
+    )
+    parser.add_argument(
+        '--server', action='store_true', help='go through a local server'
+    )
+    parser.add_argument('-o', '--output', help='save the report as JSON')
+    args = parser.parse_args(argv)
+
+    scenarios = tuple(args.scenarios.split(','))
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+    report = run_load(
+        json.loads(args.config),
+        args.concurrency,
+        args.duration,
+        scenarios,
+        args.server,
+    )
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    # failures mean the app misbehaved under load
+    failures = sum(r['failures'] for r in report['requests'].values())
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
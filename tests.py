@@ -1,17 +1,29 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import unittest
 import time
 import jwt
 import string
 from io import BytesIO
+from random import Random
+import base64
 from base64 import b64encode
 from datetime import datetime, timedelta
 from unittest.mock import patch, Mock, MagicMock, ANY
 
 from flask import Flask
 
-from PIL import Image
+from PIL import Image, ImageChops, ImageDraw
 from werkzeug.security import generate_password_hash, check_password_hash
 
+import benchmarks
+import loadtest
 from flask_simple_captcha import CAPTCHA
 
 from flask_simple_captcha.config import DEFAULT_CONFIG, EXPIRE_NORMALIZED
@@ -22,16 +34,70 @@ from flask_simple_captcha.utils import (
     exclude_similar_chars,
     CHARPOOL,
     hash_text,
+    check_hashed_text,
+    hash_backend_cost,
+    HASH_BACKENDS,
+    compact_encrypt,
+    compact_decrypt,
+    is_compact_token,
+    COMPACT_TOKEN_LEN,
+    COMPACT_HEADER,
+    COMPACT_MAC_BYTES,
+    token_expiry,
+    token_status,
+    seal_text,
+    open_sealed,
+)
+from flask_simple_captcha.batch import worker_config
+from flask_simple_captcha.metrics import Histogram, StageTimer, StatsCollector
+from flask_simple_captcha.noise import NoiseBank
+from flask_simple_captcha.pool import CaptchaPool, SQLiteCaptchaPool
+from flask_simple_captcha.rng import Charset, CaptchaRandom, token_layout
+from flask_simple_captcha.replay import (
+    BaseReplayStore,
+    MemoryReplayStore,
+    SQLiteReplayStore,
+    token_digest,
 )
 from flask_simple_captcha.img import (
     convert_b64img,
     draw_lines,
     create_text_img,
+    CaptchaRenderer,
+    GlyphAtlas,
+    get_glyph_atlas,
+    target_font_size,
+    get_resample,
+    encode_img,
+    get_img_options,
+    IMG_PROFILES,
+    auto_img_mode,
+    gradient_palette,
+    to_grey,
+    noise_params,
+    randints,
+    noise_texture,
+    draw_pixel_noise,
+    NUMPY_MIN_BATCH,
+)
+from flask_simple_captcha.text import (
+    CaptchaFont,
+    get_font,
+    CAPTCHA_FONTS,
+    FontCache,
+    load_font,
 )
-from flask_simple_captcha.text import CaptchaFont, get_font, CAPTCHA_FONTS
 
 _TESTTEXT = 'TestText'
 _TESTKEY = 'TestKey'
+_B64CHARS = string.ascii_uppercase + string.ascii_lowercase + '0123456789-_'
+
+
+def last_char_spellings(token):
+    """token with its last char changed in the 2 bits base64 ignores"""
+    i = _B64CHARS.index(token[-1]) & ~3
+    return [token[:-1] + c for c in _B64CHARS[i : i + 4]]
+
 
 app = Flask(__name__)
 
@@ -110,12 +176,343 @@ class TestImg(unittest.TestCase):
             convert_b64img(img, 'PNG')
             mock_save.assert_called_once_with(ANY, format='PNG')
 
+    def test_encode_formats(self):
+        img = create_text_img('ABC', CAPTCHA_FONTS[0].path)
+        for fmt in ('JPEG', 'PNG', 'WEBP'):
+            for profile in (None, 'fastest', 'smallest'):
+                data = encode_img(img, fmt, **get_img_options(fmt, profile))
+                self.assertEqual(Image.open(BytesIO(data)).format, fmt)
+
+    def test_palette_png(self):
+        img = create_text_img('ABC', CAPTCHA_FONTS[0].path)
+        decoded = Image.open(BytesIO(encode_img(img, 'PNG', colors=2)))
+        self.assertEqual(decoded.mode, 'P')
+        self.assertLessEqual(len(decoded.getcolors()), 2)
+
+    def test_webp_lossless(self):
+        img = Image.new('RGB', (20, 10), color=(1, 2, 3))
+        data = encode_img(img, 'WEBP', lossless=True)
+        self.assertEqual(Image.open(BytesIO(data)).getpixel((0, 0)), (1, 2, 3))
+
+    def test_jpeg_options(self):
+        img = Image.new('RGB', (1, 2))
+        with patch.object(img, 'save') as mock_save:
+            encode_img(img, 'JPEG')
+            mock_save.assert_called_once_with(ANY, format='JPEG', quality=85)
+        with patch.object(img, 'save') as mock_save:
+            encode_img(img, 'JPEG', quality=50, progressive=True)
+            mock_save.assert_called_once_with(
+                ANY, format='JPEG', quality=50, progressive=True
+            )
+
+    def test_get_img_options(self):
+        self.assertEqual(get_img_options('JPEG'), {})
+        self.assertEqual(
+            get_img_options('JPEG', 'smallest', {'quality': 1})['quality'], 1
+        )
+        self.assertEqual(
+            get_img_options('PNG', 'fastest'), IMG_PROFILES['fastest']['PNG']
+        )
+        with self.assertRaises(ValueError):
+            get_img_options('PNG', 'nope')
+
     def test_nodrawer_lines(self):
         im = Image.new('RGB', (100, 100))
         with patch('flask_simple_captcha.img.ImageDraw') as mock_draw:
             draw_lines(im)
             mock_draw.Draw.assert_called_once_with(im)
 
+    def test_noise_params(self):
+        lines, ellipses = noise_params(100, 50, noise=12)
+        self.assertEqual(len(lines), 7 * 4)
+        self.assertEqual(len(ellipses), 3 * 4)
+        for x0, y0, x1, y1 in zip(*[iter(lines)] * 4):
+            self.assertTrue(0 <= x0 <= 100 and 0 <= x1 <= 100)
+            self.assertTrue(0 <= y0 <= 50 and 0 <= y1 <= 50)
+        for x, y, rx, ry in zip(*[iter(ellipses)] * 4):
+            self.assertTrue(0 <= x <= 100 and 0 <= y <= 50)
+            self.assertTrue(4 <= rx <= 25 and 4 <= ry <= 12)
+
+    def test_randints_bounds(self):
+        for n in (10, NUMPY_MIN_BATCH):
+            bounds = [(0, 3), (5, 5)] * n
+            values = randints(bounds)
+            self.assertEqual(len(values), 2 * n)
+            self.assertEqual(set(values[1::2]), {5})
+            self.assertLessEqual(set(values[::2]), {0, 1, 2, 3})
+            self.assertTrue(all(type(v) is int for v in values))
+        # the last batch is large enough to hit every value
+        self.assertEqual(set(values[::2]), {0, 1, 2, 3})
+
+    def test_randints_without_numpy(self):
+        bounds = [(1, 2)] * NUMPY_MIN_BATCH
+        with patch('flask_simple_captcha.img._NP_RNG', False):
+            self.assertLessEqual(set(randints(bounds)), {1, 2})
+
+    def test_pixel_noise(self):
+        mask = noise_texture((100, 50), 0.2)
+        self.assertIs(mask, noise_texture((100, 50), 0.2))
+        self.assertAlmostEqual(mask.histogram()[255] / 5000, 0.2, delta=0.05)
+
+        im = Image.new('L', (100, 50), 0)
+        draw_pixel_noise(im, 0.2, 255)
+        self.assertEqual(im.histogram()[255], mask.histogram()[255])
+
+    def test_create_text_img_noise(self):
+        path = CAPTCHA_FONTS[0].path
+        with patch('flask_simple_captcha.img.draw_lines') as mock_lines:
+            mock_lines.side_effect = lambda im, **kw: im
+            create_text_img('ABC', path, noise=20)
+            self.assertEqual(mock_lines.call_args[1]['noise'], 20)
+        with patch('flask_simple_captcha.img.draw_pixel_noise') as mock_px:
+            mock_px.side_effect = lambda im, *a: im
+            create_text_img('ABC', path)
+            mock_px.assert_not_called()
+            create_text_img('ABC', path, pixel_noise=0.1)
+            self.assertEqual(mock_px.call_args[0][1], 0.1)
+
+
+class TestCaptchaRenderer(unittest.TestCase):
+    def setUp(self):
+        self.paths = [font.path for font in CAPTCHA_FONTS]
+        self.renderer = CaptchaRenderer(
+            self.paths, string.ascii_uppercase, mode='L', lengths=(6,)
+        )
+
+    def test_layouts(self):
+        self.assertEqual(len(self.renderer._layouts), len(self.paths))
+        layout = self.renderer.layout(0, 6)
+        self.assertIs(layout, self.renderer.layout(0, 6))
+        self.assertEqual(layout.canvas, (135, 45))
+        self.assertEqual(len(layout.bounds('ABC')), 6)
+
+    def test_ink_inside(self):
+        layout = self.renderer.layout(0, 6)
+        w, h = layout.canvas
+        for c in string.ascii_uppercase:
+            mask, left, top = layout.atlas.glyph(c)
+            (x_lo, x_hi), (y_lo, y_hi) = layout.char_range(c)
+            self.assertGreaterEqual(x_lo + left, 0)
+            self.assertLessEqual(x_hi + left + mask.size[0], layout.seg_w)
+            self.assertGreaterEqual(y_lo + top, 0)
+            self.assertLessEqual(y_hi + top + mask.size[1], h)
+
+    def test_render(self):
+        img = self.renderer.render('ABCDEF', Random(1))
+        self.assertEqual((img.size, img.mode), ((180, 60), 'L'))
+        again = self.renderer.render('ABCDEF', Random(1))
+        self.assertEqual(img.tobytes(), again.tobytes())
+        # other lengths are laid out on first use
+        self.assertEqual(self.renderer.render('AB').size, (180, 60))
+
+    def test_at_target(self):
+        renderer = CaptchaRenderer(
+            self.paths[:1], 'ABC', size=(120, 40), at_target=True, mode='P'
+        )
+        with patch.object(Image.Image, 'resize') as mock_resize:
+            img = renderer.render('ABC')
+            mock_resize.assert_not_called()
+        self.assertEqual((img.size, img.mode), ((120, 40), 'P'))
+        self.assertEqual(renderer.layout(0, 3).canvas, (120, 40))
+        self.assertEqual(renderer.text_font_size(3), 26)
+        self.assertEqual(renderer.text_font_size(6), 26)
+        self.assertEqual(renderer.text_font_size(12), 13)
+
+    def test_create_text_img(self):
+        # a thin wrapper, same image as a renderer of the same arguments
+        renderer = CaptchaRenderer(self.paths[:1], mode='L')
+        img = create_text_img('ABCDEF', self.paths[0], mode='L', rng=Random(3))
+        self.assertEqual(
+            img.tobytes(), renderer.render('ABCDEF', Random(3)).tobytes()
+        )
+
+    def test_captcha(self):
+        captcha = CAPTCHA({'IMG_WIDTH': 150, 'IMG_HEIGHT': 50})
+        renderer = captcha.renderer
+        self.assertIs(captcha.renderer, renderer)
+        self.assertEqual(renderer.size, (150, 50))
+        self.assertEqual(captcha.render_image('ABC').size, (150, 50))
+        captcha.fonts = CAPTCHA_FONTS[:1]
+        self.assertIsNot(captcha.renderer, renderer)
+        self.assertEqual(len(captcha.renderer.font_paths), 1)
+
+    def test_captcha_font_size(self):
+        conf = {'IMG_WIDTH': 120, 'IMG_HEIGHT': 40, 'RENDER_AT_TARGET': True}
+        captcha = CAPTCHA({**conf, 'CAPTCHA_LENGTH': 12})
+        self.assertEqual(captcha.font_size, 13)
+        self.assertEqual(captcha.renderer.layout(0, 12).atlas.font.size, 13)
+
+
+class TestNoiseBank(unittest.TestCase):
+    def setUp(self):
+        self.bank = NoiseBank(layers=4, refresh=None, seed=1)
+
+    def test_layers(self):
+        layers = self.bank.layers((100, 40), 2)
+        self.assertEqual(len(layers), 4)
+        self.assertIs(layers, self.bank.layers((100, 40), 2))
+        self.assertEqual(layers[0].size, (200, 80))
+        self.assertEqual(len(self.bank), 4)
+        # later windows show the noise mirrored
+        self.assertEqual(
+            layers[0].crop((100, 0, 200, 40)).tobytes(),
+            layers[0].crop((0, 0, 100, 40)).transpose(0).tobytes(),
+        )
+
+    def test_draw(self):
+        im = Image.new('RGB', (100, 40), (0, 0, 0))
+        self.assertEqual(len(self.bank.bounds(im.size)), 3)
+        self.bank.draw(im, (255, 0, 0), 2, [1, 30, 10])
+        colors = {color for _, color in im.getcolors()}
+        self.assertEqual(colors, {(0, 0, 0), (255, 0, 0)})
+
+    def test_refresh(self):
+        layers = list(self.bank.layers((100, 40), 2))
+        self.bank.refresh_one()
+        new = self.bank.layers((100, 40), 2)
+        self.assertIsNot(new[0], layers[0])
+        self.assertIs(new[1], layers[1])
+
+    def test_thread(self):
+        bank = NoiseBank(layers=2, refresh=0.01)
+        layers = list(bank.layers((50, 20), 2))
+        self.assertTrue(bank._thread.is_alive())
+        time.sleep(0.1)
+        bank.stop(1)
+        self.assertFalse(bank._thread.is_alive())
+        self.assertIsNot(bank.layers((50, 20), 2)[0], layers[0])
+
+    def test_captcha(self):
+        captcha = CAPTCHA({'NOISE_BANK': 4, 'NOISE_BANK_REFRESH': None})
+        with patch('flask_simple_captcha.img.draw_lines') as mock_lines:
+            captcha.render()
+            mock_lines.assert_not_called()
+            # an explicit rng draws the noise itself
+            captcha.render_image('ABC', rng=Random(1))
+            mock_lines.assert_called_once()
+        self.assertEqual(len(captcha.noise_bank), 4)
+        captcha.close_workers()
+
+
+class TestCreateTextImg(unittest.TestCase):
+    def setUp(self):
+        self.path = CAPTCHA_FONTS[0].path
+
+    def test_default_size(self):
+        img = create_text_img('ABCDEF', self.path)
+        self.assertEqual(img.size, (180, 60))
+
+    def test_at_target(self):
+        with patch.object(Image.Image, 'resize') as mock_resize:
+            img = create_text_img(
+                'ABCDEF', self.path, size=(240, 80), at_target=True
+            )
+            mock_resize.assert_not_called()
+        self.assertEqual(img.size, (240, 80))
+
+    def test_resample(self):
+        with patch.object(Image.Image, 'resize') as mock_resize:
+            create_text_img('ABC', self.path, resample='nearest')
+            mock_resize.assert_called_once_with((180, 60), Image.NEAREST)
+
+    def test_modes(self):
+        bw = ((0, 0, 0), (255, 255, 255))
+        color = ((250, 240, 200), (20, 40, 120))
+        for mode, colors, out_mode in (
+            ('RGB', bw, 'RGB'),
+            ('L', bw, 'L'),
+            ('L', color, 'L'),
+            ('1', bw, '1'),
+            ('1', color, 'P'),
+            ('P', bw, 'P'),
+            ('P', color, 'P'),
+        ):
+            img = create_text_img(
+                'ABC',
+                self.path,
+                back_color=colors[0],
+                text_color=colors[1],
+                mode=mode,
+            )
+            self.assertEqual(img.mode, out_mode)
+            self.assertEqual(img.size, (180, 60))
+            # background pixel keeps the background color
+            rgb = img.convert('RGB')
+            if mode != 'L':
+                self.assertIn(
+                    colors[0], [rgb.getpixel(xy) for xy in ((0, 0), (179, 59))]
+                )
+            for fmt in ('JPEG', 'PNG', 'WEBP'):
+                self.assertTrue(encode_img(img, fmt))
+
+    def test_grey_mode_colors(self):
+        img = create_text_img(
+            'ABC',
+            self.path,
+            back_color=200,
+            text_color=(30, 30, 30),
+            mode='L',
+            at_target=True,  # no resize overshoot
+        )
+        self.assertEqual(img.getextrema(), (30, 200))
+
+    def test_auto_img_mode(self):
+        bw = ((0, 0, 0), (255, 255, 255))
+        color = ((250, 240, 200), (20, 40, 120))
+        self.assertEqual(auto_img_mode(*bw, 'JPEG'), 'L')
+        self.assertEqual(auto_img_mode(*color, 'PNG'), 'P')
+        self.assertEqual(auto_img_mode(*color, 'JPEG'), 'RGB')
+        self.assertEqual(auto_img_mode('white', '#000', 'PNG'), 'L')
+        self.assertEqual(auto_img_mode('white', 'red', 'PNG'), 'P')
+
+    def test_to_grey(self):
+        self.assertEqual(to_grey(7), 7)
+        self.assertEqual(to_grey((9, 9, 9, 255)), 9)
+        self.assertEqual(to_grey((255, 0, 0)), 76)
+
+    def test_gradient_palette(self):
+        palette = gradient_palette((0, 0, 0), (255, 128, 2))
+        self.assertEqual(len(palette), 768)
+        self.assertEqual(palette[:3], [0, 0, 0])
+        self.assertEqual(palette[-3:], [255, 128, 2])
+
+    def test_target_font_size(self):
+        self.assertEqual(target_font_size(6, (180, 60)), 40)
+        self.assertEqual(target_font_size(12, (180, 60)), 20)
+        self.assertEqual(target_font_size(6, (1, 1)), 1)
+
+    def test_get_resample(self):
+        self.assertEqual(get_resample('bilinear'), Image.BILINEAR)
+        self.assertEqual(get_resample(Image.LANCZOS), Image.LANCZOS)
+        self.assertIsNone(get_resample(None))
+
+
+class TestGlyphAtlas(unittest.TestCase):
+    def setUp(self):
+        self.path = CAPTCHA_FONTS[0].path
+        self.atlas = GlyphAtlas(self.path, 30, 'AB')
+
+    def test_prerasterized(self):
+        self.assertEqual(set(self.atlas.glyphs), {'A', 'B'})
+        self.atlas.glyph('Z')
+        self.assertEqual(len(self.atlas), 3)
+
+    def test_matches_draw_text(self):
+        fnt = load_font(self.path, 30)
+        for color in ((255, 255, 255), (200, 30, 40)):
+            drawn = Image.new('RGB', (100, 45), color=(10, 20, 30))
+            pasted = drawn.copy()
+            drawer = ImageDraw.Draw(drawn)
+            for c, xy in (('A', (3, -5)), ('W', (20, 10)), ('Q', (80, 20))):
+                drawer.text(xy, c, font=fnt, fill=color)
+                self.atlas.draw(pasted, xy, c, color)
+            self.assertIsNone(ImageChops.difference(drawn, pasted).getbbox())
+
+    def test_shared_atlas(self):
+        atlas = get_glyph_atlas(self.path, 31)
+        self.assertIs(atlas, get_glyph_atlas(self.path, 31))
+        self.assertIsNot(atlas, get_glyph_atlas(self.path, 32))
+
 
 class TestCAPTCHA(unittest.TestCase):
     def setUp(self):
@@ -263,13 +660,135 @@ class TestCAPTCHA(unittest.TestCase):
         for c in ['2', '3', '4', '5', '6', '7', '8', '9']:
             self.assertIn(c, cap.characters)
 
+    def test_hash_backend_config(self):
+        conf = DEFAULT_CONFIG.copy()
+        conf['CAPTCHA_HASH_BACKEND'] = 'hmac-sha256'
+        cap = CAPTCHA(conf)
+        result = cap.create()
+        self.assertTrue(cap.verify(result['text'], result['hash']))
+
+    def test_img_size_config(self):
+        conf = DEFAULT_CONFIG.copy()
+        conf.update(IMG_WIDTH=120, IMG_HEIGHT=40, RENDER_AT_TARGET=True)
+        cap = CAPTCHA(conf)
+        self.assertEqual(cap.font_size, 26)
+        img = Image.open(BytesIO(base64.b64decode(cap.create()['img'])))
+        self.assertEqual(img.size, (120, 40))
+
+        conf['RENDER_AT_TARGET'] = False
+        self.assertEqual(CAPTCHA(conf).font_size, 30)
+
+    def test_img_format_config(self):
+        conf = DEFAULT_CONFIG.copy()
+        conf['CAPTCHA_IMG_FORMAT'] = 'WEBP'
+        conf['CAPTCHA_IMG_PROFILE'] = 'smallest'
+        cap = CAPTCHA(conf)
+        result = cap.create()
+        img = Image.open(BytesIO(base64.b64decode(result['img'])))
+        self.assertEqual(img.format, 'WEBP')
+        self.assertIn('data:image/webp;base64', cap.captcha_html(result))
+
+    def test_img_format_case(self):
+        for img_format, mimetype in (('png', 'png'), ('Gif', 'gif')):
+            conf = DEFAULT_CONFIG.copy()
+            conf['CAPTCHA_IMG_FORMAT'] = img_format
+            cap = CAPTCHA(conf)
+            self.assertEqual(cap.img_format, img_format.upper())
+            html = cap.captcha_html(cap.create())
+            self.assertIn('data:image/%s;base64' % mimetype, html)
+        with self.assertRaises(ValueError):
+            CAPTCHA({'CAPTCHA_IMG_FORMAT': 'TIFF'})
+
+    def test_token_config(self):
+        for key, value in (
+            ('CAPTCHA_TOKEN_FORMAT', 'Compact'),
+            ('CAPTCHA_HASH_BACKEND', 'sha256'),
+        ):
+            with self.assertRaises(ValueError):
+                CAPTCHA({key: value})
+
+    def test_img_mode_config(self):
+        self.assertEqual(self.captcha.img_mode, 'L')
+        # the 'smallest' PNG profile reduces other modes to a palette
+        for mode, profile, out_mode in (
+            ('1', None, '1'),
+            ('1', 'smallest', '1'),
+            ('P', 'smallest', 'P'),
+            ('L', 'smallest', 'P'),
+        ):
+            conf = DEFAULT_CONFIG.copy()
+            conf['IMG_MODE'] = mode
+            conf['CAPTCHA_IMG_FORMAT'] = 'PNG'
+            conf['CAPTCHA_IMG_PROFILE'] = profile
+            cap = CAPTCHA(conf)
+            img = Image.open(BytesIO(base64.b64decode(cap.create()['img'])))
+            self.assertEqual(img.mode, out_mode)
+
+    def test_color_names(self):
+        for img_format in ('PNG', 'WEBP', 'JPEG'):
+            conf = DEFAULT_CONFIG.copy()
+            conf['BACKGROUND_COLOR'] = 'white'
+            conf['TEXT_COLOR'] = 'red'
+            conf['CAPTCHA_IMG_FORMAT'] = img_format
+            cap = CAPTCHA(conf)
+            img = Image.open(BytesIO(base64.b64decode(cap.create()['img'])))
+            colors = img.convert('RGB').getcolors(img.width * img.height)
+            # mostly white (lossy formats are a little off), with red text
+            self.assertTrue(all(c >= 240 for c in max(colors)[1]))
+            self.assertTrue(any(r > 200 and g < 60 for _, (r, g, b) in colors))
+
+    def test_compact_token_format(self):
+        conf = DEFAULT_CONFIG.copy()
+        conf['CAPTCHA_TOKEN_FORMAT'] = 'compact'
+        cap = CAPTCHA(conf)
+        result = cap.create()
+        self.assertTrue(is_compact_token(result['hash']))
+        self.assertFalse(cap.verify('wrong', result['hash']))
+        self.assertTrue(cap.verify(result['hash'], result['text']))
+        self.assertFalse(cap.verify(result['text'], result['hash']))
+        # jwt tokens still verify
+        result = self.captcha.create()
+        self.assertTrue(cap.verify(result['text'], result['hash']))
+
+    def test_compact_token_float_expiry(self):
+        cap = CAPTCHA(
+            {'CAPTCHA_TOKEN_FORMAT': 'compact', 'EXPIRE_MINUTES': 0.5}
+        )
+        result = cap.create()
+        exp = token_expiry(result['hash'])
+        self.assertAlmostEqual(exp, time.time() + 30, delta=1)
+        self.assertTrue(cap.verify(result['text'], result['hash']))
+
+    def test_jwt_resubmitted(self):
+        result = self.captcha.create()
+        spellings = last_char_spellings(result['hash'])
+        verified = [
+            self.captcha.verify(result['text'], spelling)
+            for spelling in spellings + [result['hash'] + '=']
+        ]
+        self.assertEqual(verified.count(True), 1)
+
+    def test_compact_token_resubmitted(self):
+        conf = DEFAULT_CONFIG.copy()
+        conf['CAPTCHA_TOKEN_FORMAT'] = 'compact'
+        cap = CAPTCHA(conf)
+        result = cap.create()
+        verified = [
+            cap.verify(result['text'], spelling)
+            for spelling in last_char_spellings(result['hash'])
+        ]
+        self.assertEqual(verified.count(True), 1)
+
     @patch('flask_simple_captcha.captcha_generation.jwtdecrypt')
     def test_decrypt_text_nomatch(self, mock_jwtdecrypt):
         mock_jwtdecrypt.return_value = 'afsddsgfewfewggwegfw'
         conf = DEFAULT_CONFIG.copy()
         cap = CAPTCHA(conf)
-        cap.create()
-        self.assertFalse(cap.verify('test', 'test'))
+        result = cap.create()
+        self.assertFalse(cap.verify(result['text'], result['hash']))
+        mock_jwtdecrypt.assert_called_once_with(
+            result['hash'], result['text'], conf['SECRET_CAPTCHA_KEY']
+        )
 
 
 class TestCaptchaUtils(unittest.TestCase):
@@ -334,6 +853,122 @@ class TestCaptchaUtils(unittest.TestCase):
         hashed_text = hash_text(_TESTTEXT, _TESTKEY)
         self.assertTrue(check_password_hash(hashed_text, _TESTKEY + _TESTTEXT))
 
+    def test_hash_backends(self):
+        for backend in list(HASH_BACKENDS) + ['werkzeug']:
+            hashed = hash_text(_TESTTEXT, _TESTKEY, backend)
+            self.assertTrue(check_hashed_text(hashed, _TESTTEXT, _TESTKEY))
+            self.assertFalse(check_hashed_text(hashed, 'wrong', _TESTKEY))
+            self.assertFalse(check_hashed_text(hashed, _TESTTEXT, 'wrong'))
+
+    def test_hash_backend_tagged(self):
+        hashed = hash_text(_TESTTEXT, _TESTKEY, 'blake2b')
+        self.assertTrue(hashed.startswith('blake2b$'))
+        # per token salt
+        self.assertNotEqual(hashed, hash_text(_TESTTEXT, _TESTKEY, 'blake2b'))
+
+    def test_hash_backend_long_key(self):
+        key = 'k' * 100
+        hashed = hash_text(_TESTTEXT, key, 'blake2b')
+        self.assertTrue(check_hashed_text(hashed, _TESTTEXT, key))
+
+    def test_hash_backend_bad_salt(self):
+        self.assertFalse(check_hashed_text('blake2b$zz$00', _TESTTEXT))
+
+    def test_hash_backend_unknown(self):
+        with self.assertRaises(ValueError):
+            hash_text(_TESTTEXT, _TESTKEY, 'md5')
+
+    def test_hash_backend_cost(self):
+        self.assertGreater(hash_backend_cost('hmac-sha256', rounds=2), 0)
+
+    def test_jwt_hash_backend_rollout(self):
+        # tokens hashed with werkzeug still verify alongside fast ones
+        for backend in ('werkzeug', 'hmac-sha256'):
+            token = jwtencrypt(_TESTTEXT, _TESTKEY, 100, hash_backend=backend)
+            self.assertEqual(jwtdecrypt(token, _TESTTEXT, _TESTKEY), _TESTTEXT)
+            self.assertIsNone(jwtdecrypt(token, 'wrong', _TESTKEY))
+
+    def test_compact_token(self):
+        token = compact_encrypt(_TESTTEXT, _TESTKEY, 100)
+        self.assertEqual(len(token), COMPACT_TOKEN_LEN)
+        self.assertTrue(is_compact_token(token))
+        self.assertEqual(
+            compact_decrypt(token, _TESTTEXT, _TESTKEY), _TESTTEXT
+        )
+        self.assertIsNone(compact_decrypt(token, 'wrong', _TESTKEY))
+        self.assertIsNone(compact_decrypt(token, _TESTTEXT, 'wrong'))
+
+    def test_compact_token_spellings(self):
+        token = compact_encrypt(_TESTTEXT, _TESTKEY, 100)
+        spellings = last_char_spellings(token)
+        self.assertEqual(len(set(spellings)), 4)
+        for spelling in spellings:
+            self.assertEqual(
+                compact_decrypt(spelling, _TESTTEXT, _TESTKEY),
+                _TESTTEXT if spelling == token else None,
+            )
+
+    def test_compact_token_key(self):
+        # the MAC of a compact token is not the hmac-sha256 digest of a JWT
+        # payload whose salt happens to look like a compact header
+        token = compact_encrypt(_TESTTEXT, _TESTKEY, 100)
+        raw = base64.urlsafe_b64decode(token + '=')
+        header = raw[: COMPACT_HEADER.size]
+        digest = HASH_BACKENDS['hmac-sha256'](_TESTKEY, header, _TESTTEXT)
+        mac = bytes.fromhex(digest)[:COMPACT_MAC_BYTES]
+        forged = base64.urlsafe_b64encode(header + mac).rstrip(b'=').decode()
+        self.assertTrue(is_compact_token(forged))
+        self.assertIsNone(compact_decrypt(forged, _TESTTEXT, _TESTKEY))
+
+    def test_compact_token_invalid(self):
+        expired = compact_encrypt(_TESTTEXT, _TESTKEY, -1)
+        self.assertIsNone(compact_decrypt(expired, _TESTTEXT, _TESTKEY))
+        self.assertIsNone(compact_decrypt('short', _TESTTEXT, _TESTKEY))
+        bad_b64 = '*' * COMPACT_TOKEN_LEN
+        self.assertIsNone(compact_decrypt(bad_b64, _TESTTEXT, _TESTKEY))
+        token = compact_encrypt(_TESTTEXT, _TESTKEY, 100)
+        bad_version = 'B' + token[1:]
+        self.assertIsNone(compact_decrypt(bad_version, _TESTTEXT, _TESTKEY))
+        self.assertFalse(is_compact_token(jwtencrypt(_TESTTEXT)))
+
+    def test_token_expiry(self):
+        exp = int(time.time()) + 100
+        for token in (
+            jwtencrypt(_TESTTEXT, _TESTKEY, 100),
+            compact_encrypt(_TESTTEXT, _TESTKEY, 100),
+        ):
+            self.assertAlmostEqual(token_expiry(token), exp, delta=1)
+        self.assertIsNone(token_expiry('a.b.c'))
+        self.assertIsNone(token_expiry('garbage'))
+
+    def test_token_expiry_not_int(self):
+        for exp in ('Infinity', '1e400', 'NaN', '1.5', '"9999999999"'):
+            payload = ('{"exp": %s}' % exp).encode()
+            payload = base64.urlsafe_b64encode(payload).rstrip(b'=').decode()
+            token = 'eyJhbGciOiJIUzI1NiJ9.%s.sig' % payload
+            self.assertIsNone(token_expiry(token), exp)
+            self.assertEqual(token_status(token, _TESTKEY), 'invalid', exp)
+
+    def test_seal_text(self):
+        sealed = seal_text(_TESTTEXT, _TESTKEY, 100)
+        raw = base64.urlsafe_b64decode(sealed + '=' * (-len(sealed) % 4))
+        self.assertNotIn(_TESTTEXT.encode(), raw)
+        self.assertEqual(open_sealed(sealed, _TESTKEY), _TESTTEXT)
+        self.assertIsNone(open_sealed(sealed, 'wrong'))
+        self.assertNotEqual(sealed, seal_text(_TESTTEXT, _TESTKEY, 100))
+        long_text = 'X' * 100
+        sealed = seal_text(long_text, _TESTKEY, 100)
+        self.assertEqual(open_sealed(sealed, _TESTKEY), long_text)
+
+    def test_seal_text_invalid(self):
+        expired = seal_text(_TESTTEXT, _TESTKEY, -1)
+        self.assertIsNone(open_sealed(expired, _TESTKEY))
+        self.assertIsNone(open_sealed('short', _TESTKEY))
+        self.assertIsNone(open_sealed('a', _TESTKEY))
+        sealed = seal_text(_TESTTEXT, _TESTKEY, 100)
+        tampered = sealed[:-3] + ('AAA' if sealed[-3:] != 'AAA' else 'BBB')
+        self.assertIsNone(open_sealed(tampered, _TESTKEY))
+
     @patch('flask_simple_captcha.utils.jwt.decode')
     def test_no_hashed_text(self, mock_jwtdecode):
         mock_jwtdecode.return_value = {'not': 'in'}
@@ -352,6 +987,520 @@ class TestCaptchaUtils(unittest.TestCase):
         self.assertEqual(exchars, ['e'])
 
 
+class TestMemoryReplayStore(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryReplayStore(max_entries=3)
+
+    def test_add_contains(self):
+        self.assertTrue(self.store.add('token'))
+        self.assertFalse(self.store.add('token'))
+        self.assertIn('token', self.store)
+        self.assertNotIn('other', self.store)
+
+    def test_token_spellings(self):
+        for token in (jwtencrypt(_TESTTEXT), compact_encrypt(_TESTTEXT)):
+            digests = {token_digest(t) for t in last_char_spellings(token)}
+            self.assertEqual(digests, {token_digest(token)})
+            self.store.add(token)
+            for spelling in last_char_spellings(token):
+                self.assertIn(spelling, self.store)
+        self.assertNotEqual(
+            token_digest(jwtencrypt(_TESTTEXT)), token_digest(token)
+        )
+
+    def test_expired_swept(self):
+        now = time.time()
+        self.store.add('old', int(now) - 10)
+        self.assertNotIn('old', self.store)
+        self.assertEqual(self.store.sweep(), 1)
+        self.store.add('new', int(now) + 100)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.sweep(now + 1000), 1)
+        self.assertEqual(len(self.store), 0)
+
+    def test_max_entries(self):
+        exp = int(time.time()) + 100
+        for i in range(5):
+            self.store.add('token%d' % i, exp + i)
+        self.assertEqual(len(self.store), 3)
+        # soonest expiring tokens evicted first
+        self.assertNotIn('token0', self.store)
+        self.assertIn('token4', self.store)
+        self.assertEqual(self.store.stats()['evicted'], 2)
+        self.assertEqual(self.store.stats()['entries'], 3)
+
+    def test_clear(self):
+        self.store.add('token')
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertIn('MemoryReplayStore', repr(self.store))
+
+    def test_stripes(self):
+        store = MemoryReplayStore(max_entries=64, stripes=4)
+        for i in range(100):
+            self.assertTrue(store.add('token%d' % i))
+        self.assertFalse(store.add('token99'))
+        self.assertIn('token99', store)
+        self.assertLessEqual(len(store), 64)
+        self.assertEqual(store.stats()['evicted'], 100 - len(store))
+        self.assertEqual(store.stats()['stripes'], 4)
+        entries = len(store)
+        self.assertEqual(store.sweep(time.time() + 10**6), entries)
+
+
+class TestSQLiteReplayStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'replay.db')
+        self.store = SQLiteReplayStore(self.path, sweep_every=2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_add_contains(self):
+        self.assertTrue(self.store.add('token'))
+        self.assertFalse(self.store.add('token'))
+        self.assertIn('token', self.store)
+        self.assertNotIn('other', self.store)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.stats(), {'entries': 1})
+
+    def test_shared_between_stores(self):
+        # e.g. two gunicorn workers on the same host
+        other = SQLiteReplayStore(self.path)
+        self.assertTrue(self.store.add('token'))
+        self.assertIn('token', other)
+        self.assertFalse(other.add('token'))
+
+    def test_sweep(self):
+        now = int(time.time())
+        self.store.add('old', now - 10)
+        self.assertNotIn('old', self.store)
+        # batched sweep on every 2nd insert
+        self.store.add('new', now + 100)
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(self.store.sweep(now + 1000), 1)
+
+    def test_clear(self):
+        self.store.add('token')
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
+        self.assertIn(self.path, repr(self.store))
+
+    def test_captcha_replay_store(self):
+        conf = DEFAULT_CONFIG.copy()
+        conf['REPLAY_STORE'] = self.store
+        cap, other_cap = CAPTCHA(conf), CAPTCHA(conf)
+        self.assertIs(cap.verified_captchas, self.store)
+
+        result = cap.create()
+        self.assertTrue(cap.verify(result['text'], result['hash']))
+        self.assertFalse(other_cap.verify(result['text'], result['hash']))
+
+    def test_base_interface(self):
+        class Partial(BaseReplayStore):
+            def add(self, token, exp=None):
+                return True
+
+        # incomplete stores fail when constructed, not on the first verify
+        for cls in (BaseReplayStore, Partial):
+            with self.assertRaises(TypeError):
+                cls()
+
+        class Complete(Partial):
+            __contains__ = __len__ = clear = lambda *args: 0
+
+        store = Complete()
+        self.assertEqual(store.sweep(), 0)
+        self.assertEqual(store.stats(), {'entries': 0})
+
+
+class TestLazyImages(unittest.TestCase):
+    def setUp(self):
+        conf = DEFAULT_CONFIG.copy()
+        conf['LAZY_IMG_ROUTE'] = '/captcha/'
+        self.cap = CAPTCHA(conf)
+        self.app = self.cap.init_app(Flask(__name__))
+        self.client = self.app.test_client()
+
+    def test_float_expiry(self):
+        cap = CAPTCHA({'LAZY_IMG_ROUTE': '/captcha/', 'EXPIRE_MINUTES': 0.5})
+        self.assertEqual(cap.expire_secs, 30.0)
+        captcha = cap.create()
+        self.assertEqual(open_sealed(captcha['sealed']), captcha['text'])
+        self.assertTrue(cap.verify(captcha['text'], captcha['hash']))
+
+    def test_create_lazy(self):
+        with patch.object(self.cap, 'render_image') as render_image:
+            result = self.cap.create()
+            render_image.assert_not_called()
+        self.assertIsNone(result['img'])
+        self.assertTrue(result['img_url'].startswith('/captcha/'))
+        self.assertTrue(result['img_url'].endswith('.jpg'))
+        self.assertTrue(self.cap.verify(result['text'], result['hash']))
+
+        html = self.cap.captcha_html(result)
+        self.assertIn('src="%s"' % result['img_url'], html)
+        self.assertIn(result['hash'], html)
+
+    def test_image_route(self):
+        result = self.cap.create()
+        resp = self.client.get(result['img_url'])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'image/jpeg')
+        self.assertIn('no-store', resp.headers['Cache-Control'])
+        img = Image.open(BytesIO(resp.data))
+        self.assertEqual(img.format, 'JPEG')
+        self.assertEqual(img.size, (180, 60))
+
+    def test_image_route_invalid(self):
+        result = self.cap.create()
+        self.assertEqual(self.client.get('/captcha/abc.jpg').status_code, 404)
+        png_url = result['img_url'][:-3] + 'png'
+        self.assertEqual(self.client.get(png_url).status_code, 404)
+
+    def test_no_route_by_default(self):
+        app = CAPTCHA(DEFAULT_CONFIG.copy()).init_app(Flask(__name__))
+        self.assertEqual(app.blueprints, {})
+
+    def test_script_name(self):
+        result = self.cap.create()
+        base_url = 'http://localhost/prefix'
+        with self.app.test_request_context('/', base_url=base_url):
+            html = self.cap.captcha_html(result)
+            self.assertIn(
+                'src="/prefix/captcha/%s.jpg"' % result['sealed'], html
+            )
+            url = self.cap.create()['img_url']
+            self.assertTrue(url.startswith('/prefix/captcha/'))
+        resp = self.client.get(url[len('/prefix') :], base_url=base_url)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_two_instances(self):
+        other = CAPTCHA({**self.cap.config, 'LAZY_IMG_ROUTE': '/other'})
+        other.init_app(self.app)
+        self.assertEqual(
+            set(self.app.blueprints),
+            {'simple_captcha_captcha', 'simple_captcha_other'},
+        )
+        with self.app.test_request_context('/'):
+            url = other.create()['img_url']
+            self.assertTrue(url.startswith('/other/'))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_image_route_same_image(self):
+        url = self.cap.create()['img_url']
+        self.assertEqual(self.client.get(url).data, self.client.get(url).data)
+        other = self.cap.create()['img_url']
+        self.assertNotEqual(
+            self.client.get(url).data, self.client.get(other).data
+        )
+
+
+class TestCreateMany(unittest.TestCase):
+    def setUp(self):
+        self.cap = CAPTCHA(DEFAULT_CONFIG.copy())
+
+    def tearDown(self):
+        self.cap.close_workers()
+
+    def test_create_many_inline(self):
+        results = self.cap.create_many(3, workers=1)
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertTrue(self.cap.verify(result['text'], result['hash']))
+        rendered = self.cap.render_many(2, workers=1)
+        self.assertEqual([set(r) for r in rendered], [{'img', 'text'}] * 2)
+
+    def test_create_many_workers(self):
+        results = self.cap.create_many(10, workers=2)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len({r['hash'] for r in results}), 10)
+        for result in results:
+            self.assertTrue(self.cap.verify(result['text'], result['hash']))
+
+        # worker pool is kept between calls
+        batch = self.cap._batch
+        self.assertEqual(len(self.cap.render_many(3, workers=2)), 3)
+        self.assertIs(self.cap._batch, batch)
+        self.assertIn('2 workers', repr(batch))
+
+        self.cap.create_many(1, workers=3)
+        self.assertIsNot(self.cap._batch, batch)
+
+    def test_worker_config(self):
+        conf = DEFAULT_CONFIG.copy()
+        conf['REPLAY_STORE'] = MemoryReplayStore()
+        conf['POOL_SIZE'] = 10
+        wconf = worker_config(conf)
+        self.assertNotIn('REPLAY_STORE', wconf)
+        self.assertEqual(wconf['POOL_SIZE'], 0)
+
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.conf = DEFAULT_CONFIG.copy()
+
+    def roundtrip(self, cap):
+        async def main():
+            result = await cap.acreate()
+            valid = await cap.averify(result['hash'], result['text'])
+            replay = await cap.averify(result['text'], result['hash'])
+            wrong = await cap.averify('wrong', (await cap.acreate())['hash'])
+            return valid, replay, wrong
+
+        try:
+            return asyncio.run(main())
+        finally:
+            cap.close_workers()
+
+    def test_thread_executor(self):
+        cap = CAPTCHA(self.conf)
+        self.assertEqual(self.roundtrip(cap), (True, False, False))
+
+    def test_process_executor(self):
+        self.conf['ASYNC_EXECUTOR'] = 'process'
+        self.conf['ASYNC_WORKERS'] = 1
+        cap = CAPTCHA(self.conf)
+        self.assertEqual(self.roundtrip(cap), (True, False, False))
+
+    def test_metrics(self):
+        self.conf['METRICS'] = True
+        for kind in ('thread', 'process'):
+            self.conf['ASYNC_EXECUTOR'] = kind
+            self.conf['ASYNC_WORKERS'] = 1
+            cap = CAPTCHA(self.conf)
+            self.assertEqual(self.roundtrip(cap), (True, False, False))
+            outcomes = cap.metrics.outcomes()
+            self.assertEqual(outcomes['create']['rendered']['count'], 2)
+            verify = outcomes['verify']
+            self.assertEqual(verify['valid']['count'], 1)
+            self.assertEqual(verify['replay']['count'], 1)
+            self.assertEqual(sum(h['count'] for h in verify.values()), 3)
+            self.assertEqual(cap.stats()['verify']['check']['count'], 1)
+
+    def test_custom_executor(self):
+        with ThreadPoolExecutor(1) as executor:
+            self.conf['ASYNC_EXECUTOR'] = executor
+            cap = CAPTCHA(self.conf)
+            self.assertEqual(self.roundtrip(cap), (True, False, False))
+            self.assertIs(cap.executor, executor)
+        with ProcessPoolExecutor(1) as executor:
+            self.conf['ASYNC_EXECUTOR'] = executor
+            with self.assertRaises(ValueError):
+                CAPTCHA(self.conf)
+
+    def test_pool(self):
+        self.conf['POOL_SIZE'] = 1
+        cap = CAPTCHA(self.conf)
+        with patch.object(cap.pool, 'start'):
+            cap.pool.fill()
+            self.assertEqual(self.roundtrip(cap), (True, False, False))
+        self.assertEqual(len(cap.pool), 0)
+
+    def test_concurrency_limit(self):
+        self.conf['ASYNC_CONCURRENCY'] = 2
+        cap = CAPTCHA(self.conf)
+        running, peak = [0], [0]
+        token = cap.encrypt('ABCDEF')
+
+        def check(c_text, c_hash):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            running[0] -= 1
+            return False
+
+        async def main():
+            await asyncio.gather(
+                *(cap.averify('ABCDEF', token) for _ in range(8))
+            )
+
+        with patch.object(cap, 'check', check):
+            asyncio.run(main())
+        cap.close_workers()
+        self.assertEqual(peak[0], 2)
+
+    def test_cancel(self):
+        self.conf['ASYNC_CONCURRENCY'] = 1
+        cap = CAPTCHA(self.conf)
+
+        async def main():
+            first = asyncio.ensure_future(cap.acreate())
+            second = asyncio.ensure_future(cap.acreate())
+            await asyncio.sleep(0)
+            second.cancel()
+            await first
+            with self.assertRaises(asyncio.CancelledError):
+                await second
+            # the semaphore was released by the cancelled call
+            return await cap.acreate()
+
+        self.assertIn('hash', asyncio.run(main()))
+        cap.close_workers()
+
+
+class TestCaptchaPool(unittest.TestCase):
+    def setUp(self):
+        self.conf = DEFAULT_CONFIG.copy()
+        self.conf['POOL_SIZE'] = 4
+        self.conf['POOL_LOW_WATERMARK'] = 2
+        self.cap = CAPTCHA(self.conf)
+        self.pool = self.cap.pool
+        # no refill thread unless a test starts it
+        self.start_patch = patch.object(self.pool, 'start')
+        self.start_patch.start()
+
+    def tearDown(self):
+        patch.stopall()
+        self.pool.stop(timeout=5)
+
+    def age_items(self, secs):
+        self.pool._items = deque(
+            (created - secs, item) for created, item in self.pool._items
+        )
+
+    def test_fill(self):
+        self.assertEqual(self.pool.fill(), 4)
+        self.assertEqual(self.pool.fill(2), 2)
+        self.assertEqual(len(self.pool), 6)
+        self.assertIn('CaptchaPool', repr(self.pool))
+        self.pool.stop()
+        self.assertEqual(self.pool.fill(2), 0)
+
+    def test_create_from_pool(self):
+        self.pool.fill()
+        result = self.cap.create()
+        self.assertEqual(len(self.pool), 3)
+        self.assertEqual(set(result), {'img', 'text', 'hash'})
+        self.assertTrue(self.cap.verify(result['text'], result['hash']))
+
+    def test_expiry_set_on_get(self):
+        self.pool.fill(1)
+        self.age_items(100)
+        exp = token_expiry(self.pool.get()['hash'])
+        self.assertAlmostEqual(
+            exp, time.time() + self.cap.expire_secs, delta=2
+        )
+
+    def test_max_age(self):
+        self.pool.fill(2)
+        self.age_items(self.pool.max_age + 1)
+        self.assertIsNone(self.pool.get())
+        self.assertEqual(len(self.pool), 0)
+
+    def test_empty_pool_falls_back(self):
+        result = self.cap.create()
+        self.assertTrue(self.cap.verify(result['text'], result['hash']))
+        # custom lengths bypass the pool
+        self.pool.fill()
+        self.assertEqual(len(self.cap.create(length=3)['text']), 3)
+        self.assertEqual(len(self.pool), 4)
+
+    def wait_for_pool(self, size):
+        deadline = time.time() + 30
+        while len(self.pool) < size and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.pool), size)
+
+    def test_background_refill(self):
+        self.start_patch.stop()
+        self.pool.start()
+        self.wait_for_pool(4)
+        self.pool.start()  # already running
+
+        # no refill until below the low watermark
+        self.assertIsNotNone(self.pool.get())
+        self.assertIsNotNone(self.pool.get())
+        time.sleep(0.05)
+        self.assertEqual(len(self.pool), 2)
+        self.assertIsNotNone(self.pool.get())
+        self.wait_for_pool(4)
+
+    def test_fill_with_workers(self):
+        self.pool.workers = 2
+        with patch.object(self.cap, 'render_many') as render_many:
+            render_many.side_effect = lambda n, w: [{'text': 'A'}] * n
+            self.assertEqual(self.pool.fill(), 4)
+            render_many.assert_called_once_with(4, 2)
+
+    def test_no_pool_by_default(self):
+        self.assertIsNone(CAPTCHA(DEFAULT_CONFIG.copy()).pool)
+
+
+class TestSQLiteCaptchaPool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.conf = {
+            'POOL_SIZE': 4,
+            'POOL_PATH': os.path.join(self.tmpdir.name, 'pool.db'),
+            'CAPTCHA_HASH_BACKEND': 'blake2b',
+        }
+        self.cap = CAPTCHA(self.conf)
+        self.pool = self.cap.pool
+        patch.object(self.pool, 'start').start()
+
+    def tearDown(self):
+        patch.stopall()
+        self.tmpdir.cleanup()
+
+    def test_survives_restart(self):
+        self.assertIsInstance(self.pool, SQLiteCaptchaPool)
+        self.assertEqual(self.pool.fill(), 4)
+        # a new instance, e.g. after a restart, finds them
+        cap = CAPTCHA(self.conf)
+        patch.object(cap.pool, 'start').start()
+        self.assertEqual(len(cap.pool), 4)
+        result = cap.create()
+        self.assertEqual(set(result), {'img', 'text', 'hash'})
+        self.assertTrue(cap.verify(result['text'], result['hash']))
+        self.assertTrue(Image.open(BytesIO(base64.b64decode(result['img']))))
+        self.assertEqual(len(self.pool), 3)
+        self.assertIn('SQLiteCaptchaPool', repr(self.pool))
+
+    def test_no_plain_text(self):
+        item = self.cap.render()
+        self.pool._put([item])
+        with open(self.conf['POOL_PATH'], 'rb') as f:
+            data = f.read()
+        with open(self.conf['POOL_PATH'] + '-wal', 'rb') as f:
+            data += f.read()
+        self.assertNotIn(item['text'].encode(), data)
+
+    def test_tampered_or_other_key(self):
+        self.pool.fill(2)
+        self.pool._conn().execute(
+            "UPDATE pool SET sealed = 'AAAA' || sealed "
+            'WHERE id = (SELECT MIN(id) FROM pool)'
+        )
+        self.assertIsNotNone(self.pool.get())
+        self.assertIsNone(self.pool.get())
+
+        self.pool.fill(1)
+        other = CAPTCHA({**self.conf, 'SECRET_CAPTCHA_KEY': 'other' * 8})
+        patch.object(other.pool, 'start').start()
+        self.assertIsNone(other.pool.get())
+
+    def test_expiry(self):
+        self.pool.fill(2)
+        self.assertEqual(self.pool.sweep(), 0)
+        with patch('time.time', return_value=time.time() + 1000):
+            self.assertEqual(len(self.pool), 0)
+            self.assertIsNone(self.pool.get())
+            self.assertEqual(self.pool.sweep(), 2)
+        self.pool.fill(1)
+        self.pool.clear()
+        self.assertEqual(len(self.pool), 0)
+
+    def test_claimed_once(self):
+        self.pool.fill(8)
+        with ThreadPoolExecutor(8) as executor:
+            items = list(executor.map(lambda _: self.pool.get(), range(10)))
+        hashes = [item['hash'] for item in items if item is not None]
+        self.assertEqual(len(hashes), 8)
+        self.assertEqual(len(set(hashes)), 8)
+
+
 class TestText(unittest.TestCase):
     def setUp(self):
         self.fonts = CAPTCHA_FONTS
@@ -387,6 +1536,503 @@ class TestText(unittest.TestCase):
         self.assertEqual(cap.fonts[0].name, 'RobotoMono-Bold')
 
 
+class TestFontCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = FontCache(maxsize=2)
+        self.font = CAPTCHA_FONTS[0]
+
+    def test_same_font_object(self):
+        fnt = self.cache.get(self.font, 30)
+        self.assertIs(fnt, self.cache.get(self.font.path, 30))
+        self.assertIsNot(fnt, self.cache.get(self.font, 31))
+
+    def test_font_bytes_read_once(self):
+        with patch('builtins.open', wraps=open) as mock_open:
+            for size in (20, 21, 22, 20):
+                self.cache.get(self.font, size)
+            mock_open.assert_called_once_with(self.font.path, 'rb')
+
+    def test_eviction(self):
+        for size in (20, 21, 22):
+            self.cache.get(self.font, size)
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn((self.font.path, 20), self.cache._fonts)
+
+    def test_clear(self):
+        self.cache.get(self.font, 20)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_load_font(self):
+        self.assertIs(load_font(self.font, 30), self.font.truetype(30))
+
+
+class TestMetrics(unittest.TestCase):
+    def test_stage_timer(self):
+        timer = StageTimer()
+        timer.mark('a')
+        timer.mark('b')
+        timer.mark('a')
+        self.assertEqual(set(timer.stages), {'a', 'b'})
+        self.assertTrue(all(v >= 0 for v in timer.stages.values()))
+
+    def test_histogram(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 4)
+        self.assertAlmostEqual(snapshot['sum'], 2.65)
+        self.assertEqual(snapshot['buckets'], {'0.1': 2, '1.0': 3, '+Inf': 4})
+
+    def test_collector(self):
+        collector = StatsCollector()
+        collector('create', {'draw': 0.001, 'encode': 0.002})
+        collector('create', {'draw': 0.003, 'encode': 0.004})
+        stats = collector.stats()
+        self.assertEqual(set(stats['create']), {'draw', 'encode', 'total'})
+        self.assertEqual(stats['create']['total']['count'], 2)
+        self.assertAlmostEqual(stats['create']['total']['sum'], 0.01)
+        collector.reset()
+        self.assertEqual(collector.stats(), {})
+
+    def test_exited_threads(self):
+        collector = StatsCollector()
+        for _ in range(50):
+            thread = threading.Thread(
+                target=collector, args=('verify', {'check': 0.001}, 'valid')
+            )
+            thread.start()
+            thread.join()
+        collector('verify', {'check': 0.001}, 'valid')
+        # one live shard, the exited threads' histograms are merged
+        self.assertEqual(len(collector._shards), 1)
+        self.assertEqual(collector.outcomes()['verify']['valid']['count'], 51)
+        collector.reset()
+        self.assertEqual(collector.stats(), {})
+
+    def test_captcha_stages(self):
+        cap = CAPTCHA({'CAPTCHA_HASH_BACKEND': 'blake2b', 'METRICS': True})
+        self.assertIsInstance(cap.metrics, StatsCollector)
+        c = cap.create()
+        self.assertTrue(cap.verify(c['text'], c['hash']))
+        self.assertFalse(cap.verify(c['text'], c['hash']))
+
+        stats = cap.stats()
+        self.assertEqual(
+            set(stats['create']),
+            {
+                'text',
+                'font',
+                'draw',
+                'noise',
+                'resize',
+                'encode',
+                'base64',
+                'token',
+                'total',
+            },
+        )
+        self.assertEqual(stats['verify']['total']['count'], 2)
+        self.assertEqual(stats['verify']['replay_check']['count'], 2)
+        self.assertEqual(stats['verify']['replay_add']['count'], 1)
+
+    def test_callable_hook(self):
+        calls = []
+        cap = CAPTCHA(
+            {
+                'METRICS': lambda *args: calls.append(args),
+                'LAZY_IMG_ROUTE': '/c',
+            }
+        )
+        cap.create()
+        ((operation, stages, outcome),) = calls
+        self.assertEqual(operation, 'create')
+        self.assertEqual(outcome, 'lazy')
+        self.assertEqual(set(stages), {'text', 'seal', 'token'})
+        self.assertEqual(cap.stats(), {})
+
+    def test_disabled(self):
+        cap = CAPTCHA({'CAPTCHA_HASH_BACKEND': 'blake2b'})
+        with patch('flask_simple_captcha.captcha_generation.StageTimer') as t:
+            c = cap.create()
+            cap.verify(c['text'], c['hash'])
+            t.assert_not_called()
+        self.assertEqual(cap.stats(), {})
+
+
+class TestVerifyOutcomes(unittest.TestCase):
+    def setUp(self):
+        self.config = {
+            **DEFAULT_CONFIG,
+            'CAPTCHA_HASH_BACKEND': 'blake2b',
+            'METRICS_ROUTE': '/metrics',
+            'ANSWER_LENGTHS': (6,),
+        }
+
+    def outcomes(self, cap):
+        return {
+            outcome: histogram['count']
+            for outcome, histogram in cap.metrics.outcomes()['verify'].items()
+        }
+
+    def check_outcomes(self, cap):
+        c = cap.create()
+        wrong = ('B' if c['text'][0] == 'A' else 'A') + c['text'][1:]
+        cap.verify(wrong, c['hash'])
+        cap.verify(c['text'] + 'A', c['hash'])
+        cap.verify('!' + c['text'][1:], c['hash'])
+        cap.verify(c['hash'], c['text'])
+        cap.verify(c['text'], c['hash'])
+        cap.verify(c['text'], 'not.a.token')
+        cap.verify(c['text'], None)
+
+        expired = CAPTCHA({**cap.config, 'EXPIRE_NORMALIZED': -10})
+        cap.verify('ABC', expired.encrypt('ABC'))
+
+        self.assertEqual(
+            self.outcomes(cap),
+            {
+                'mismatch': 1,
+                'wrong_length': 1,
+                'wrong_chars': 1,
+                'valid': 1,
+                'replay': 1,
+                'invalid': 2,
+                'expired': 1,
+            },
+        )
+        self.assertEqual(cap.stats()['verify']['swap']['count'], 1)
+
+    def test_jwt_outcomes(self):
+        cap = CAPTCHA(self.config)
+        self.assertIsInstance(cap.metrics, StatsCollector)
+        self.check_outcomes(cap)
+
+        c = cap.create()
+        forged = jwtencrypt(c['text'], 'other key', hash_backend='blake2b')
+        cap.verify(c['text'], forged)
+        self.assertEqual(self.outcomes(cap)['invalid'], 3)
+
+    def test_compact_outcomes(self):
+        cap = CAPTCHA({**self.config, 'CAPTCHA_TOKEN_FORMAT': 'compact'})
+        self.check_outcomes(cap)
+
+    def test_precheck(self):
+        cap = CAPTCHA(self.config)
+        c = cap.create()
+        self.assertIsNone(cap.precheck(c['text'].lower(), c['hash']))
+        self.assertEqual(cap.precheck(c['text'], 'A' * 2000), 'invalid')
+        self.assertEqual(cap.precheck(c['text'], 'A.B.C'), 'invalid')
+        self.assertEqual(cap.precheck('', c['hash']), 'wrong_length')
+        self.assertEqual(cap.precheck('ABCDE!', c['hash']), 'wrong_chars')
+        infinity = base64.urlsafe_b64encode(b'{"exp": Infinity}').decode()
+        forged = 'eyJhbGciOiJIUzI1NiJ9.%s.sig' % infinity.rstrip('=')
+        self.assertEqual(cap.precheck(c['text'], forged), 'invalid')
+        self.assertFalse(cap.verify(c['text'], forged))
+
+        # missing form fields (request.form.get() gives None)
+        for c_text, c_hash in (
+            (c['text'], None),
+            (None, c['hash']),
+            (None, None),
+            (c['text'], b'a.b.c'),
+        ):
+            self.assertEqual(cap.precheck(c_text, c_hash), 'invalid')
+            self.assertFalse(cap.verify(c_text, c_hash))
+
+        # rejected without touching the token's signature or the store
+        with patch.object(cap, 'check', side_effect=AssertionError):
+            self.assertFalse(cap.verify('ABC', c['hash']))
+        self.assertTrue(cap.verify(c['text'], c['hash']))
+
+    def test_answer_lengths(self):
+        config = {**self.config, 'ANSWER_LENGTHS': None}
+        cap = CAPTCHA(config)
+        self.assertIsNone(cap.answer_lengths)
+        c = cap.create(length=8)
+        self.assertIsNone(cap.answer_lengths)
+
+        # any instance verifies any length unless ANSWER_LENGTHS is set
+        self.assertTrue(CAPTCHA(config).verify(c['text'], c['hash']))
+        c = cap.create(length=8)
+        other = CAPTCHA({**config, 'ANSWER_LENGTHS': (6, 8)})
+        self.assertEqual(other.answer_lengths, {6, 8})
+        self.assertEqual(
+            other.precheck(c['text'] + 'A', c['hash']), 'wrong_length'
+        )
+        self.assertTrue(other.verify(c['text'], c['hash']))
+
+    def test_create_outcomes(self):
+        cap = CAPTCHA(self.config)
+        cap.create()
+        outcomes = cap.metrics.outcomes()['create']
+        self.assertEqual(outcomes['rendered']['count'], 1)
+
+    def test_threads(self):
+        cap = CAPTCHA(self.config)
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: cap.verify('A', 'B.C.D'), range(100)))
+        self.assertEqual(self.outcomes(cap), {'invalid': 100})
+        cap.metrics.reset()
+        self.assertEqual(cap.stats(), {})
+
+    def test_metrics_route(self):
+        cap = CAPTCHA(self.config)
+        app = cap.init_app(Flask(__name__))
+        c = cap.create()
+        cap.verify(c['text'], c['hash'])
+
+        resp = app.test_client().get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.mimetype.startswith('text/plain'))
+        body = resp.get_data(as_text=True)
+        self.assertIn(
+            'flask_simple_captcha_operations_total'
+            '{operation="verify",outcome="valid"} 1',
+            body,
+        )
+        self.assertIn('flask_simple_captcha_replay_store_entries 1', body)
+        self.assertIn(
+            'flask_simple_captcha_duration_seconds_bucket'
+            '{operation="verify",outcome="valid",le="+Inf"} 1',
+            body,
+        )
+        self.assertIn(
+            'flask_simple_captcha_stage_seconds_count'
+            '{operation="create",stage="encode"} 1',
+            body,
+        )
+
+    def test_metrics_route_without_collector(self):
+        cap = CAPTCHA({**self.config, 'METRICS': lambda *args: None})
+        app = cap.init_app(Flask(__name__))
+        self.assertEqual(app.test_client().get('/metrics').status_code, 404)
+
+
+class TestLazyImports(unittest.TestCase):
+    HEAVY = ('PIL', 'jwt', 'werkzeug', 'asyncio', 'flask_simple_captcha.img')
+
+    def loaded(self, code):
+        code += '\nimport sys\nprint(" ".join(sorted(sys.modules)))'
+        out = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+        return set(out.split())
+
+    def test_import(self):
+        modules = self.loaded('import flask_simple_captcha')
+        self.assertFalse(modules & set(self.HEAVY))
+
+    def test_verify_only(self):
+        modules = self.loaded(
+            'from flask_simple_captcha import CAPTCHA\n'
+            "cap = CAPTCHA({'CAPTCHA_TOKEN_FORMAT': 'compact'})\n"
+            "assert cap.verify('ABC', cap.encrypt('ABC'))"
+        )
+        self.assertFalse(modules & set(self.HEAVY))
+
+    def test_first_render(self):
+        cap = CAPTCHA({'USE_TEXT_FONTS': ['RobotoMono-Bold']})
+        self.assertIsNone(cap._fonts)
+        self.assertEqual([f.name for f in cap.fonts], ['RobotoMono-Bold'])
+        self.assertEqual(cap.img_mode, 'L')
+        self.assertIn('img', cap.create())
+
+    def test_module_attributes(self):
+        import flask_simple_captcha.captcha_generation as cg
+        import flask_simple_captcha.text as text
+        import flask_simple_captcha.utils as utils
+
+        self.assertIs(utils.jwt, jwt)
+        self.assertIs(cg.new_draw_lines, draw_lines)
+        self.assertEqual([f.path for f in text.CAPTCHA_FONTS], text.FONT_PATHS)
+        with self.assertRaises(AttributeError):
+            text.NOPE
+
+
+class TestRandom(unittest.TestCase):
+    def test_charset_uniform(self):
+        charset = Charset('ABC')
+        # 255 is rejected, the rest maps to 85 of each character
+        picked = charset.decode(bytes(range(256)))
+        self.assertEqual(len(picked), 255)
+        self.assertEqual(
+            {c: picked.count(c) for c in 'ABC'}, dict.fromkeys('ABC', 85)
+        )
+
+    def test_charset_unicode(self):
+        charset = Charset('\u0416\u0444')
+        self.assertEqual(
+            charset.decode(bytes([0, 1, 2])), '\u0416\u0444\u0416'
+        )
+
+    def test_charset_size(self):
+        with self.assertRaises(ValueError):
+            Charset('')
+        self.assertEqual(len(Charset('AB')), 2)
+
+    def test_text(self):
+        rng = CaptchaRandom()
+        texts = {rng.text(16, 'ABCDEFGH') for _ in range(1000)}
+        self.assertEqual(len(texts), 1000)
+        self.assertTrue(
+            all(len(t) == 16 and set(t) <= set('ABCDEFGH') for t in texts)
+        )
+        self.assertNotEqual(rng.entropy(16), rng.entropy(16))
+        self.assertIs(rng.charset('AB'), rng.charset('AB'))
+
+    def test_seed(self):
+        a, b = CaptchaRandom(1), CaptchaRandom(1)
+        self.assertEqual(a.text(10, 'ABCDEF'), b.text(10, 'ABCDEF'))
+        self.assertEqual(a.layout.random(), b.layout.random())
+        self.assertNotEqual(
+            CaptchaRandom(2).text(10, 'ABCDEF'),
+            CaptchaRandom(3).text(10, 'ABCDEF'),
+        )
+
+    def test_seeded_captcha(self):
+        config = {'RANDOM_SEED': 7, 'CAPTCHA_HASH_BACKEND': 'blake2b'}
+        a, b = CAPTCHA(config), CAPTCHA(config)
+        self.assertEqual(a.render(), b.render())
+        self.assertEqual(a.gen_text(digits=True), b.gen_text(digits=True))
+        self.assertNotIn('RANDOM_SEED', worker_config(a.config))
+
+    def test_create_text_img_rng(self):
+        path = CAPTCHA_FONTS[0].path
+        imgs = [
+            create_text_img('ABC', path, pixel_noise=0.1, rng=Random(5))
+            for _ in range(2)
+        ]
+        self.assertEqual(imgs[0].tobytes(), imgs[1].tobytes())
+
+    def test_token_layout(self):
+        self.assertEqual(
+            token_layout('key', 'token').random(),
+            token_layout('key', 'token').random(),
+        )
+        self.assertNotEqual(
+            token_layout('key', 'token').random(),
+            token_layout('other', 'token').random(),
+        )
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_fork(self):
+        rng = CaptchaRandom()
+        rng.entropy(1)
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(w, rng.entropy(16))
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertNotEqual(os.read(r, 16), rng.entropy(16))
+
+
+class TestThreads(unittest.TestCase):
+    def setUp(self):
+        self.captcha = CAPTCHA({'CAPTCHA_TOKEN_FORMAT': 'compact'})
+
+    def run_threads(self, func, n=16):
+        barrier = threading.Barrier(n)
+
+        def run():
+            barrier.wait()
+            return func()
+
+        with ThreadPoolExecutor(n) as executor:
+            return list(executor.map(lambda _: run(), range(n)))
+
+    def test_verify_once(self):
+        text = self.captcha.gen_text()
+        token = self.captcha.encrypt(text)
+        results = self.run_threads(lambda: self.captcha.verify(text, token))
+        self.assertEqual(results.count(True), 1)
+
+    def test_create_verify(self):
+        def create_verify():
+            c = self.captcha.create()
+            return self.captcha.verify(c['text'], c['hash']), c['text']
+
+        results = self.run_threads(create_verify)
+        self.assertTrue(all(valid for valid, _ in results))
+        self.assertEqual(len({text for _, text in results}), 16)
+
+    def test_random_per_thread(self):
+        rng = CaptchaRandom(3)
+        layouts = self.run_threads(rng.layout.random, n=4)
+        self.assertEqual(len(set(layouts)), 4)
+        texts = self.run_threads(lambda: rng.text(16, 'ABCDEF'), n=4)
+        self.assertEqual(len(set(texts)), 4)
+
+
+class TestBenchmarks(unittest.TestCase):
+    def results(self, median_us=100.0, peak=10000, per_sec=50.0):
+        return {
+            'environment': {'cpu_count': 2},
+            'benchmarks': {
+                'b': {'median_us': median_us, 'peak_alloc_bytes': peak}
+            },
+            'scaling': [{'workers': 2, 'per_sec': per_sec}],
+            'threads': [{'threads': 2, 'per_sec': per_sec * 10}],
+        }
+
+    def test_compare(self):
+        base = self.results()
+        self.assertEqual(benchmarks.compare(base, self.results(120.0)), [])
+        self.assertEqual(len(benchmarks.compare(base, self.results(130.0))), 1)
+        self.assertEqual(
+            len(benchmarks.compare(base, self.results(peak=20000))), 1
+        )
+        self.assertEqual(
+            len(benchmarks.compare(base, self.results(per_sec=10.0))), 2
+        )
+        self.assertEqual(
+            benchmarks.compare(base, self.results(130.0), 0.5), []
+        )
+
+    def test_run(self):
+        results = benchmarks.run_benchmarks(
+            ['utils.gen_captcha_text'], min_time=0.001, rounds=2
+        )
+        result = results['utils.gen_captcha_text']
+        self.assertGreater(result['median_us'], 0)
+        self.assertGreater(result['peak_alloc_bytes'], 0)
+
+
+class TestLoadTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 50), 50)
+        self.assertEqual(loadtest.percentile(values, 99), 99)
+        self.assertEqual(loadtest.percentile([3.0], 95), 3.0)
+        self.assertEqual(loadtest.percentile([], 50), 0.0)
+
+    def test_run_load(self):
+        config = {
+            'CAPTCHA_TOKEN_FORMAT': 'compact',
+            'LAZY_IMG_ROUTE': '/captcha',
+        }
+        report = loadtest.run_load(config, concurrency=2, duration=0.5)
+        requests = report['requests']
+        self.assertEqual(
+            set(requests),
+            {'GET form', 'GET image'}
+            | {'POST ' + s for s in loadtest.SCENARIOS},
+        )
+        self.assertEqual(sum(r['failures'] for r in requests.values()), 0)
+        self.assertGreater(requests['GET image']['mean_bytes'], 0)
+        self.assertGreaterEqual(len(report['rss']), 2)
+
+    def test_unknown_scenario(self):
+        with patch('sys.stderr'), self.assertRaises(SystemExit):
+            loadtest.main(['-s', 'valid,bogus'])
+
+
 class TestBackwardsCompatibleMethods(unittest.TestCase):
     def setUp(self):
         self.config = DEFAULT_CONFIG